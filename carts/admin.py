@@ -1,5 +1,6 @@
 from django.contrib import admin
-from .models import Cart, CartItem
+from store.pagination import EstimatedCountPaginator
+from .models import Cart, CartItem, Promotion
 
 
 class CartAdmin(admin.ModelAdmin):
@@ -8,8 +9,13 @@ class CartAdmin(admin.ModelAdmin):
 
     Attributes:
       list_display (tuple): Specifies the fields to be displayed as columns in the Cart model list.
+      search_fields (tuple): Specifies the fields searched from the Cart model list.
+      paginator (class): Counts the whole table from its statistics (see store.pagination).
   """
   list_display = ('cart_id', 'date_added')
+  search_fields = ('cart_id',)
+  paginator = EstimatedCountPaginator
+  show_full_result_count = False
 
 
 class CartItemAdmin(admin.ModelAdmin):
@@ -18,9 +24,34 @@ class CartItemAdmin(admin.ModelAdmin):
 
     Attributes:
       list_display (tuple): Specifies the fields to be displayed as columns in the CartItem model list.
+      list_select_related (tuple): Specifies the foreign keys joined to the CartItem model list query.
+      raw_id_fields (tuple): Specifies the foreign keys entered by ID instead of a select of every row.
+      paginator (class): Counts the whole table from its statistics (see store.pagination).
   """
   list_display = ('product', 'cart', 'quantity', 'is_active')
+  list_select_related = ('product', 'cart')
+  raw_id_fields = ('product', 'cart')
+  paginator = EstimatedCountPaginator
+  show_full_result_count = False
 
-# Register the Cart and CartItem models in the admin interface
+class PromotionAdmin(admin.ModelAdmin):
+  """
+    Configuration class for the Promotion model in the Django admin interface.
+
+    Attributes:
+      list_display (tuple): Specifies the fields to be displayed as columns in the Promotion model list.
+      list_filter (tuple): Specifies the fields used to filter the Promotion model list.
+      search_fields (tuple): Specifies the fields searched from the Promotion model list.
+      list_select_related (tuple): Specifies the foreign keys joined to the Promotion model list query.
+      autocomplete_fields (tuple): Specifies the foreign keys chosen with a search widget, as the catalog can be large.
+  """
+  list_display = ('name', 'code', 'kind', 'value', 'product', 'category', 'starts_at', 'ends_at', 'is_active')
+  list_filter = ('kind', 'is_active')
+  search_fields = ('name', 'code')
+  list_select_related = ('product', 'category')
+  autocomplete_fields = ('product',)
+
+# Register the Cart, CartItem and Promotion models in the admin interface
 admin.site.register(Cart, CartAdmin)
 admin.site.register(CartItem, CartItemAdmin)
+admin.site.register(Promotion, PromotionAdmin)
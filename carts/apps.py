@@ -12,3 +12,9 @@ class CartsConfig(AppConfig):
 	"""
 	default_auto_field = 'django.db.models.BigAutoField'
 	name = 'carts'
+
+	def ready(self):
+		"""
+			Connect the signal receivers moving cookie carts to the database at login and recompiling the promotions.
+		"""
+		from . import signals  # noqa: F401
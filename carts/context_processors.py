@@ -1,5 +1,4 @@
-from .models import Cart, CartItem
-from .views import _cart_id
+from .storage import get_cart_storage
 
 
 def counter(request):
@@ -16,17 +15,10 @@ def counter(request):
     Note:
       If the request path contains 'admin', an empty dictionary is returned.
       This is to prevent the cart count from appearing in the admin interface.
+      The count is read from the cart storage (see carts.storage): from the cookie, or from the
+      denormalized Cart.item_count, copied in the cache.
       If the Cart associated with the current session does not exist, 'cart_count' is set to 0.
   """
-  cart_count = 0
   if 'admin' in request.path:
     return {}
-  else:
-    try:
-      cart = Cart.objects.filter(cart_id=_cart_id(request))
-      cart_items = CartItem.objects.all().filter(cart=cart[:1])
-      for cart_item in cart_items:
-        cart_count += cart_item.quantity
-    except Cart.DoesNotExist:
-      cart_count = 0
-  return dict(cart_count=cart_count)
+  return dict(cart_count=get_cart_storage(request).count())
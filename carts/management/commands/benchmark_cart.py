@@ -0,0 +1,80 @@
+import threading
+import time
+import uuid
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from carts.models import Cart, CartItem
+from carts.services import add_item, decrement_item
+from store.models import Product
+
+
+class Command(BaseCommand):
+  """
+    Hammer a single cart from several threads and check that no update is lost.
+
+    Every thread adds `--operations` units of the same product to the same cart, then removes
+    `--removals` of them. The final quantity must be exactly threads * (operations - removals).
+    The benchmark cart is deleted afterwards.
+  """
+  help = 'Benchmark concurrent add/remove operations on one cart and check the final quantity.'
+
+  def add_arguments(self, parser):
+    parser.add_argument('--threads', type=int, default=8, help='Number of concurrent threads.')
+    parser.add_argument('--operations', type=int, default=50, help='Units added by each thread.')
+    parser.add_argument('--removals', type=int, default=10, help='Units removed by each thread.')
+    parser.add_argument('--product', type=int, help='ID of the product to add (default: the first product).')
+    parser.add_argument('--min-ops', type=float, default=0, help='Fail below this many operations per second.')
+
+  def handle(self, *args, **options):
+    threads, operations, removals = options['threads'], options['operations'], options['removals']
+    if removals > operations:
+      raise CommandError('--removals cannot exceed --operations.')
+    products = Product.objects.order_by('id')
+    product = products.filter(id=options['product']).first() if options['product'] else products.first()
+    if product is None:
+      raise CommandError('No product to add to the cart.')
+
+    cart = Cart.objects.create(cart_id='benchmark-%s' % uuid.uuid4().hex)
+    errors = []
+    barrier = threading.Barrier(threads)
+
+    def worker():
+      try:
+        barrier.wait()
+        for _ in range(operations):
+          add_item(cart, product, [])
+        item_id = CartItem.objects.filter(cart=cart, product=product).values_list('id', flat=True).get()
+        for _ in range(removals):
+          decrement_item(cart, product.id, item_id)
+      except Exception as error:
+        errors.append(error)
+      finally:
+        connections.close_all()
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    start = time.monotonic()
+    for thread in workers:
+      thread.start()
+    for thread in workers:
+      thread.join()
+    elapsed = time.monotonic() - start
+
+    try:
+      if errors:
+        raise CommandError('%d thread(s) failed: %r' % (len(errors), errors[0]))
+      quantity = CartItem.objects.filter(cart=cart, product=product).values_list('quantity', flat=True).first() or 0
+      expected = threads * (operations - removals)
+      total = threads * (operations + removals)
+      rate = total / elapsed if elapsed else float('inf')
+      self.stdout.write('%d operations by %d threads in %.2fs (%.0f ops/s), final quantity %d (expected %d).' % (
+        total, threads, elapsed, rate, quantity, expected,
+      ))
+      if quantity != expected:
+        raise CommandError('Lost updates: final quantity %d, expected %d.' % (quantity, expected))
+      if rate < options['min_ops']:
+        raise CommandError('Throughput %.0f ops/s is below %.0f ops/s.' % (rate, options['min_ops']))
+    finally:
+      cart.delete()
+    self.stdout.write(self.style.SUCCESS('No update was lost.'))
@@ -0,0 +1,66 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from carts.models import CartItem, Promotion
+from carts.promotions import compile_promotions
+from store.models import Product
+
+
+class Command(BaseCommand):
+  """
+    Measure the cost of evaluating a cart against compiled promotions of growing size.
+
+    For every `--rules` size, random promotions (scoped to a product, to a category or to
+    the whole cart, half of them behind a code) are compiled in memory, and a cart of
+    `--lines` lines is evaluated `--iterations` times. Nothing is written to the database.
+  """
+  help = 'Benchmark the evaluation of a cart against 10 and 10,000 compiled promotions.'
+
+  def add_arguments(self, parser):
+    parser.add_argument('--rules', type=int, nargs='+', default=[10, 10000], help='Numbers of promotions to compare.')
+    parser.add_argument('--lines', type=int, default=20, help='Lines of the evaluated cart.')
+    parser.add_argument('--iterations', type=int, default=2000, help='Evaluations per size.')
+    parser.add_argument('--max-ratio', type=float, default=0, help='Fail if the largest size is this many times slower than the smallest.')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the random promotions.')
+
+  def handle(self, *args, **options):
+    sizes = sorted(options['rules'])
+    if sizes[0] <= 0 or options['lines'] <= 0 or options['iterations'] <= 0:
+      raise CommandError('--rules, --lines and --iterations must be positive.')
+    rng = random.Random(options['seed'])
+    products, categories = 5000, 100
+    cart_items = []
+    for line in range(options['lines']):
+      product = Product(id=rng.randint(1, products), category_id=rng.randint(1, categories), price=rng.uniform(5, 200))
+      cart_items.append(CartItem(id=line + 1, product=product, quantity=rng.randint(1, 3)))
+
+    timings = []
+    for size in sizes:
+      promotions = []
+      for number in range(size):
+        scope = rng.random()
+        promotions.append(Promotion(
+          code='CODE%d' % rng.randint(1, 100) if number % 2 else '',
+          kind=rng.choice([Promotion.PERCENT, Promotion.FIXED]),
+          value=rng.uniform(1, 30),
+          product_id=rng.randint(1, products) if scope < 0.6 else None,
+          category_id=rng.randint(1, categories) if 0.6 <= scope < 0.95 else None,
+        ))
+      start = time.perf_counter()
+      compiled = compile_promotions(promotions)
+      compile_time = time.perf_counter() - start
+      start = time.perf_counter()
+      for _ in range(options['iterations']):
+        compiled.evaluate(cart_items, 'CODE1')
+      per_cart = (time.perf_counter() - start) / options['iterations']
+      timings.append(per_cart)
+      self.stdout.write('%6d promotions: compiled in %.1fms, %.1fus per cart of %d lines.' % (
+        size, compile_time * 1000, per_cart * 1e6, options['lines'],
+      ))
+
+    ratio = timings[-1] / timings[0] if timings[0] else 1
+    self.stdout.write('%d promotions cost %.2fx the time of %d.' % (sizes[-1], ratio, sizes[0]))
+    if options['max_ratio'] and ratio > options['max_ratio']:
+      raise CommandError('Evaluation with %d promotions is %.2fx slower than with %d.' % (sizes[-1], ratio, sizes[0]))
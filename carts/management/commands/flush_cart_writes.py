@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from carts.writebehind import flush_pending_writes, pending_writes
+
+
+class Command(BaseCommand):
+  """
+    Write the cart changes pending in the write-behind cache to the database.
+
+    Run it periodically and before stopping the workers when CART_STORAGE is 'write_behind'.
+  """
+  help = 'Flush the pending write-behind cart changes to the database.'
+
+  def handle(self, *args, **options):
+    pending = pending_writes()
+    applied = flush_pending_writes()
+    self.stdout.write(self.style.SUCCESS('Applied %d of %d pending cart changes.' % (applied, pending)))
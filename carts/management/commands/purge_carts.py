@@ -0,0 +1,54 @@
+import datetime
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from carts.models import Cart, CartItem
+
+
+class Command(BaseCommand):
+  """
+    Delete the carts not changed for a given age, with their items, in bounded chunks.
+
+    A cart is judged by its last activity (Cart.last_activity), not by its creation date, so
+    a cart created long ago that the visitor still fills is kept.
+
+    Each chunk of carts is deleted in its own short transaction, with the cascade to their
+    items and variations, so the command can run on a large table without holding long locks.
+  """
+  help = 'Delete abandoned carts and their items in chunks.'
+
+  def add_arguments(self, parser):
+    parser.add_argument(
+      '--days', type=int, default=getattr(settings, 'CART_PURGE_AGE_DAYS', 30),
+      help='Delete the carts not changed for this many days.',
+    )
+    parser.add_argument('--chunk-size', type=int, default=1000, help='Number of carts deleted per chunk.')
+    parser.add_argument('--sleep', type=float, default=0, help='Seconds to wait between chunks.')
+    parser.add_argument('--dry-run', action='store_true', help='Only count the carts to delete.')
+
+  def handle(self, *args, **options):
+    cutoff = timezone.now() - datetime.timedelta(days=options['days'])
+    expired = Cart.objects.filter(last_activity__lt=cutoff)
+    if options['dry_run']:
+      self.stdout.write('%d carts inactive since %s.' % (expired.count(), cutoff.date()))
+      return
+
+    carts = items = 0
+    last_pk = 0
+    while True:
+      # Walk the expired carts by primary key, so each chunk is an index range scan
+      pks = list(expired.filter(pk__gt=last_pk).order_by('pk').values_list('pk', flat=True)[:options['chunk_size']])
+      if not pks:
+        break
+      last_pk = pks[-1]
+      # The items and their variations are deleted by the cascade, chunk by chunk; a cart
+      # changed since it was selected is kept
+      deleted = expired.filter(pk__in=pks).delete()[1]
+      carts += deleted.get(Cart._meta.label, 0)
+      items += deleted.get(CartItem._meta.label, 0)
+      if options['sleep']:
+        time.sleep(options['sleep'])
+    self.stdout.write(self.style.SUCCESS('Deleted %d carts and %d cart items inactive since %s.' % (carts, items, cutoff.date())))
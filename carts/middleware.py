@@ -0,0 +1,18 @@
+class CartStorageMiddleware:
+  """
+    Let the cart storage of a request write its state to the response.
+
+    Only the storages keeping the cart outside the database (the signed cookie of
+    carts.storage.CookieCartStorage) have something to write.
+  """
+
+  def __init__(self, get_response):
+    self.get_response = get_response
+
+
+  def __call__(self, request):
+    response = self.get_response(request)
+    storage = getattr(request, '_cart_storage', None)
+    if storage is not None:
+      storage.finalize(response)
+    return response
@@ -0,0 +1,35 @@
+# Generated by Django 4.2.30 on 2026-10-18 07:21
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+
+def count_cart_items(apps, schema_editor):
+    Cart = apps.get_model('carts', 'Cart')
+    CartItem = apps.get_model('carts', 'CartItem')
+    db_alias = schema_editor.connection.alias
+    totals = (
+        CartItem.objects.using(db_alias)
+        .filter(cart=OuterRef('pk'))
+        .values('cart')
+        .annotate(total=Sum('quantity'))
+        .values('total')
+    )
+    Cart.objects.using(db_alias).update(item_count=Coalesce(Subquery(totals), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('carts', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cart',
+            name='item_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(count_cart_items, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 4.2.30 on 2026-10-18 07:22
+
+from django.db import migrations, models
+
+
+def sign_cart_items(apps, schema_editor):
+    """
+        Compute the variation signature of the existing cart items and merge the items
+        that end up with the same (cart, product, signature) key.
+    """
+    CartItem = apps.get_model('carts', 'CartItem')
+    db_alias = schema_editor.connection.alias
+    variations = {}
+    for item_id, variation_id in CartItem.variations.through.objects.using(db_alias).values_list('cartitem_id', 'variation_id'):
+        variations.setdefault(item_id, set()).add(variation_id)
+    kept = {}
+    for item in CartItem.objects.using(db_alias).order_by('id'):
+        signature = ','.join(str(pk) for pk in sorted(variations.get(item.id, ())))
+        key = (item.cart_id, item.product_id, signature)
+        if key in kept:
+            first = kept[key]
+            first.quantity += item.quantity
+            first.save(update_fields=['quantity'])
+            item.delete()
+        else:
+            item.variation_signature = signature
+            item.save(update_fields=['variation_signature'])
+            kept[key] = item
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('carts', '0002_cart_item_count'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cartitem',
+            name='variation_signature',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+        migrations.RunPython(sign_cart_items, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='cartitem',
+            constraint=models.UniqueConstraint(fields=('cart', 'product', 'variation_signature'), name='unique_cart_item_variations'),
+        ),
+    ]
@@ -0,0 +1,66 @@
+# Generated by Django 4.2.30 on 2026-10-18 07:30
+
+from django.db import migrations, models
+from django.db.models import Count, Min, Sum
+
+
+def merge_duplicate_carts(apps, schema_editor):
+    """
+        Merge the carts sharing a cart_id into the oldest one, adding up the quantities of
+        the items with the same product and variations.
+    """
+    Cart = apps.get_model('carts', 'Cart')
+    CartItem = apps.get_model('carts', 'CartItem')
+    db_alias = schema_editor.connection.alias
+    duplicates = (
+        Cart.objects.using(db_alias)
+        .values('cart_id')
+        .annotate(carts=Count('id'), first=Min('id'))
+        .filter(carts__gt=1)
+    )
+    for duplicate in duplicates.iterator():
+        kept = duplicate['first']
+        others = list(
+            Cart.objects.using(db_alias)
+            .filter(cart_id=duplicate['cart_id'])
+            .exclude(pk=kept)
+            .values_list('pk', flat=True)
+        )
+        items = dict(
+            ((item.product_id, item.variation_signature), item)
+            for item in CartItem.objects.using(db_alias).filter(cart_id=kept)
+        )
+        for item in CartItem.objects.using(db_alias).filter(cart_id__in=others).order_by('id'):
+            key = (item.product_id, item.variation_signature)
+            if key in items:
+                items[key].quantity += item.quantity
+                items[key].save(update_fields=['quantity'])
+                item.delete()
+            else:
+                item.cart_id = kept
+                item.save(update_fields=['cart'])
+                items[key] = item
+        Cart.objects.using(db_alias).filter(pk__in=others).delete()
+        total = CartItem.objects.using(db_alias).filter(cart_id=kept).aggregate(total=Sum('quantity'))['total']
+        Cart.objects.using(db_alias).filter(pk=kept).update(item_count=total or 0)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('carts', '0003_cartitem_variation_signature'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_carts, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='cart',
+            name='cart_id',
+            field=models.CharField(blank=True, max_length=250, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='cart',
+            name='date_added',
+            field=models.DateField(auto_now_add=True, db_index=True),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 4.2.30 on 2026-10-18 08:09
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('carts', '0005_promotion'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='promotion',
+            name='value',
+            field=models.FloatField(validators=[django.core.validators.MinValueValidator(0)]),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 4.2.30 on 2026-10-18 08:15
+
+from django.db import migrations, models
+from django.db.models.functions import Cast
+
+
+def set_last_activity(apps, schema_editor):
+    # Carts older than the field were last known active the day they were created
+    Cart = apps.get_model('carts', 'Cart')
+    db_alias = schema_editor.connection.alias
+    Cart.objects.using(db_alias).update(last_activity=Cast('date_added', models.DateTimeField()))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('carts', '0006_promotion_value_validator'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cart',
+            name='last_activity',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+        migrations.RunPython(set_last_activity, migrations.RunPython.noop),
+    ]
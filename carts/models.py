@@ -1,4 +1,7 @@
+from django.core.exceptions import ValidationError
+from django.core.validators import MinValueValidator
 from django.db import models
+from category.models import Category
 from store.models import Product, Variation
 
 
@@ -7,11 +10,15 @@ class Cart(models.Model):
     Represents a shopping cart.
 
     Attributes:
-      cart_id (CharField): A unique identifier for the cart. Can be blank.
-      date_added (DateField): The date the cart was created. Automatically set to the current date.
+      cart_id (CharField): A unique identifier for the cart (the session key). Can be blank.
+      date_added (DateField): The date the cart was created. Automatically set to the current date. Indexed for purge_carts.
+      item_count (PositiveIntegerField): The total quantity of the items of the cart, kept up to date by the cart views.
+      last_activity (DateTimeField): When the items of the cart last changed, set with item_count. Indexed for purge_carts.
   """
-  cart_id = models.CharField(max_length=250, blank=True)
-  date_added = models.DateField(auto_now_add=True)
+  cart_id = models.CharField(max_length=250, blank=True, unique=True)
+  date_added = models.DateField(auto_now_add=True, db_index=True)
+  item_count = models.PositiveIntegerField(default=0)
+  last_activity = models.DateTimeField(auto_now=True, db_index=True)
 
 
   def __str__(self):
@@ -35,12 +42,23 @@ class CartItem(models.Model):
       cart (ForeignKey): The cart the item belongs to. On cart deletion, the cart item is also deleted.
       quantity (IntegerField): The quantity of the product in the cart.
       is_active (BooleanField): Whether the cart item is active. Default is True.
+      variation_signature (CharField): The sorted IDs of the variations, unique per cart and product.
   """
   product = models.ForeignKey(Product, on_delete=models.CASCADE)
   variations = models.ManyToManyField(Variation, blank=True)
   cart = models.ForeignKey(Cart, on_delete=models.CASCADE)
   quantity = models.IntegerField()
   is_active = models.BooleanField(default=True)
+  variation_signature = models.CharField(max_length=255, blank=True, default='')
+
+
+  class Meta:
+    constraints = [
+      models.UniqueConstraint(
+        fields=['cart', 'product', 'variation_signature'],
+        name='unique_cart_item_variations',
+      ),
+    ]
 
 
   def sub_total(self):
@@ -53,6 +71,36 @@ class CartItem(models.Model):
     return self.product.price * self.quantity
 
 
+  def selected_variations(self):
+    """
+      Returns the variations of the item, from the prefetched variations when available.
+
+      Returns:
+        list: The variations of the item.
+    """
+    return list(self.variations.all())
+
+
+  def sizes(self):
+    """
+      Returns the active size variations of the item, from the prefetched variations when available.
+
+      Returns:
+        list: The active size variations of the item.
+    """
+    return [variation for variation in self.selected_variations() if variation.variation_category == 'size' and variation.is_active]
+
+
+  def colors(self):
+    """
+      Returns the active color variations of the item, from the prefetched variations when available.
+
+      Returns:
+        list: The active color variations of the item.
+    """
+    return [variation for variation in self.selected_variations() if variation.variation_category == 'color' and variation.is_active]
+
+
   def __str__(self):
     """
       Returns a string representation of the cart item.
@@ -61,3 +109,75 @@ class CartItem(models.Model):
         str: The string representation of the product.
     """
     return str(self.product)
+
+
+
+class Promotion(models.Model):
+  """
+    Represents a discount rule of the cart (see carts.promotions).
+
+    A promotion without code applies automatically; one with a code applies once the visitor
+    enters the code on the cart page. It is scoped to a product, to a category, or to the
+    whole cart when neither is set.
+
+    Attributes:
+      name (CharField): The name of the promotion, shown in the admin.
+      code (CharField): The code to enter on the cart page. Blank for an automatic promotion.
+      kind (CharField): 'percent' (percentage of the price) or 'fixed' (amount off each unit, or off the cart).
+      value (FloatField): The percentage (up to 100) or the amount of the discount, not negative.
+      product (ForeignKey): The product the promotion is restricted to. Can be null.
+      category (ForeignKey): The category the promotion is restricted to. Can be null.
+      starts_at (DateTimeField): The start of the promotion. Can be null.
+      ends_at (DateTimeField): The end of the promotion. Can be null.
+      is_active (BooleanField): Whether the promotion is active. Default is True.
+  """
+  PERCENT = 'percent'
+  FIXED = 'fixed'
+  KIND_CHOICES = [
+    (PERCENT, 'Percentage'),
+    (FIXED, 'Fixed amount'),
+  ]
+
+  name = models.CharField(max_length=100)
+  code = models.CharField(max_length=50, blank=True, db_index=True)
+  kind = models.CharField(max_length=10, choices=KIND_CHOICES, default=PERCENT)
+  value = models.FloatField(validators=[MinValueValidator(0)])
+  product = models.ForeignKey(Product, on_delete=models.CASCADE, null=True, blank=True)
+  category = models.ForeignKey(Category, on_delete=models.CASCADE, null=True, blank=True)
+  starts_at = models.DateTimeField(null=True, blank=True)
+  ends_at = models.DateTimeField(null=True, blank=True)
+  is_active = models.BooleanField(default=True)
+
+
+  def clean(self):
+    """
+      Validates the promotion: a percentage cannot exceed 100, and a promotion is scoped to a product or to a category, not both.
+
+      Raises:
+        ValidationError: If the promotion is not valid.
+    """
+    errors = {}
+    if self.kind == self.PERCENT and self.value is not None and self.value > 100:
+      errors['value'] = 'A percentage cannot exceed 100.'
+    if self.product_id is not None and self.category_id is not None:
+      errors['category'] = 'A promotion applies to a product or to a category, not both.'
+    if errors:
+      raise ValidationError(errors)
+
+
+  def save(self, *args, **kwargs):
+    """
+      Saves the promotion with its code in upper case, as entered codes are matched case-insensitively.
+    """
+    self.code = self.code.strip().upper()
+    super().save(*args, **kwargs)
+
+
+  def __str__(self):
+    """
+      Returns a string representation of the promotion.
+
+      Returns:
+        str: The name of the promotion.
+    """
+    return self.name
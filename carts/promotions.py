@@ -0,0 +1,155 @@
+from django.db.models import Q
+from django.utils import timezone
+
+from store.cache import LocalIndex
+from .models import Promotion
+
+
+# Version namespace of the promotions, bumped on every saved or deleted promotion.
+PROMOTIONS = 'promotions'
+
+# Session key of the discount code entered on the cart page.
+DISCOUNT_CODE_SESSION_KEY = 'discount_code'
+
+
+class RuleSet:
+  """
+    The best discounts of a group of promotions (the automatic ones, or the ones of a code).
+
+    Only the highest percentage and the highest fixed amount of each product, each category
+    and the whole cart are kept: the best discount of a line never depends on the other
+    promotions of the same scope, so a line is evaluated with at most two lookups per set.
+  """
+
+  def __init__(self):
+    self.products = {}
+    self.categories = {}
+    self.cart = [0, 0]
+
+  def add(self, promotion):
+    if promotion.product_id is not None:
+      best = self.products.setdefault(promotion.product_id, [0, 0])
+    elif promotion.category_id is not None:
+      best = self.categories.setdefault(promotion.category_id, [0, 0])
+    else:
+      best = self.cart
+    slot = 0 if promotion.kind == Promotion.PERCENT else 1
+    best[slot] = max(best[slot], promotion.value)
+
+
+class CompiledPromotions:
+  """
+    The promotions running at a given time, compiled into rule sets indexed by product and category.
+
+    Evaluating a cart costs a constant number of dictionary lookups per line, whatever the
+    number of promotions. The compiled promotions are valid until `expires_at`, the next
+    start or end of a promotion.
+  """
+
+  def __init__(self, promotions, now):
+    self.automatic = RuleSet()
+    self.codes = {}
+    self.expires_at = None
+    for promotion in promotions:
+      if not promotion.is_active or (promotion.ends_at is not None and promotion.ends_at <= now):
+        continue
+      if promotion.starts_at is not None and promotion.starts_at > now:
+        self._expire_at(promotion.starts_at)
+        continue
+      if promotion.ends_at is not None:
+        self._expire_at(promotion.ends_at)
+      rules = self.codes.setdefault(promotion.code, RuleSet()) if promotion.code else self.automatic
+      rules.add(promotion)
+
+  def _expire_at(self, moment):
+    if self.expires_at is None or moment < self.expires_at:
+      self.expires_at = moment
+
+  def is_valid_code(self, code):
+    """
+      Return True if a discount code has a running promotion.
+    """
+    return bool(code) and code.strip().upper() in self.codes
+
+  def evaluate(self, cart_items, code=''):
+    """
+      Calculate the discounts of a cart.
+
+      Every line gets the best discount of its product or of its category, among the
+      automatic promotions and the ones of the code: a percentage of the price, or a fixed
+      amount off each unit. The best cart-wide discount then applies to what is left.
+
+      Args:
+        cart_items (list): The items of the cart, with their products.
+        code (str): The discount code entered by the visitor (default: none).
+
+      Returns:
+        tuple: The discount of each item ID, and the cart-wide discount.
+    """
+    rule_sets = [self.automatic]
+    if code:
+      coded = self.codes.get(code.strip().upper())
+      if coded is not None:
+        rule_sets.append(coded)
+    lines = {}
+    rest = 0
+    for cart_item in cart_items:
+      product = cart_item.product
+      price = product.price
+      unit = 0
+      for rules in rule_sets:
+        for best in (rules.products.get(product.id), rules.categories.get(product.category_id)):
+          if best is not None:
+            unit = max(unit, price * best[0] / 100, best[1])
+      discount = min(unit, price) * cart_item.quantity
+      if discount:
+        lines[cart_item.id] = round(discount, 2)
+      rest += price * cart_item.quantity - discount
+    cart = 0
+    for rules in rule_sets:
+      cart = max(cart, rest * rules.cart[0] / 100, rules.cart[1])
+    return lines, round(min(cart, rest), 2)
+
+
+def compile_promotions(promotions, now=None):
+  """
+    Compile promotions into a CompiledPromotions valid at `now` (default: the current time).
+  """
+  return CompiledPromotions(promotions, now or timezone.now())
+
+
+class PromotionIndex(LocalIndex):
+  """
+    In-memory compiled promotions.
+
+    Rebuilt with one query when a promotion is saved or deleted (the 'promotions' version
+    changes), and when a promotion starts or ends.
+  """
+  namespaces = (PROMOTIONS,)
+
+  def __init__(self):
+    super().__init__()
+    self.compiled = None
+
+  def load(self):
+    now = timezone.now()
+    promotions = Promotion.objects.filter(is_active=True).filter(Q(ends_at__isnull=True) | Q(ends_at__gt=now)).only(
+      'code', 'kind', 'value', 'product_id', 'category_id', 'starts_at', 'ends_at', 'is_active',
+    )
+    self.compiled = compile_promotions(promotions, now)
+
+  def get(self):
+    """
+      Return the promotions compiled for the current time.
+    """
+    self.ensure_current()
+    compiled = self.compiled
+    if compiled.expires_at is not None and compiled.expires_at <= timezone.now():
+      with self.lock:
+        if self.compiled is compiled:
+          self.load()
+      compiled = self.compiled
+    return compiled
+
+
+promotion_index = PromotionIndex()
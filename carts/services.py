@@ -0,0 +1,328 @@
+from django.db import IntegrityError, transaction
+from django.db.models import F, Q
+
+from store.models import Product, Variation, variation_category_choice
+from .models import Cart, CartItem
+
+
+# Names of the form fields holding a variation (the other fields, like the CSRF token, are ignored).
+VARIATION_FIELDS = tuple(category for category, label in variation_category_choice)
+
+# Maximum quantity of a product added or set at once, well below the integer column limits.
+MAX_ITEM_QUANTITY = 999
+
+
+def variation_signature(variation_ids):
+  """
+    Build the canonical signature of a set of variations.
+
+    Args:
+      variation_ids (iterable): The IDs of the variations.
+
+    Returns:
+      str: The sorted, de-duplicated IDs joined by commas ('' without variation).
+  """
+  return ','.join(str(pk) for pk in sorted(set(variation_ids)))
+
+
+def resolve_variations(product, data):
+  """
+    Resolve the variations selected in a form with a single query.
+
+    Args:
+      product (Product): The product the variations belong to.
+      data (QueryDict): The submitted form data.
+
+    Returns:
+      list: The matching variations of the product.
+  """
+  condition = Q()
+  for field in VARIATION_FIELDS:
+    value = data.get(field)
+    if value:
+      condition |= Q(variation_category__iexact=field, variation_value__iexact=value)
+  if not condition:
+    return []
+  return list(Variation.objects.filter(condition, product=product))
+
+
+def resolve_batch(entries):
+  """
+    Validate the entries of a batch addition with two queries, one for the products and one
+    for their variations.
+
+    Args:
+      entries (list): {'product_id': int, 'variations': {field: value}, 'quantity': int} dictionaries.
+
+    Returns:
+      tuple: The (product, variations, quantity) entries, and a list of error messages
+             (the entries are only valid if the list is empty).
+  """
+  errors = []
+  parsed = []
+  for index, entry in enumerate(entries):
+    try:
+      product_id = int(entry['product_id'])
+      quantity = int(entry.get('quantity', 1))
+      selected = dict((str(field).lower(), str(value)) for field, value in (entry.get('variations') or {}).items())
+    except (AttributeError, KeyError, TypeError, ValueError):
+      errors.append('Entry %d: invalid entry.' % index)
+      continue
+    if quantity < 1:
+      errors.append('Entry %d: the quantity must be positive.' % index)
+      continue
+    if quantity > MAX_ITEM_QUANTITY:
+      errors.append('Entry %d: the quantity cannot exceed %d.' % (index, MAX_ITEM_QUANTITY))
+      continue
+    unknown = set(selected) - set(VARIATION_FIELDS)
+    if unknown:
+      errors.append('Entry %d: unknown variation %s.' % (index, ', '.join(sorted(unknown))))
+      continue
+    parsed.append((index, product_id, selected, quantity))
+
+  products = Product.objects.filter(is_available=True).in_bulk([product_id for index, product_id, selected, quantity in parsed])
+  variations = {}
+  for variation in Variation.objects.filter(product_id__in=list(products), is_active=True):
+    key = (variation.product_id, variation.variation_category.lower(), variation.variation_value.lower())
+    variations[key] = variation
+
+  resolved = []
+  for index, product_id, selected, quantity in parsed:
+    product = products.get(product_id)
+    if product is None:
+      errors.append('Entry %d: product %d is not available.' % (index, product_id))
+      continue
+    chosen = []
+    for field, value in selected.items():
+      variation = variations.get((product_id, field, value.lower()))
+      if variation is None:
+        errors.append('Entry %d: %s %s is not available.' % (index, field, value))
+        break
+      chosen.append(variation)
+    else:
+      resolved.append((product, chosen, quantity))
+  return resolved, errors
+
+
+def get_or_create_cart(cart_id):
+  """
+    Get the cart of a session, creating it if it does not exist yet.
+
+    Args:
+      cart_id (str): The ID of the session's cart.
+
+    Returns:
+      Cart: The cart with this ID. The unique index on cart_id makes concurrent creations safe.
+  """
+  return Cart.objects.get_or_create(cart_id=cart_id)[0]
+
+
+def add_item(cart, product, variations, quantity=1):
+  """
+    Add units of a product with the given variations to a cart.
+
+    The cart item is found by its (cart, product, variation signature) unique key: an existing
+    item is incremented with a single UPDATE, otherwise a new item is inserted. If a concurrent
+    request inserted the same item first, the unique constraint rejects the insert and the
+    units are added to that item. The quantity of the item never exceeds MAX_ITEM_QUANTITY:
+    an item that would pass it is raised to the maximum under a row lock.
+
+    Args:
+      cart (Cart): The cart to add the product to.
+      product (Product): The product to add.
+      variations (list): The selected variations of the product.
+      quantity (int): The number of units to add (default: 1).
+
+    Returns:
+      int: The number of units added.
+  """
+  signature = variation_signature(variation.pk for variation in variations)
+  items = CartItem.objects.filter(cart=cart, product=product, variation_signature=signature)
+  if items.filter(quantity__lte=MAX_ITEM_QUANTITY - quantity).update(quantity=F('quantity') + quantity):
+    return quantity
+  quantity = min(quantity, MAX_ITEM_QUANTITY)
+  try:
+    with transaction.atomic():
+      cart_item = CartItem.objects.create(
+        cart=cart, product=product, quantity=quantity, variation_signature=signature,
+      )
+      if variations:
+        cart_item.variations.add(*variations)
+  except IntegrityError:
+    return _add_up_to_max(items, quantity)
+  return quantity
+
+
+def _add_up_to_max(items, quantity):
+  """
+    Add units to a cart item under a row lock, without exceeding MAX_ITEM_QUANTITY.
+
+    Returns:
+      int: The number of units added (0 if the item does not exist or is already full).
+  """
+  with transaction.atomic():
+    current = items.select_for_update().values_list('quantity', flat=True).first()
+    if current is None:
+      return 0
+    added = units_up_to_max(current, quantity)
+    if added:
+      items.update(quantity=F('quantity') + added)
+  return added
+
+
+def units_up_to_max(current, quantity):
+  """
+    Return how many of the given units can be added to an item holding current units.
+
+    Returns:
+      int: The units that keep the item at MAX_ITEM_QUANTITY at most (never negative).
+  """
+  return max(min(current + quantity, MAX_ITEM_QUANTITY) - current, 0)
+
+
+def add_items(cart, entries):
+  """
+    Add several products to a cart in one transaction.
+
+    The entries with the same product and variations are merged, the existing items are
+    incremented with one bulk_update, the new ones are inserted with one bulk_create and
+    their variations with another. If a concurrent request inserted one of the items
+    meanwhile, the unique constraint rolls the transaction back and it is run once more.
+    Like add_item(), the quantities are capped at MAX_ITEM_QUANTITY, after merging.
+
+    Args:
+      cart (Cart): The cart to add the products to.
+      entries (list): (product, variations, quantity) tuples.
+
+    Returns:
+      dict: The number of units added to each product ID.
+  """
+  merged = {}
+  for product, variations, quantity in entries:
+    key = (product.pk, variation_signature(variation.pk for variation in variations))
+    if key in merged:
+      merged[key][2] = min(merged[key][2] + quantity, MAX_ITEM_QUANTITY)
+    else:
+      merged[key] = [product, variations, min(quantity, MAX_ITEM_QUANTITY)]
+  for attempt in range(2):
+    try:
+      with transaction.atomic():
+        return _add_items(cart, merged)
+    except IntegrityError:
+      if attempt:
+        raise
+
+
+def _add_items(cart, merged):
+  product_ids = set(product_id for product_id, signature in merged)
+  existing = dict(
+    ((item.product_id, item.variation_signature), item)
+    for item in CartItem.objects.select_for_update().filter(cart=cart, product_id__in=product_ids)
+  )
+  updated, created = [], []
+  added = dict.fromkeys(product_ids, 0)
+  for key, (product, variations, quantity) in merged.items():
+    if key in existing:
+      # The item is locked, its quantity is current
+      item = existing[key]
+      units = units_up_to_max(item.quantity, quantity)
+      if units:
+        item.quantity += units
+        updated.append(item)
+        added[product.pk] += units
+    else:
+      created.append(CartItem(cart=cart, product=product, quantity=quantity, variation_signature=key[1]))
+      added[product.pk] += quantity
+  if updated:
+    CartItem.objects.bulk_update(updated, ['quantity'])
+  if created:
+    CartItem.objects.bulk_create(created)
+    # Read the IDs back, bulk_create does not set them on every database (MySQL)
+    ids = dict(
+      ((product_id, signature), pk)
+      for pk, product_id, signature in CartItem.objects.filter(
+        cart=cart, product_id__in=[item.product_id for item in created],
+      ).values_list('pk', 'product_id', 'variation_signature')
+    )
+    Through = CartItem.variations.through
+    Through.objects.bulk_create([
+      Through(cartitem_id=ids[(item.product_id, item.variation_signature)], variation_id=variation.pk)
+      for item in created
+      for variation in merged[(item.product_id, item.variation_signature)][1]
+    ])
+  return added
+
+
+def decrement_item(cart, product_id, cart_item_id):
+  """
+    Remove one unit of a cart item, deleting the item when its last unit is removed.
+
+    Items with more than one unit are decremented with a single conditional UPDATE; the last
+    unit is removed under a row lock, so that a concurrent increment is not deleted with it.
+
+    Args:
+      cart (Cart): The cart of the item.
+      product_id (int): The ID of the product of the item.
+      cart_item_id (int): The ID of the cart item.
+
+    Returns:
+      int: The number of units removed (0 if the item does not exist).
+  """
+  items = CartItem.objects.filter(cart=cart, product_id=product_id, id=cart_item_id)
+  if items.filter(quantity__gt=1).update(quantity=F('quantity') - 1):
+    return 1
+  with transaction.atomic():
+    quantity = items.select_for_update().values_list('quantity', flat=True).first()
+    if quantity is None:
+      return 0
+    if quantity > 1:
+      items.update(quantity=F('quantity') - 1)
+    else:
+      items.delete()
+  return 1
+
+
+def remove_item(cart, product_id, cart_item_id):
+  """
+    Delete a cart item with all its units.
+
+    Args:
+      cart (Cart): The cart of the item.
+      product_id (int): The ID of the product of the item.
+      cart_item_id (int): The ID of the cart item.
+
+    Returns:
+      int: The number of units removed (0 if the item does not exist).
+  """
+  items = CartItem.objects.filter(cart=cart, product_id=product_id, id=cart_item_id)
+  with transaction.atomic():
+    quantity = items.select_for_update().values_list('quantity', flat=True).first()
+    if quantity is None:
+      return 0
+    items.delete()
+  return quantity
+
+
+def set_item_quantity(cart, product_id, cart_item_id, quantity):
+  """
+    Set the quantity of a cart item, deleting it when the quantity is 0.
+
+    Args:
+      cart (Cart): The cart of the item.
+      product_id (int): The ID of the product of the item.
+      cart_item_id (int): The ID of the cart item.
+      quantity (int): The new quantity of the item.
+
+    Returns:
+      int: The change of the quantity of the item (0 if the item does not exist).
+  """
+  items = CartItem.objects.filter(cart=cart, product_id=product_id, id=cart_item_id)
+  with transaction.atomic():
+    previous = items.select_for_update().values_list('quantity', flat=True).first()
+    if previous is None:
+      return 0
+    if quantity > 0:
+      items.update(quantity=quantity)
+    else:
+      items.delete()
+  return max(quantity, 0) - previous
@@ -0,0 +1,56 @@
+from django.contrib.auth.signals import user_logged_in
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from store.cache import bump_version
+from store.reservations import move_holds
+from .models import Cart, Promotion
+from .promotions import PROMOTIONS
+from .storage import CART_COOKIE_NAME, CART_ID_SESSION_KEY, CookieCartStorage
+
+
+@receiver(user_logged_in)
+def move_cookie_cart(sender, request, user, **kwargs):
+  """
+    Move the cookie cart of a visitor who logs in to the database cart of the new session.
+  """
+  if request is None or CART_COOKIE_NAME not in request.COOKIES:
+    return
+  storage = getattr(request, '_cart_storage', None)
+  if not isinstance(storage, CookieCartStorage):
+    storage = CookieCartStorage(request)
+  storage.flush()
+
+
+@receiver(user_logged_in)
+def move_session_cart(sender, request, user, **kwargs):
+  """
+    Move the database cart of a visitor who logs in, with its stock holds, to the new session key.
+
+    Login rotates the session key: without the move, the visitor would find an empty cart
+    while its units stay held. The holds only follow a cart that moved, to the database
+    row here or from the cookie by move_cookie_cart.
+  """
+  if request is None or not hasattr(request, 'session'):
+    return
+  old_cart_id = request.session.get(CART_ID_SESSION_KEY)
+  new_cart_id = request.session.session_key
+  if not old_cart_id or not new_cart_id or old_cart_id == new_cart_id:
+    return
+  with transaction.atomic():
+    moved = False
+    if not Cart.objects.filter(cart_id=new_cart_id).exists():
+      moved = bool(Cart.objects.filter(cart_id=old_cart_id).update(cart_id=new_cart_id))
+    if moved or CART_COOKIE_NAME in request.COOKIES:
+      move_holds(old_cart_id, new_cart_id)
+  request.session[CART_ID_SESSION_KEY] = new_cart_id
+
+
+@receiver(post_save, sender=Promotion)
+@receiver(post_delete, sender=Promotion)
+def promotion_changed(sender, instance, **kwargs):
+  """
+    Move the promotions to a new version once the transaction is committed, so that every process compiles them again.
+  """
+  transaction.on_commit(lambda: bump_version(PROMOTIONS))
@@ -0,0 +1,511 @@
+from django.conf import settings
+from django.core import signing
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce, Greatest
+from django.utils import timezone
+
+from store.models import Product, Variation
+from .models import Cart, CartItem
+from .services import MAX_ITEM_QUANTITY, add_item, add_items, decrement_item, get_or_create_cart, remove_item, set_item_quantity, units_up_to_max, variation_signature
+from .writebehind import apply_cart_writes, maybe_flush, pending_cart_count, pending_item_deltas, record_change
+
+
+# Name and signing salt of the cookie holding the cart of an anonymous visitor.
+CART_COOKIE_NAME = 'cart'
+CART_COOKIE_SALT = 'carts.storage.cookie'
+
+# Session key set once the cart of an anonymous visitor has been moved to the database.
+CART_IN_DATABASE = 'cart_in_database'
+
+# Session key of the ID of the session's cart, which outlives the key rotated on login (see carts.signals).
+CART_ID_SESSION_KEY = 'cart_id'
+
+# Cache key and timeout of the item count of a cart, a copy of Cart.item_count shared by every request.
+CART_COUNT_KEY = 'carts:count:%s'
+CART_COUNT_TIMEOUT = 300
+
+
+def _cart_id(request):
+  """
+    Get the ID of the current session's cart, creating the session if needed.
+
+    Only the operations writing to the cart call it; reading a cart never creates a session.
+
+    Args:
+      request: The Django request object.
+
+    Returns:
+      str: The ID of the session's cart.
+  """
+  if not request.session.session_key:
+    # SessionBase.create() returns None, the new key is set on the session
+    request.session.create()
+  if request.session.get(CART_ID_SESSION_KEY) != request.session.session_key:
+    request.session[CART_ID_SESSION_KEY] = request.session.session_key
+  return request.session.session_key
+
+
+class BaseCartStorage:
+  """
+    Interface of the cart storages.
+
+    A storage is created once per request by get_cart_storage(); CartStorageMiddleware then
+    calls finalize() with the response, so that storages keeping state outside the database
+    can write it back.
+  """
+
+  def __init__(self, request):
+    self.request = request
+
+  def count(self):
+    """
+      Return the total quantity of the items of the cart (the navbar badge).
+    """
+    raise NotImplementedError
+
+  def contains(self, product_id):
+    """
+      Return True if the cart holds the product, with any variation.
+    """
+    raise NotImplementedError
+
+  def items(self):
+    """
+      Return the active items of the cart with their products, categories and variations loaded.
+
+      Each item provides id, product, quantity, sub_total(), selected_variations(), sizes() and colors().
+    """
+    raise NotImplementedError
+
+  def add(self, product, variations, quantity=1):
+    """
+      Add units of a product with the given variations to the cart. Returns the number of
+      units added, fewer than asked when the item reaches MAX_ITEM_QUANTITY.
+    """
+    raise NotImplementedError
+
+  def add_many(self, entries):
+    """
+      Add several (product, variations, quantity) entries to the cart at once. Returns the
+      number of units added to each product ID.
+    """
+    raise NotImplementedError
+
+  def decrement(self, product_id, item_id):
+    """
+      Remove one unit of an item. Returns the number of units removed.
+    """
+    raise NotImplementedError
+
+  def remove(self, product_id, item_id):
+    """
+      Remove an item with all its units. Returns the number of units removed.
+    """
+    raise NotImplementedError
+
+  def set_quantity(self, product_id, item_id, quantity):
+    """
+      Set the quantity of an item, removing it when the quantity is 0. Returns the change of the quantity.
+    """
+    raise NotImplementedError
+
+  def refresh_count(self):
+    """
+      Recompute the count of the cart from its items, if the storage keeps it apart.
+    """
+
+  def finalize(self, response):
+    """
+      Write the state of the cart to the response, if the storage needs to.
+    """
+
+
+class DatabaseCartStorage(BaseCartStorage):
+  """
+    Cart kept in the Cart and CartItem tables, keyed by the session key.
+
+    The total quantity is denormalized in Cart.item_count and copied in the cache, so the
+    navbar badge is read without a query; a change of the count drops the copy, so that
+    every request (another tab, a double click) reads the new count. The cart page
+    recomputes the count from the items, which the cascade of a deleted product or the
+    admin change without it.
+
+    Attributes:
+      delete_cookie (bool): Whether the response must delete the cookie of a cart just moved to the database.
+  """
+
+  def __init__(self, request, delete_cookie=False):
+    super().__init__(request)
+    self.delete_cookie = delete_cookie
+
+  def session_cart_id(self):
+    """
+      Return the ID of the session's cart, or None if the visitor has no session yet.
+    """
+    return self.request.session.session_key
+
+  def get_session_cart(self):
+    """
+      Return the cart of the session, or None if it does not exist.
+    """
+    cart_id = self.session_cart_id()
+    return Cart.objects.filter(cart_id=cart_id).first() if cart_id else None
+
+  def count(self):
+    cart_id = self.session_cart_id()
+    if not cart_id:
+      return 0
+    count = cache.get(CART_COUNT_KEY % cart_id)
+    if count is None:
+      count = Cart.objects.filter(cart_id=cart_id).values_list('item_count', flat=True).first() or 0
+      cache.set(CART_COUNT_KEY % cart_id, count, CART_COUNT_TIMEOUT)
+    return count
+
+  def contains(self, product_id):
+    cart_id = self.session_cart_id()
+    return bool(cart_id) and CartItem.objects.filter(cart__cart_id=cart_id, product_id=product_id).exists()
+
+  def items(self):
+    cart_id = self.session_cart_id()
+    if not cart_id:
+      return []
+    # Two queries whatever the number of items
+    return list(
+      CartItem.objects.filter(cart__cart_id=cart_id, is_active=True)
+      .select_related('product__category')
+      .prefetch_related('variations')
+      .order_by('id')
+    )
+
+  def get_cart(self):
+    """
+      Return the cart of the session, creating the session and the cart if they do not exist yet.
+    """
+    return get_or_create_cart(_cart_id(self.request))
+
+  def add(self, product, variations, quantity=1):
+    cart = self.get_cart()
+    added = add_item(cart, product, variations, quantity)
+    if added:
+      self.change_count(cart, added)
+    return added
+
+  def add_many(self, entries):
+    cart = self.get_cart()
+    added = add_items(cart, entries)
+    self.change_count(cart, sum(added.values()))
+    return added
+
+  def decrement(self, product_id, item_id):
+    cart = self.get_session_cart()
+    removed = decrement_item(cart, product_id, item_id) if cart else 0
+    if removed:
+      self.change_count(cart, -removed)
+    return removed
+
+  def remove(self, product_id, item_id):
+    cart = self.get_session_cart()
+    removed = remove_item(cart, product_id, item_id) if cart else 0
+    if removed:
+      self.change_count(cart, -removed)
+    return removed
+
+  def set_quantity(self, product_id, item_id, quantity):
+    cart = self.get_session_cart()
+    delta = set_item_quantity(cart, product_id, item_id, quantity) if cart else 0
+    if delta:
+      self.change_count(cart, delta)
+    return delta
+
+  def change_count(self, cart, delta):
+    """
+      Add `delta` to the item count of a cart and drop its cached copy.
+
+      The count is changed with a single UPDATE, so concurrent requests cannot lose an update.
+    """
+    Cart.objects.filter(pk=cart.pk).update(item_count=Greatest(F('item_count') + delta, 0), last_activity=timezone.now())
+    self.forget_count(cart.cart_id)
+
+  def refresh_count(self):
+    cart_id = self.session_cart_id()
+    if not cart_id:
+      return
+    totals = CartItem.objects.filter(cart=OuterRef('pk')).values('cart').annotate(total=Sum('quantity')).values('total')
+    total = Coalesce(Subquery(totals), 0)
+    if Cart.objects.filter(cart_id=cart_id).exclude(item_count=total).update(item_count=total):
+      self.forget_count(cart_id)
+
+  def forget_count(self, cart_id):
+    """
+      Drop the cached count of a cart, at once and again after the commit, in case a
+      concurrent request cached the previous count meanwhile.
+    """
+    key = CART_COUNT_KEY % cart_id
+    cache.delete(key)
+    transaction.on_commit(lambda: cache.delete(key))
+
+  def finalize(self, response):
+    if self.delete_cookie:
+      response.delete_cookie(CART_COOKIE_NAME, samesite='Lax')
+
+
+class WriteBehindCartStorage(DatabaseCartStorage):
+  """
+    Database cart whose quantity changes are coalesced in the cache before being written.
+
+    Adding a unit of an existing item and removing a unit are recorded in the cache (see
+    carts.writebehind) instead of updating the database; reads add the pending changes to
+    the values of the database. The changes are flushed in batches with bulk_update every
+    settings.CART_WRITE_BEHIND_BATCH changes or settings.CART_WRITE_BEHIND_INTERVAL seconds,
+    and by the flush_cart_writes command. New items and removed items are written at once.
+  """
+
+  def count(self):
+    cart_id = self.session_cart_id()
+    row = Cart.objects.filter(cart_id=cart_id).values_list('pk', 'item_count').first() if cart_id else None
+    if row is None:
+      return 0
+    return pending_cart_count(*row)
+
+  def contains(self, product_id):
+    return any(item.product_id == product_id for item in self.items())
+
+  def items(self):
+    items = super().items()
+    deltas = pending_item_deltas([item.id for item in items])
+    for item in items:
+      item.quantity += deltas[item.id]
+    return [item for item in items if item.quantity > 0]
+
+  def add(self, product, variations, quantity=1):
+    cart = self.get_cart()
+    signature = variation_signature(variation.pk for variation in variations)
+    row = (
+      CartItem.objects.filter(cart=cart, product=product, variation_signature=signature)
+      .values_list('id', 'quantity').first()
+    )
+    if row is None:
+      added = add_item(cart, product, variations, quantity)
+      if added:
+        self.change_count(cart, added)
+    else:
+      item_id, current = row
+      added = units_up_to_max(current + pending_item_deltas([item_id])[item_id], quantity)
+      if added:
+        record_change(cart.pk, item_id, added)
+    maybe_flush()
+    return added
+
+  def decrement(self, product_id, item_id):
+    cart = self.get_session_cart()
+    if cart is None:
+      return 0
+    quantity = CartItem.objects.filter(cart=cart, product_id=product_id, id=item_id).values_list('quantity', flat=True).first()
+    if quantity is None or quantity + pending_item_deltas([item_id])[item_id] <= 0:
+      return 0
+    record_change(cart.pk, item_id, -1)
+    maybe_flush()
+    return 1
+
+  def remove(self, product_id, item_id):
+    # Apply the pending changes of the cart first, so that the removed quantity is exact
+    cart = self.get_session_cart()
+    if cart is not None:
+      apply_cart_writes(cart.pk)
+    return super().remove(product_id, item_id)
+
+  def set_quantity(self, product_id, item_id, quantity):
+    if quantity <= 0:
+      return -self.remove(product_id, item_id)
+    cart = self.get_session_cart()
+    if cart is None:
+      return 0
+    current = CartItem.objects.filter(cart=cart, product_id=product_id, id=item_id).values_list('quantity', flat=True).first()
+    if current is None:
+      return 0
+    delta = quantity - current - pending_item_deltas([item_id])[item_id]
+    if delta:
+      record_change(cart.pk, item_id, delta)
+      maybe_flush()
+    return delta
+
+  def change_count(self, cart, delta):
+    # The count is read with the pending changes, it is not mirrored in the session
+    Cart.objects.filter(pk=cart.pk).update(item_count=Greatest(F('item_count') + delta, 0), last_activity=timezone.now())
+
+
+class CookieCartItem:
+  """
+    Item of a cart kept in a cookie, with the interface of CartItem used by the cart page.
+
+    Attributes:
+      id (int): The ID of the line in the cookie.
+      product (Product): The product, with its category loaded.
+      variations (list): The selected variations of the product.
+      quantity (int): The quantity of the product.
+  """
+
+  def __init__(self, id, product, variations, quantity):
+    self.id = id
+    self.product = product
+    self.variations = variations
+    self.quantity = quantity
+
+  def sub_total(self):
+    return self.product.price * self.quantity
+
+  def selected_variations(self):
+    return self.variations
+
+  def sizes(self):
+    return [variation for variation in self.variations if variation.variation_category == 'size' and variation.is_active]
+
+  def colors(self):
+    return [variation for variation in self.variations if variation.variation_category == 'color' and variation.is_active]
+
+
+class CookieCartStorage(BaseCartStorage):
+  """
+    Cart of an anonymous visitor kept in a signed cookie, without session or database row.
+
+    The cookie holds the next line ID and one [line ID, product ID, variation IDs, quantity]
+    list per line. The cart is moved to the database when it grows past
+    settings.CART_COOKIE_MAX_LINES lines or when the visitor logs in; the session is then
+    flagged so that the following requests use the database storage.
+  """
+
+  def __init__(self, request):
+    super().__init__(request)
+    self.next_id, self.lines = 1, []
+    self.changed = False
+    value = request.COOKIES.get(CART_COOKIE_NAME)
+    if value:
+      try:
+        data = signing.loads(value, salt=CART_COOKIE_SALT)
+        self.next_id, self.lines = data['n'], data['l']
+      except (signing.BadSignature, KeyError, TypeError, ValueError):
+        self.changed = True
+
+  def count(self):
+    return sum(line[3] for line in self.lines)
+
+  def contains(self, product_id):
+    return any(line[1] == product_id for line in self.lines)
+
+  def items(self):
+    if not self.lines:
+      return []
+    products = Product.objects.select_related('category').in_bulk([line[1] for line in self.lines])
+    variation_ids = set(pk for line in self.lines for pk in line[2])
+    variations = Variation.objects.in_bulk(variation_ids) if variation_ids else {}
+    items = []
+    for line_id, product_id, line_variations, quantity in self.lines:
+      if product_id in products:
+        selected = [variations[pk] for pk in line_variations if pk in variations]
+        items.append(CookieCartItem(line_id, products[product_id], selected, quantity))
+    return items
+
+  def add(self, product, variations, quantity=1):
+    return self.add_many([(product, variations, quantity)])[product.pk]
+
+  def add_many(self, entries):
+    added = {}
+    for product, variations, quantity in entries:
+      signature = variation_signature(variation.pk for variation in variations)
+      for line in self.lines:
+        if line[1] == product.pk and variation_signature(line[2]) == signature:
+          units = units_up_to_max(line[3], quantity)
+          line[3] += units
+          break
+      else:
+        units = min(quantity, MAX_ITEM_QUANTITY)
+        self.lines.append([self.next_id, product.pk, sorted(variation.pk for variation in variations), units])
+        self.next_id += 1
+      added[product.pk] = added.get(product.pk, 0) + units
+    self.changed = True
+    if len(self.lines) > getattr(settings, 'CART_COOKIE_MAX_LINES', 20):
+      self.flush()
+    return added
+
+  def decrement(self, product_id, item_id):
+    for line in self.lines:
+      if line[0] == item_id and line[1] == product_id:
+        line[3] -= 1
+        if line[3] <= 0:
+          self.lines.remove(line)
+        self.changed = True
+        return 1
+    return 0
+
+  def remove(self, product_id, item_id):
+    for line in self.lines:
+      if line[0] == item_id and line[1] == product_id:
+        self.lines.remove(line)
+        self.changed = True
+        return line[3]
+    return 0
+
+  def set_quantity(self, product_id, item_id, quantity):
+    for line in self.lines:
+      if line[0] == item_id and line[1] == product_id:
+        delta = max(quantity, 0) - line[3]
+        if quantity > 0:
+          line[3] = quantity
+        else:
+          self.lines.remove(line)
+        self.changed = True
+        return delta
+    return 0
+
+  def flush(self):
+    """
+      Move the cart to the database storage of the session and empty the cookie.
+
+      Returns:
+        DatabaseCartStorage: The storage now holding the cart.
+    """
+    database = DatabaseCartStorage(self.request, delete_cookie=True)
+    items = self.items()
+    if items:
+      database.add_many([(item.product, item.variations, item.quantity) for item in items])
+    self.request.session[CART_IN_DATABASE] = True
+    self.lines = []
+    self.request._cart_storage = database
+    return database
+
+  def finalize(self, response):
+    if not self.changed:
+      return
+    if self.lines:
+      response.set_cookie(
+        CART_COOKIE_NAME,
+        signing.dumps({'n': self.next_id, 'l': self.lines}, salt=CART_COOKIE_SALT, compress=True),
+        max_age=getattr(settings, 'CART_COOKIE_AGE', 60 * 60 * 24 * 30),
+        httponly=True,
+        samesite='Lax',
+      )
+    else:
+      response.delete_cookie(CART_COOKIE_NAME, samesite='Lax')
+
+
+def get_cart_storage(request):
+  """
+    Return the cart storage of a request, created once per request.
+
+    With settings.CART_STORAGE = 'cookie', anonymous visitors whose cart was not moved to
+    the database get a CookieCartStorage; with 'write_behind', everybody gets a
+    WriteBehindCartStorage; otherwise everybody gets a DatabaseCartStorage.
+  """
+  storage = getattr(request, '_cart_storage', None)
+  if storage is None:
+    mode = getattr(settings, 'CART_STORAGE', 'database')
+    if mode == 'write_behind':
+      storage = WriteBehindCartStorage(request)
+    elif mode == 'cookie' and not request.user.is_authenticated and not request.session.get(CART_IN_DATABASE):
+      storage = CookieCartStorage(request)
+    else:
+      storage = DatabaseCartStorage(request)
+    request._cart_storage = storage
+  return storage
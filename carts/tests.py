@@ -1,10 +1,25 @@
-from django.test import TestCase
+import json
+from io import StringIO
+from django.core.exceptions import ValidationError
+from django.core.management import CommandError, call_command
+from django.test import TestCase, TransactionTestCase, override_settings, skipUnlessDBFeature
+from django.contrib.sessions.models import Session
+from accounts.models import Account
 from django.contrib.auth.models import User
-from carts.models import Cart, CartItem
-from store.models import Product
+from carts.models import Cart, CartItem, Promotion
+from carts.promotions import compile_promotions, promotion_index
+from store.models import Product, Variation
 from category.models import Category
-from datetime import date
+from datetime import date, timedelta
 from django.utils import timezone
+from django.db import IntegrityError, connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.conf import settings
+from carts.storage import CART_COUNT_KEY, DatabaseCartStorage
+from carts.services import MAX_ITEM_QUANTITY, add_item, decrement_item, remove_item, variation_signature
+from carts.writebehind import SEQUENCE_KEY, _entry_key, flush_pending_writes, journal_cache, pending_writes, record_change
+from django.core.cache import cache
 
 
 class CartModelTest(TestCase):
@@ -237,3 +252,1173 @@ class CartModelTest(TestCase):
     self.cart_item.delete()
     final_cart_item_count = CartItem.objects.filter(cart=self.cart).count()
     self.assertEqual(final_cart_item_count, initial_cart_item_count - 1)
+
+
+class CartCountTest(TestCase):
+  """
+    Test class for the denormalized item count of the cart.
+
+    Methods:
+      setUpTestData: Set up initial data for the test class.
+      test_add_cart_increments_count: Test if adding products increments the item count.
+      test_remove_cart_decrements_count: Test if removing one unit decrements the item count.
+      test_remove_cart_item_subtracts_quantity: Test if removing a cart item subtracts its quantity.
+      test_counter_cached: Test if the navbar count is read from the cache, shared by the requests of the cart.
+      test_cart_page_recomputes_count: Test if the cart page corrects a count the cascade of a deleted product left behind.
+  """
+  @classmethod
+  def setUpTestData(cls):
+    """
+      Set up initial data for the test class.
+
+      Creates a test category and a test product under the category.
+    """
+    category = Category.objects.create(category_name='count category', slug='count-category')
+    cls.product = Product.objects.create(
+      product_name='Count product', slug='count-product', price=10, category=category,
+      images='photos/products/x.jpg',
+    )
+
+
+  def _cart(self):
+    return Cart.objects.get(cart_id=self.client.session.session_key)
+
+
+  def test_add_cart_increments_count(self):
+    """
+      Test if adding products increments the item count.
+    """
+    self.client.get(reverse('add_cart', args=[self.product.id]))
+    self.client.get(reverse('add_cart', args=[self.product.id]))
+    self.assertEqual(self._cart().item_count, 2)
+    self.assertEqual(cache.get(CART_COUNT_KEY % self._cart().cart_id), None)
+
+
+  def test_remove_cart_decrements_count(self):
+    """
+      Test if removing one unit decrements the item count.
+    """
+    self.client.get(reverse('add_cart', args=[self.product.id]))
+    self.client.get(reverse('add_cart', args=[self.product.id]))
+    item = CartItem.objects.get(cart=self._cart())
+    self.client.get(reverse('remove_cart', args=[self.product.id, item.id]))
+    self.assertEqual(self._cart().item_count, 1)
+
+
+  def test_remove_cart_item_subtracts_quantity(self):
+    """
+      Test if removing a cart item subtracts its quantity.
+    """
+    for _ in range(3):
+      self.client.get(reverse('add_cart', args=[self.product.id]))
+    item = CartItem.objects.get(cart=self._cart())
+    self.client.get(reverse('remove_cart_item', args=[self.product.id, item.id]))
+    self.assertEqual(self._cart().item_count, 0)
+
+
+  def test_counter_cached(self):
+    """
+      Test if the navbar count is read from the cache, shared by the requests of the cart.
+    """
+    self.client.get(reverse('add_cart', args=[self.product.id]))
+    self.assertEqual(self.client.get(reverse('store')).context['cart_count'], 1)
+    with CaptureQueriesContext(connection) as queries:
+      response = self.client.get(reverse('store'))
+    self.assertEqual(response.context['cart_count'], 1)
+    self.assertFalse(any(query['sql'].startswith('SELECT "carts_cart"."item_count" FROM') for query in queries.captured_queries))
+    # A change made by another request of the session is seen at once
+    cart = self._cart()
+    DatabaseCartStorage(None).change_count(cart, 2)
+    self.assertEqual(self.client.get(reverse('store')).context['cart_count'], 3)
+
+
+  def test_cart_page_recomputes_count(self):
+    """
+      Test if the cart page corrects a count the cascade of a deleted product left behind.
+    """
+    other = Product.objects.create(product_name='Other product', slug='other-product', price=10, category=self.product.category)
+    self.client.get(reverse('add_cart', args=[self.product.id]))
+    self.client.get(reverse('add_cart', args=[other.id]))
+    self.assertEqual(self.client.get(reverse('store')).context['cart_count'], 2)
+    other.delete()
+    self.assertEqual(self.client.get(reverse('cart')).context['cart_count'], 1)
+    self.assertEqual(self._cart().item_count, 1)
+
+
+class CartVariationSignatureTest(TestCase):
+  """
+    Test class for the variation signature of the cart items.
+
+    Methods:
+      setUpTestData: Set up initial data for the test class.
+      test_signature_is_canonical: Test if the signature does not depend on the order of the variations.
+      test_same_variations_increment_item: Test if adding the same variations twice increments one item.
+      test_other_variations_create_item: Test if adding other variations creates another item.
+      test_variations_resolved_in_one_query: Test if the selected variations are resolved with one query.
+      test_unique_signature: Test if two items cannot share the same cart, product and signature.
+  """
+  @classmethod
+  def setUpTestData(cls):
+    """
+      Set up initial data for the test class.
+
+      Creates a product with two sizes and a color.
+    """
+    category = Category.objects.create(category_name='variation category', slug='variation-category')
+    cls.product = Product.objects.create(
+      product_name='Variation product', slug='variation-product', price=10, category=category,
+      images='photos/products/x.jpg',
+    )
+    cls.small = Variation.objects.create(product=cls.product, variation_category='size', variation_value='S')
+    cls.large = Variation.objects.create(product=cls.product, variation_category='size', variation_value='L')
+    cls.red = Variation.objects.create(product=cls.product, variation_category='color', variation_value='Red')
+
+
+  def _add(self, **data):
+    return self.client.post(reverse('add_cart', args=[self.product.id]), data)
+
+
+  def test_signature_is_canonical(self):
+    """
+      Test if the signature does not depend on the order of the variations.
+    """
+    self.assertEqual(variation_signature([3, 1, 2, 1]), '1,2,3')
+    self.assertEqual(variation_signature([]), '')
+
+
+  def test_same_variations_increment_item(self):
+    """
+      Test if adding the same variations twice increments one item.
+    """
+    self._add(size='s', color='red')
+    self._add(color='Red', size='S')
+    item = CartItem.objects.get(product=self.product)
+    self.assertEqual(item.quantity, 2)
+    self.assertEqual(item.variation_signature, variation_signature([self.small.pk, self.red.pk]))
+    self.assertEqual(set(item.variations.all()), {self.small, self.red})
+
+
+  def test_other_variations_create_item(self):
+    """
+      Test if adding other variations creates another item.
+    """
+    self._add(size='S', color='Red')
+    self._add(size='L', color='Red')
+    self._add()
+    self.assertEqual(CartItem.objects.filter(product=self.product).count(), 3)
+
+
+  def test_variations_resolved_in_one_query(self):
+    """
+      Test if the selected variations are resolved with one query.
+    """
+    with CaptureQueriesContext(connection) as queries:
+      self._add(size='S', color='Red', csrfmiddlewaretoken='token')
+    variation_queries = [query for query in queries.captured_queries if 'FROM "store_variation"' in query['sql']]
+    self.assertEqual(len(variation_queries), 1)
+
+
+  def test_unique_signature(self):
+    """
+      Test if two items cannot share the same cart, product and signature.
+    """
+    cart = Cart.objects.create(cart_id='signature')
+    CartItem.objects.create(cart=cart, product=self.product, quantity=1, variation_signature='1')
+    with self.assertRaises(IntegrityError):
+      with transaction.atomic():
+        CartItem.objects.create(cart=cart, product=self.product, quantity=1, variation_signature='1')
+
+
+class CartConcurrencyTest(TransactionTestCase):
+  """
+    Test class for the concurrent cart mutations.
+
+    Methods:
+      setUp: Set up environment for each test.
+      test_decrement_keeps_last_unit_until_zero: Test if decrementing deletes the item with its last unit.
+      test_remove_item_returns_quantity: Test if removing an item returns its quantity.
+      test_add_item_capped: Test if adding units never raises an item past the maximum quantity.
+      test_benchmark_command: Test the benchmark command with a single thread.
+      test_benchmark_loses_no_update: Test if concurrent additions and removals on one cart lose no update.
+  """
+  def setUp(self):
+    """
+      Set up environment for each test.
+
+      Creates a category, a product and a cart.
+    """
+    category = Category.objects.create(category_name='concurrency category', slug='concurrency-category')
+    self.product = Product.objects.create(
+      product_name='Concurrency product', slug='concurrency-product', price=10, category=category,
+    )
+    self.cart = Cart.objects.create(cart_id='concurrency')
+
+
+  def test_decrement_keeps_last_unit_until_zero(self):
+    """
+      Test if decrementing deletes the item with its last unit.
+    """
+    add_item(self.cart, self.product, [])
+    add_item(self.cart, self.product, [])
+    item = CartItem.objects.get(cart=self.cart)
+    self.assertEqual(decrement_item(self.cart, self.product.id, item.id), 1)
+    self.assertEqual(CartItem.objects.get(id=item.id).quantity, 1)
+    self.assertEqual(decrement_item(self.cart, self.product.id, item.id), 1)
+    self.assertFalse(CartItem.objects.filter(id=item.id).exists())
+    self.assertEqual(decrement_item(self.cart, self.product.id, item.id), 0)
+
+
+  def test_remove_item_returns_quantity(self):
+    """
+      Test if removing an item returns its quantity.
+    """
+    for _ in range(3):
+      add_item(self.cart, self.product, [])
+    item = CartItem.objects.get(cart=self.cart)
+    self.assertEqual(remove_item(self.cart, self.product.id, item.id), 3)
+    self.assertEqual(remove_item(self.cart, self.product.id, item.id), 0)
+
+
+  def test_add_item_capped(self):
+    """
+      Test if adding units never raises an item past the maximum quantity.
+    """
+    self.assertEqual(add_item(self.cart, self.product, [], MAX_ITEM_QUANTITY - 1), MAX_ITEM_QUANTITY - 1)
+    self.assertEqual(add_item(self.cart, self.product, [], 5), 1)
+    self.assertEqual(add_item(self.cart, self.product, [], 5), 0)
+    self.assertEqual(CartItem.objects.get(cart=self.cart).quantity, MAX_ITEM_QUANTITY)
+
+
+  def test_benchmark_command(self):
+    """
+      Test the benchmark command with a single thread.
+    """
+    out = StringIO()
+    call_command('benchmark_cart', threads=1, operations=10, removals=4, stdout=out)
+    self.assertIn('final quantity 6 (expected 6)', out.getvalue())
+    with self.assertRaises(CommandError):
+      call_command('benchmark_cart', threads=1, operations=10, removals=4, min_ops=float('inf'), stdout=StringIO())
+
+
+  @skipUnlessDBFeature('test_db_allows_multiple_connections')
+  def test_benchmark_loses_no_update(self):
+    """
+      Test if concurrent additions and removals on one cart lose no update.
+
+      The benchmark command raises CommandError on a lost update or a throughput below --min-ops.
+      SQLite test databases do not support concurrent connections, so this runs on MySQL only.
+    """
+    out = StringIO()
+    call_command('benchmark_cart', threads=4, operations=20, removals=5, min_ops=1, stdout=out)
+    self.assertIn('final quantity 60 (expected 60)', out.getvalue())
+    self.assertFalse(Cart.objects.filter(cart_id__startswith='benchmark-').exists())
+
+
+class CartPageQueryTest(TestCase):
+  """
+    Test class for the number of queries of the cart page.
+
+    Methods:
+      setUpTestData: Set up initial data for the test class.
+      _cart_page_queries: Fill the cart with some products and count the queries of the cart page.
+      test_query_count_does_not_grow: Test if a large cart renders with as many queries as a small one.
+      test_totals: Test the subtotal, quantity and tax of the cart page.
+  """
+  @classmethod
+  def setUpTestData(cls):
+    """
+      Set up initial data for the test class.
+
+      Creates six products, each with a size and a color.
+    """
+    category = Category.objects.create(category_name='page category', slug='page-category')
+    cls.products = []
+    for index in range(6):
+      product = Product.objects.create(
+        product_name='Page product %d' % index, title_online='Page product %d' % index,
+        slug='page-product-%d' % index, price=10 + index,
+        category=category, images='photos/products/x.jpg',
+      )
+      Variation.objects.create(product=product, variation_category='size', variation_value='M')
+      Variation.objects.create(product=product, variation_category='color', variation_value='Blue')
+      cls.products.append(product)
+
+
+  def _cart_page_queries(self, count):
+    for product in self.products[:count]:
+      self.client.post(reverse('add_cart', args=[product.id]), {'size': 'M', 'color': 'Blue'})
+    # Load the in-process category tree and facets before counting
+    self.client.get(reverse('cart'))
+    with CaptureQueriesContext(connection) as queries:
+      response = self.client.get(reverse('cart'))
+    self.assertEqual(len(response.context['cart_items']), count)
+    return len(queries.captured_queries)
+
+
+  def test_query_count_does_not_grow(self):
+    """
+      Test if a large cart renders with as many queries as a small one.
+    """
+    small = self._cart_page_queries(1)
+    self.client.cookies.clear()
+    large = self._cart_page_queries(6)
+    self.assertEqual(small, large)
+
+
+  def test_totals(self):
+    """
+      Test the subtotal, quantity and tax of the cart page.
+    """
+    self.client.get(reverse('add_cart', args=[self.products[0].id]))
+    self.client.get(reverse('add_cart', args=[self.products[0].id]))
+    self.client.get(reverse('add_cart', args=[self.products[1].id]))
+    response = self.client.get(reverse('cart'))
+    self.assertEqual(response.context['total'], 31)
+    self.assertEqual(response.context['quantity'], 3)
+    self.assertEqual(response.context['tax'], 6.2)
+    self.assertContains(response, 'Page product 0')
+
+
+@override_settings(CART_STORAGE='cookie', CART_COOKIE_MAX_LINES=3)
+class CookieCartStorageTest(TestCase):
+  """
+    Test class for the signed-cookie cart of anonymous visitors.
+
+    Methods:
+      setUpTestData: Set up initial data for the test class.
+      test_anonymous_cart_writes_nothing: Test if adding to the cart writes no session, cart or item row.
+      test_cart_page_and_badge: Test if the cart page and the badge read the cookie.
+      test_decrement_and_remove: Test if the quantity buttons change the cookie.
+      test_tampered_cookie_is_ignored: Test if a cookie with a bad signature is dropped.
+      test_moved_to_database_past_limit: Test if the cart is moved to the database past the line limit.
+      test_moved_to_database_at_login: Test if the cart is moved to the database when the visitor logs in.
+  """
+  @classmethod
+  def setUpTestData(cls):
+    """
+      Set up initial data for the test class.
+
+      Creates four products, the first one with a size.
+    """
+    category = Category.objects.create(category_name='cookie category', slug='cookie-category')
+    cls.products = [
+      Product.objects.create(
+        product_name='Cookie product %d' % index, title_online='Cookie product %d' % index,
+        slug='cookie-product-%d' % index, price=10, category=category, images='photos/products/x.jpg',
+      )
+      for index in range(4)
+    ]
+    cls.size = Variation.objects.create(product=cls.products[0], variation_category='size', variation_value='M')
+
+
+  def _add(self, product, **data):
+    return self.client.post(reverse('add_cart', args=[product.id]), data)
+
+
+  def test_anonymous_cart_writes_nothing(self):
+    """
+      Test if adding to the cart writes no session, cart or item row.
+    """
+    self._add(self.products[0], size='M')
+    self._add(self.products[0], size='M')
+    self.assertIn('cart', self.client.cookies)
+    self.assertFalse(Session.objects.exists())
+    self.assertFalse(Cart.objects.exists())
+    self.assertFalse(CartItem.objects.exists())
+
+
+  def test_cart_page_and_badge(self):
+    """
+      Test if the cart page and the badge read the cookie.
+    """
+    self._add(self.products[0], size='M')
+    self._add(self.products[0], size='M')
+    self._add(self.products[1])
+    response = self.client.get(reverse('cart'))
+    self.assertEqual(response.context['cart_count'], 3)
+    self.assertEqual(response.context['quantity'], 3)
+    self.assertEqual(response.context['total'], 30)
+    first = response.context['cart_items'][0]
+    self.assertEqual(first.sizes(), [self.size])
+    self.assertContains(response, 'Cookie product 1')
+
+
+  def test_decrement_and_remove(self):
+    """
+      Test if the quantity buttons change the cookie.
+    """
+    self._add(self.products[0])
+    self._add(self.products[0])
+    self._add(self.products[1])
+    items = self.client.get(reverse('cart')).context['cart_items']
+    self.client.get(reverse('remove_cart', args=[self.products[0].id, items[0].id]))
+    self.client.get(reverse('remove_cart_item', args=[self.products[1].id, items[1].id]))
+    items = self.client.get(reverse('cart')).context['cart_items']
+    self.assertEqual([(item.product, item.quantity) for item in items], [(self.products[0], 1)])
+    self.client.get(reverse('remove_cart', args=[self.products[0].id, items[0].id]))
+    self.assertEqual(self.client.get(reverse('cart')).context['cart_items'], [])
+
+
+  def test_tampered_cookie_is_ignored(self):
+    """
+      Test if a cookie with a bad signature is dropped.
+    """
+    self.client.cookies['cart'] = 'forged'
+    response = self.client.get(reverse('cart'))
+    self.assertEqual(response.context['cart_count'], 0)
+    self.assertEqual(response.cookies['cart'].value, '')
+
+
+  def test_moved_to_database_past_limit(self):
+    """
+      Test if the cart is moved to the database past the line limit.
+    """
+    for product in self.products:
+      self._add(product)
+    self.assertEqual(self.client.cookies['cart'].value, '')
+    cart = Cart.objects.get()
+    self.assertEqual(cart.item_count, 4)
+    self.assertEqual(CartItem.objects.filter(cart=cart).count(), 4)
+    self._add(self.products[0])
+    self.assertEqual(self.client.get(reverse('cart')).context['cart_count'], 5)
+
+
+  def test_moved_to_database_at_login(self):
+    """
+      Test if the cart is moved to the database when the visitor logs in.
+    """
+    self._add(self.products[0], size='M')
+    self._add(self.products[1])
+    user = Account.objects.create_user(first_name='cookie', last_name='user', email='cookie@user.com', username='cookie', password='password')
+    user.is_active = True
+    user.save()
+    self.client.post(reverse('login'), {'email': 'cookie@user.com', 'password': 'password'})
+    self.assertEqual(self.client.cookies['cart'].value, '')
+    item = CartItem.objects.get(product=self.products[0])
+    self.assertEqual(list(item.variations.all()), [self.size])
+    response = self.client.get(reverse('cart'))
+    self.assertEqual(response.context['cart_count'], 2)
+
+
+@override_settings(CART_STORAGE='write_behind', CART_WRITE_BEHIND_BATCH=100, CART_WRITE_BEHIND_INTERVAL=3600)
+class WriteBehindCartStorageTest(TestCase):
+  """
+    Test class for the write-behind cart storage.
+
+    Methods:
+      setUpTestData: Set up initial data for the test class.
+      setUp: Set up environment for each test.
+      test_clicks_are_coalesced: Test if quantity changes are read back without being written.
+      test_flush_applies_changes: Test if the flush writes the merged changes with their count.
+      test_batch_size_triggers_flush: Test if the changes are flushed once the batch is full.
+      test_last_unit_removed_at_flush: Test if an item without unit is hidden, then deleted by the flush.
+      test_remove_applies_pending_changes: Test if removing an item drops its pending changes.
+      test_remove_leaves_other_carts_pending: Test if removing an item applies the changes of its cart only.
+      test_count_matches_clamped_items: Test if the count clamps the pending changes like the items.
+      test_set_quantity_is_recorded: Test if setting the quantity records the difference with the pending changes.
+      test_lost_entry_skipped: Test if a journal entry lost for longer than the grace period no longer blocks the flush.
+  """
+  @classmethod
+  def setUpTestData(cls):
+    """
+      Set up initial data for the test class.
+
+      Creates a test category and a test product under the category.
+    """
+    category = Category.objects.create(category_name='write category', slug='write-category')
+    cls.product = Product.objects.create(
+      product_name='Write product', title_online='Write product', slug='write-product',
+      price=10, category=category, images='photos/products/x.jpg',
+    )
+
+
+  def setUp(self):
+    """
+      Set up environment for each test.
+
+      Empties the caches, and the journal holding the pending changes.
+    """
+    cache.clear()
+    journal_cache().clear()
+
+
+  def _add(self, times=1):
+    for _ in range(times):
+      self.client.get(reverse('add_cart', args=[self.product.id]))
+    return CartItem.objects.get(product=self.product)
+
+
+  def test_clicks_are_coalesced(self):
+    """
+      Test if quantity changes are read back without being written.
+    """
+    item = self._add()
+    with CaptureQueriesContext(connection) as queries:
+      self._add(5)
+      self.client.get(reverse('remove_cart', args=[self.product.id, item.id]))
+    self.assertFalse(any(query['sql'].startswith('UPDATE "carts_cartitem"') for query in queries.captured_queries))
+    self.assertEqual(CartItem.objects.get(id=item.id).quantity, 1)
+    response = self.client.get(reverse('cart'))
+    self.assertEqual(response.context['cart_count'], 5)
+    self.assertEqual(response.context['cart_items'][0].quantity, 5)
+    self.assertEqual(response.context['total'], 50)
+
+
+  def test_flush_applies_changes(self):
+    """
+      Test if the flush writes the merged changes with their count.
+    """
+    item = self._add(4)
+    out = StringIO()
+    call_command('flush_cart_writes', stdout=out)
+    self.assertIn('Applied 3 of 3', out.getvalue())
+    self.assertEqual(CartItem.objects.get(id=item.id).quantity, 4)
+    self.assertEqual(Cart.objects.get().item_count, 4)
+    self.assertEqual(pending_writes(), 0)
+    self.assertEqual(self.client.get(reverse('cart')).context['cart_count'], 4)
+
+
+  @override_settings(CART_WRITE_BEHIND_BATCH=3)
+  def test_batch_size_triggers_flush(self):
+    """
+      Test if the changes are flushed once the batch is full.
+    """
+    item = self._add(3)
+    self.assertEqual(CartItem.objects.get(id=item.id).quantity, 1)
+    self._add()
+    self.assertEqual(CartItem.objects.get(id=item.id).quantity, 4)
+    self.assertEqual(pending_writes(), 0)
+
+
+  def test_last_unit_removed_at_flush(self):
+    """
+      Test if an item without unit is hidden, then deleted by the flush.
+    """
+    item = self._add(2)
+    self.client.get(reverse('remove_cart', args=[self.product.id, item.id]))
+    self.client.get(reverse('remove_cart', args=[self.product.id, item.id]))
+    self.client.get(reverse('remove_cart', args=[self.product.id, item.id]))
+    response = self.client.get(reverse('cart'))
+    self.assertEqual(response.context['cart_items'], [])
+    self.assertEqual(response.context['cart_count'], 0)
+    flush_pending_writes()
+    self.assertFalse(CartItem.objects.exists())
+    self.assertEqual(Cart.objects.get().item_count, 0)
+
+
+  def test_remove_applies_pending_changes(self):
+    """
+      Test if removing an item drops its pending changes.
+    """
+    item = self._add(3)
+    self.client.get(reverse('remove_cart_item', args=[self.product.id, item.id]))
+    self.assertFalse(CartItem.objects.exists())
+    self.assertEqual(self.client.get(reverse('cart')).context['cart_count'], 0)
+    # The journal entries of the cart are skipped by the next flush
+    self.assertEqual(pending_writes(), 2)
+    flush_pending_writes()
+    self.assertEqual(Cart.objects.get().item_count, 0)
+    self.assertEqual(pending_writes(), 0)
+
+
+  def test_remove_leaves_other_carts_pending(self):
+    """
+      Test if removing an item applies the changes of its cart only.
+    """
+    item = self._add(3)
+    other_cart = Cart.objects.create(cart_id='other', item_count=1)
+    other_item = CartItem.objects.create(cart=other_cart, product=self.product, quantity=1)
+    record_change(other_cart.pk, other_item.id, 2)
+    self.client.get(reverse('remove_cart_item', args=[self.product.id, item.id]))
+    self.assertFalse(CartItem.objects.filter(id=item.id).exists())
+    self.assertEqual(CartItem.objects.get(id=other_item.id).quantity, 1)
+    self.assertEqual(pending_writes(), 3)
+    flush_pending_writes()
+    self.assertEqual(CartItem.objects.get(id=other_item.id).quantity, 3)
+    self.assertEqual(Cart.objects.get(pk=other_cart.pk).item_count, 3)
+    self.assertEqual(Cart.objects.exclude(pk=other_cart.pk).get().item_count, 0)
+    self.assertEqual(pending_writes(), 0)
+
+
+  def test_count_matches_clamped_items(self):
+    """
+      Test if the count clamps the pending changes like the items.
+    """
+    item = self._add()
+    self.client.get(reverse('add_cart', args=[self.product.id]))
+    second_product = Product.objects.create(
+      product_name='Second write product', title_online='Second write product', slug='second-write-product',
+      price=10, category=self.product.category, images='photos/products/x.jpg',
+    )
+    self.client.get(reverse('add_cart', args=[second_product.id]))
+    # Two concurrent removals of the same units
+    record_change(item.cart_id, item.id, -2)
+    record_change(item.cart_id, item.id, -2)
+    response = self.client.get(reverse('cart'))
+    self.assertEqual([line.product for line in response.context['cart_items']], [second_product])
+    self.assertEqual(response.context['cart_count'], 1)
+    flush_pending_writes()
+    self.assertFalse(CartItem.objects.filter(id=item.id).exists())
+    self.assertEqual(Cart.objects.get().item_count, 1)
+    self.assertEqual(self.client.get(reverse('cart')).context['cart_count'], 1)
+
+  def test_set_quantity_is_recorded(self):
+    """
+      Test if setting the quantity records the difference with the pending changes.
+    """
+    item = self._add(2)
+    state = self.client.post(reverse('cart_api_set_quantity', args=[self.product.id, item.id]), {'quantity': 7}).json()
+    self.assertEqual(state['line']['quantity'], 7)
+    self.assertEqual(CartItem.objects.get(id=item.id).quantity, 1)
+    flush_pending_writes()
+    self.assertEqual(CartItem.objects.get(id=item.id).quantity, 7)
+    self.assertEqual(Cart.objects.get().item_count, 7)
+
+
+  def test_lost_entry_skipped(self):
+    """
+      Test if a journal entry lost for longer than the grace period no longer blocks the flush.
+    """
+    item = self._add(3)
+    journal = journal_cache()
+    journal.delete(_entry_key(journal.get(SEQUENCE_KEY) - 1))
+    self.assertEqual(flush_pending_writes(), 0)
+    self.assertEqual(CartItem.objects.get(id=item.id).quantity, 1)
+    with override_settings(CART_WRITE_BEHIND_GRACE=0):
+      self.assertEqual(flush_pending_writes(), 2)
+    self.assertEqual(CartItem.objects.get(id=item.id).quantity, 3)
+    self.assertEqual(Cart.objects.get().item_count, 3)
+    self.assertEqual(pending_writes(), 0)
+    self._add()
+    flush_pending_writes()
+    self.assertEqual(CartItem.objects.get(id=item.id).quantity, 4)
+
+
+class CartPurgeTest(TestCase):
+  """
+    Test class for the unique cart ID and the purge_carts command.
+
+    Methods:
+      setUpTestData: Set up initial data for the test class.
+      test_cart_id_is_unique: Test if two carts cannot share a cart ID.
+      test_purge_old_carts: Test if the carts inactive for the age are deleted with their items, chunk by chunk.
+      test_dry_run: Test if a dry run deletes nothing.
+  """
+  @classmethod
+  def setUpTestData(cls):
+    """
+      Set up initial data for the test class.
+
+      Creates five inactive carts and an old one still changed recently, each with an item with a variation.
+    """
+    category = Category.objects.create(category_name='purge category', slug='purge-category')
+    product = Product.objects.create(product_name='Purge product', slug='purge-product', price=10, category=category)
+    size = Variation.objects.create(product=product, variation_category='size', variation_value='M')
+    for index in range(6):
+      cart = Cart.objects.create(cart_id='purge-%d' % index)
+      item = CartItem.objects.create(cart=cart, product=product, quantity=1, variation_signature=str(size.pk))
+      item.variations.add(size)
+    Cart.objects.update(date_added=date(2000, 1, 1))
+    Cart.objects.exclude(cart_id='purge-5').update(last_activity=timezone.now() - timedelta(days=365))
+
+
+  def test_cart_id_is_unique(self):
+    """
+      Test if two carts cannot share a cart ID.
+    """
+    with self.assertRaises(IntegrityError):
+      with transaction.atomic():
+        Cart.objects.create(cart_id='purge-0')
+
+
+  def test_purge_old_carts(self):
+    """
+      Test if the carts inactive for the age are deleted with their items, chunk by chunk.
+    """
+    out = StringIO()
+    call_command('purge_carts', days=30, chunk_size=2, stdout=out)
+    self.assertIn('Deleted 5 carts and 5 cart items', out.getvalue())
+    self.assertEqual(list(Cart.objects.values_list('cart_id', flat=True)), ['purge-5'])
+    self.assertEqual(CartItem.variations.through.objects.count(), 1)
+
+
+  def test_dry_run(self):
+    """
+      Test if a dry run deletes nothing.
+    """
+    out = StringIO()
+    call_command('purge_carts', days=30, dry_run=True, stdout=out)
+    self.assertIn('5 carts', out.getvalue())
+    self.assertEqual(Cart.objects.count(), 6)
+
+
+class CartApiTest(TestCase):
+  """
+    Test class for the JSON cart API.
+
+    Methods:
+      setUpTestData: Set up initial data for the test class.
+      test_add_returns_line_and_totals: Test if adding returns the line, the totals and the badge count.
+      test_decrement_and_set_quantity: Test if decrementing and setting the quantity return the updated line.
+      test_remove_returns_no_line: Test if removing an item returns no line.
+      test_invalid_quantity: Test if a negative, missing or too large quantity is rejected.
+      test_get_not_allowed: Test if the API only accepts POST requests.
+      test_cookie_storage: Test if the API works with the cookie cart.
+  """
+  @classmethod
+  def setUpTestData(cls):
+    """
+      Set up initial data for the test class.
+
+      Creates a product with a size.
+    """
+    category = Category.objects.create(category_name='api category', slug='api-category')
+    cls.product = Product.objects.create(
+      product_name='Api product', slug='api-product', price=12.5, category=category, images='photos/products/x.jpg',
+    )
+    cls.size = Variation.objects.create(product=cls.product, variation_category='size', variation_value='M')
+
+
+  def _add(self):
+    return self.client.post(reverse('cart_api_add', args=[self.product.id]), {'size': 'M'}).json()
+
+
+  def test_add_returns_line_and_totals(self):
+    """
+      Test if adding returns the line, the totals and the badge count.
+    """
+    self._add()
+    state = self._add()
+    self.assertEqual(state['line']['quantity'], 2)
+    self.assertEqual(state['line']['product_id'], self.product.id)
+    self.assertEqual(state['line']['sub_total'], 25)
+    self.assertEqual(state['total'], 25)
+    self.assertEqual(state['tax'], 5)
+    self.assertEqual(state['cart_count'], 2)
+
+
+  def test_decrement_and_set_quantity(self):
+    """
+      Test if decrementing and setting the quantity return the updated line.
+    """
+    line = self._add()['line']
+    url = reverse('cart_api_set_quantity', args=[self.product.id, line['id']])
+    state = self.client.post(url, {'quantity': 5}).json()
+    self.assertEqual(state['line']['quantity'], 5)
+    self.assertEqual(state['cart_count'], 5)
+    state = self.client.post(reverse('cart_api_decrement', args=[self.product.id, line['id']])).json()
+    self.assertEqual(state['line']['quantity'], 4)
+    state = self.client.post(url, {'quantity': 0}).json()
+    self.assertIsNone(state['line'])
+    self.assertEqual(state['cart_count'], 0)
+
+
+  def test_remove_returns_no_line(self):
+    """
+      Test if removing an item returns no line.
+    """
+    line = self._add()['line']
+    state = self.client.post(reverse('cart_api_remove', args=[self.product.id, line['id']])).json()
+    self.assertIsNone(state['line'])
+    self.assertEqual(state['total'], 0)
+    self.assertFalse(CartItem.objects.exists())
+
+
+  def test_invalid_quantity(self):
+    """
+      Test if a negative, missing or too large quantity is rejected.
+    """
+    line = self._add()['line']
+    url = reverse('cart_api_set_quantity', args=[self.product.id, line['id']])
+    self.assertEqual(self.client.post(url, {'quantity': -1}).status_code, 400)
+    self.assertEqual(self.client.post(url).status_code, 400)
+    self.assertEqual(self.client.post(url, {'quantity': 2 ** 63}).status_code, 400)
+    self.assertEqual(CartItem.objects.get().quantity, 1)
+
+
+  def test_get_not_allowed(self):
+    """
+      Test if the API only accepts POST requests.
+    """
+    self.assertEqual(self.client.get(reverse('cart_api_add', args=[self.product.id])).status_code, 405)
+
+
+  @override_settings(CART_STORAGE='cookie')
+  def test_cookie_storage(self):
+    """
+      Test if the API works with the cookie cart.
+    """
+    line = self._add()['line']
+    state = self.client.post(reverse('cart_api_set_quantity', args=[self.product.id, line['id']]), {'quantity': 3}).json()
+    self.assertEqual(state['cart_count'], 3)
+    self.assertFalse(Cart.objects.exists())
+
+
+
+class LazyCartIdentityTest(TestCase):
+  """
+    Test class for the lazy cart identity.
+
+    Methods:
+      setUpTestData: Set up initial data for the test class.
+      test_read_only_pages_create_no_session: Test if browsing creates no session and no cart.
+      test_first_write_creates_session_and_cart: Test if the first addition creates the session and the cart.
+      test_mutations_without_session: Test if removing from a cart without session does nothing.
+  """
+  @classmethod
+  def setUpTestData(cls):
+    """
+      Set up initial data for the test class.
+
+      Creates a test category and a test product under the category.
+    """
+    cls.category = Category.objects.create(category_name='lazy category', slug='lazy-category')
+    cls.product = Product.objects.create(
+      product_name='Lazy product', slug='lazy-product', price=10, category=cls.category, images='photos/products/x.jpg',
+    )
+
+
+  def test_read_only_pages_create_no_session(self):
+    """
+      Test if browsing creates no session and no cart.
+    """
+    for url in (reverse('home'), reverse('store'), reverse('cart'), self.product.get_url()):
+      response = self.client.get(url)
+      self.assertEqual(response.status_code, 200)
+      self.assertEqual(response.context['cart_count'], 0)
+    self.assertNotIn(settings.SESSION_COOKIE_NAME, self.client.cookies)
+    self.assertFalse(Session.objects.exists())
+    self.assertFalse(Cart.objects.exists())
+
+
+  def test_first_write_creates_session_and_cart(self):
+    """
+      Test if the first addition creates the session and the cart.
+    """
+    self.client.get(reverse('add_cart', args=[self.product.id]))
+    self.assertEqual(Session.objects.count(), 1)
+    self.assertEqual(Cart.objects.get().cart_id, self.client.session.session_key)
+
+
+  def test_mutations_without_session(self):
+    """
+      Test if removing from a cart without session does nothing.
+    """
+    response = self.client.get(reverse('remove_cart', args=[self.product.id, 1]))
+    self.assertEqual(response.status_code, 302)
+    state = self.client.post(reverse('cart_api_remove', args=[self.product.id, 1])).json()
+    self.assertEqual(state['cart_count'], 0)
+    self.assertFalse(Session.objects.exists())
+
+
+class CartBatchAddTest(TestCase):
+  """
+    Test class for the batch addition endpoint.
+
+    Methods:
+      setUpTestData: Set up initial data for the test class.
+      test_batch_creates_and_increments_items: Test if a batch adds new items and increments the existing ones.
+      test_batch_query_count: Test if a batch runs the same number of queries for 2 or 6 entries.
+      test_invalid_batch_adds_nothing: Test if one invalid entry rejects the whole batch.
+      test_batch_with_cookie_storage: Test if a batch is added to the cookie cart.
+      test_batch_capped: Test if the merged entries of a batch never raise an item past the maximum quantity.
+  """
+  @classmethod
+  def setUpTestData(cls):
+    """
+      Set up initial data for the test class.
+
+      Creates six products, each with a size and a color.
+    """
+    category = Category.objects.create(category_name='batch category', slug='batch-category')
+    cls.products = []
+    for index in range(6):
+      product = Product.objects.create(
+        product_name='Batch product %d' % index, slug='batch-product-%d' % index, price=10,
+        category=category, images='photos/products/x.jpg',
+      )
+      Variation.objects.create(product=product, variation_category='size', variation_value='M')
+      Variation.objects.create(product=product, variation_category='color', variation_value='Red')
+      cls.products.append(product)
+
+
+  def _post(self, items):
+    return self.client.post(reverse('cart_api_add_many'), json.dumps({'items': items}), content_type='application/json')
+
+
+  def _entries(self, count, quantity=1):
+    return [
+      {'product_id': product.id, 'variations': {'size': 'm', 'color': 'Red'}, 'quantity': quantity}
+      for product in self.products[:count]
+    ]
+
+
+  def test_batch_creates_and_increments_items(self):
+    """
+      Test if a batch adds new items and increments the existing ones.
+    """
+    self.client.post(reverse('add_cart', args=[self.products[0].id]), {'size': 'M', 'color': 'Red'})
+    entries = self._entries(2, quantity=2) + [{'product_id': self.products[1].id, 'variations': {'color': 'red', 'size': 'M'}}]
+    state = self._post(entries).json()
+    self.assertEqual(state['added'], 5)
+    self.assertEqual(state['cart_count'], 6)
+    quantities = dict(CartItem.objects.values_list('product_id', 'quantity'))
+    self.assertEqual(quantities, {self.products[0].id: 3, self.products[1].id: 3})
+    item = CartItem.objects.get(product=self.products[1])
+    self.assertEqual(sorted(variation.variation_category for variation in item.variations.all()), ['color', 'size'])
+
+
+  def test_batch_query_count(self):
+    """
+      Test if a batch runs the same number of queries for 2 or 6 entries.
+    """
+    self._post(self._entries(1))
+    with CaptureQueriesContext(connection) as small:
+      self._post(self._entries(2)[1:])
+    self.client.cookies.clear()
+    self._post(self._entries(1))
+    with CaptureQueriesContext(connection) as large:
+      self._post(self._entries(6)[1:])
+    self.assertEqual(len(small.captured_queries), len(large.captured_queries))
+
+
+  def test_invalid_batch_adds_nothing(self):
+    """
+      Test if one invalid entry rejects the whole batch.
+    """
+    entries = self._entries(2) + [{'product_id': self.products[2].id, 'variations': {'size': 'XXL'}}]
+    response = self._post(entries)
+    self.assertEqual(response.status_code, 400)
+    self.assertEqual(len(response.json()['errors']), 1)
+    self.assertFalse(CartItem.objects.exists())
+    self.assertEqual(self._post([]).status_code, 400)
+    self.assertEqual(self._post([{'product_id': 'x'}]).status_code, 400)
+    self.assertEqual(self._post([{'product_id': self.products[0].id, 'quantity': 0}]).status_code, 400)
+    self.assertEqual(self._post([{'product_id': self.products[0].id, 'quantity': 2 ** 63}]).status_code, 400)
+
+
+  @override_settings(CART_STORAGE='cookie', CART_COOKIE_MAX_LINES=20)
+  def test_batch_with_cookie_storage(self):
+    """
+      Test if a batch is added to the cookie cart.
+    """
+    state = self._post(self._entries(3, quantity=2)).json()
+    self.assertEqual(state['cart_count'], 6)
+    self.assertFalse(Cart.objects.exists())
+
+
+  def test_batch_capped(self):
+    """
+      Test if the merged entries of a batch never raise an item past the maximum quantity.
+    """
+    state = self._post(self._entries(1, quantity=600) * 2).json()
+    self.assertEqual(state['added'], MAX_ITEM_QUANTITY)
+    state = self._post(self._entries(2, quantity=5)).json()
+    self.assertEqual(state['added'], 5)
+    self.assertEqual(state['cart_count'], MAX_ITEM_QUANTITY + 5)
+    self.assertEqual(CartItem.objects.get(product=self.products[0]).quantity, MAX_ITEM_QUANTITY)
+
+
+
+class PromotionTest(TestCase):
+  """
+    Test class for the compiled promotions and the discount code of the cart page.
+
+    Methods:
+      setUpTestData: Set up initial data for the test class.
+      setUp: Set up environment for each test.
+      test_best_line_discount: Test if a line gets the best discount of its product or category.
+      test_fixed_discount_capped: Test if a fixed discount never exceeds the price.
+      test_cart_discount: Test if the best cart-wide discount applies after the line discounts.
+      test_codes: Test if coded promotions only apply with their code, in any case.
+      test_schedule: Test if promotions apply only between their start and end.
+      test_index_recompiles: Test if the index recompiles on a change and at the next start.
+      test_validation: Test if negative values, percentages above 100 and double scopes are rejected.
+      test_cart_page_discount: Test if the cart page shows the discount and the tax on the discounted total.
+      test_apply_discount_code: Test if a valid code is kept in the session and an invalid one rejected.
+      test_api_totals: Test if the cart API returns the subtotal, the discount and the total.
+      test_benchmark_command: Test if the benchmark command compares the evaluation costs.
+  """
+  @classmethod
+  def setUpTestData(cls):
+    """
+      Set up initial data for the test class.
+
+      Creates two categories with a product each.
+    """
+    cls.shirts = Category.objects.create(category_name='promo shirts', slug='promo-shirts')
+    cls.shoes = Category.objects.create(category_name='promo shoes', slug='promo-shoes')
+    cls.shirt = Product.objects.create(product_name='Promo shirt', slug='promo-shirt', price=40, category=cls.shirts, images='photos/products/shirt.jpg')
+    cls.shoe = Product.objects.create(product_name='Promo shoe', slug='promo-shoe', price=100, category=cls.shoes, images='photos/products/shoe.jpg')
+
+
+  def setUp(self):
+    """
+      Set up environment for each test.
+
+      Clears the cache holding the promotion versions.
+    """
+    cache.clear()
+    self.items = [CartItem(id=1, product=self.shirt, quantity=2), CartItem(id=2, product=self.shoe, quantity=1)]
+
+
+  def _compile(self, *promotions, now=None):
+    return compile_promotions([Promotion(name='p', **promotion) for promotion in promotions], now)
+
+
+  def test_best_line_discount(self):
+    """
+      Test if a line gets the best discount of its product or category.
+    """
+    compiled = self._compile(
+      {'kind': Promotion.PERCENT, 'value': 10, 'category_id': self.shirts.id},
+      {'kind': Promotion.FIXED, 'value': 5, 'product_id': self.shirt.id},
+      {'kind': Promotion.PERCENT, 'value': 20, 'product_id': self.shoe.id},
+    )
+    self.assertEqual(compiled.evaluate(self.items), ({1: 10, 2: 20}, 0))
+
+
+  def test_fixed_discount_capped(self):
+    """
+      Test if a fixed discount never exceeds the price.
+    """
+    compiled = self._compile({'kind': Promotion.FIXED, 'value': 500, 'category_id': self.shirts.id})
+    self.assertEqual(compiled.evaluate(self.items), ({1: 80}, 0))
+
+
+  def test_cart_discount(self):
+    """
+      Test if the best cart-wide discount applies after the line discounts.
+    """
+    compiled = self._compile(
+      {'kind': Promotion.PERCENT, 'value': 50, 'product_id': self.shoe.id},
+      {'kind': Promotion.PERCENT, 'value': 10},
+      {'kind': Promotion.FIXED, 'value': 12},
+    )
+    # 10% of 80 + 50 is 13, more than 12
+    self.assertEqual(compiled.evaluate(self.items), ({2: 50}, 13))
+
+
+  def test_codes(self):
+    """
+      Test if coded promotions only apply with their code, in any case.
+    """
+    compiled = self._compile({'code': 'SUMMER', 'kind': Promotion.PERCENT, 'value': 25, 'category_id': self.shoes.id})
+    self.assertEqual(compiled.evaluate(self.items), ({}, 0))
+    self.assertEqual(compiled.evaluate(self.items, 'WINTER'), ({}, 0))
+    self.assertEqual(compiled.evaluate(self.items, ' summer'), ({2: 25}, 0))
+    self.assertTrue(compiled.is_valid_code('Summer'))
+    self.assertFalse(compiled.is_valid_code(''))
+
+
+  def test_schedule(self):
+    """
+      Test if promotions apply only between their start and end.
+    """
+    now = timezone.now()
+    compiled = self._compile(
+      {'kind': Promotion.FIXED, 'value': 1, 'starts_at': now + timedelta(hours=2)},
+      {'kind': Promotion.FIXED, 'value': 2, 'ends_at': now + timedelta(hours=1)},
+      {'kind': Promotion.FIXED, 'value': 3, 'ends_at': now},
+      {'kind': Promotion.FIXED, 'value': 4, 'is_active': False},
+      now=now,
+    )
+    self.assertEqual(compiled.evaluate(self.items), ({}, 2))
+    self.assertEqual(compiled.expires_at, now + timedelta(hours=1))
+
+
+  def test_index_recompiles(self):
+    """
+      Test if the index recompiles on a change and at the next start.
+    """
+    self.assertEqual(promotion_index.get().evaluate(self.items), ({}, 0))
+    with self.captureOnCommitCallbacks(execute=True):
+      promotion = Promotion.objects.create(name='Shirts', kind=Promotion.PERCENT, value=50, category=self.shirts)
+    self.assertEqual(promotion_index.get().evaluate(self.items), ({1: 40}, 0))
+    with self.assertNumQueries(0):
+      promotion_index.get()
+    with self.captureOnCommitCallbacks(execute=True):
+      promotion.delete()
+    self.assertEqual(promotion_index.get().evaluate(self.items), ({}, 0))
+    with self.captureOnCommitCallbacks(execute=True):
+      Promotion.objects.create(name='Later', kind=Promotion.FIXED, value=5, starts_at=timezone.now() + timedelta(milliseconds=50))
+    self.assertEqual(promotion_index.get().evaluate(self.items), ({}, 0))
+    Promotion.objects.filter(name='Later').update(starts_at=timezone.now())
+    promotion_index.compiled.expires_at = timezone.now()
+    self.assertEqual(promotion_index.get().evaluate(self.items), ({}, 5))
+
+
+  def test_validation(self):
+    """
+      Test if negative values, percentages above 100 and double scopes are rejected.
+    """
+    Promotion(name='Valid', kind=Promotion.PERCENT, value=100, category=self.shirts).full_clean()
+    Promotion(name='Large amount', kind=Promotion.FIXED, value=150).full_clean()
+    invalid = [
+      (dict(kind=Promotion.FIXED, value=-5), 'value'),
+      (dict(kind=Promotion.PERCENT, value=120), 'value'),
+      (dict(kind=Promotion.PERCENT, value=10, product=self.shirt, category=self.shirts), 'category'),
+    ]
+    for values, field in invalid:
+      with self.assertRaises(ValidationError) as raised:
+        Promotion(name='Invalid', **values).full_clean()
+      self.assertIn(field, raised.exception.message_dict)
+
+
+  def test_cart_page_discount(self):
+    """
+      Test if the cart page shows the discount and the tax on the discounted total.
+    """
+    Promotion.objects.create(name='Shoes', kind=Promotion.FIXED, value=30, product=self.shoe)
+    self.client.post(reverse('add_cart', args=[self.shoe.id]))
+    response = self.client.get(reverse('cart'))
+    self.assertEqual(response.context['subtotal'], 100)
+    self.assertEqual(response.context['discount'], 30)
+    self.assertEqual(response.context['total'], 70)
+    self.assertEqual(response.context['tax'], 14)
+    self.assertContains(response, '<span id="cart-discount">-30.00€</span>', html=True)
+
+
+  @override_settings(CART_TAX_RATE=10)
+  def test_apply_discount_code(self):
+    """
+      Test if a valid code is kept in the session and an invalid one rejected.
+    """
+    Promotion.objects.create(name='Welcome', code='welcome', kind=Promotion.PERCENT, value=10)
+    self.client.post(reverse('add_cart', args=[self.shoe.id]))
+    response = self.client.post(reverse('apply_discount'), {'discountCode': 'nope'}, follow=True)
+    self.assertContains(response, 'This discount code is not valid.')
+    self.assertEqual(response.context['discount'], 0)
+    response = self.client.post(reverse('apply_discount'), {'discountCode': 'Welcome'}, follow=True)
+    self.assertContains(response, 'Discount code WELCOME applied.')
+    self.assertEqual(response.context['discount_code'], 'WELCOME')
+    self.assertEqual(response.context['total'], 90)
+    self.assertEqual(response.context['tax'], 9)
+    response = self.client.post(reverse('apply_discount'), {'discountCode': ''}, follow=True)
+    self.assertContains(response, 'Discount code removed.')
+    self.assertEqual(response.context['total'], 100)
+    self.assertEqual(self.client.get(reverse('apply_discount')).status_code, 405)
+
+
+  def test_api_totals(self):
+    """
+      Test if the cart API returns the subtotal, the discount and the total.
+    """
+    Promotion.objects.create(name='Shirts', kind=Promotion.PERCENT, value=25, category=self.shirts)
+    self.client.post(reverse('cart_api_add', args=[self.shirt.id]))
+    state = self.client.post(reverse('cart_api_add', args=[self.shirt.id])).json()
+    self.assertEqual(state['subtotal'], 80)
+    self.assertEqual(state['discount'], 20)
+    self.assertEqual(state['total'], 60)
+    self.assertEqual(state['tax'], 12)
+
+
+  def test_benchmark_command(self):
+    """
+      Test if the benchmark command compares the evaluation costs.
+    """
+    out = StringIO()
+    call_command('benchmark_promotions', rules=[10, 1000], iterations=20, stdout=out)
+    self.assertIn('1000 promotions cost', out.getvalue())
+    with self.assertRaises(CommandError):
+      call_command('benchmark_promotions', rules=[10, 1000], iterations=20, max_ratio=1e-9, stdout=StringIO())
@@ -8,4 +8,11 @@ urlpatterns = [
   path('add_cart/<int:product_id>/', views.add_cart, name='add_cart'),
   path('remove_cart/<int:product_id>/<int:cart_item_id>/', views.remove_cart, name='remove_cart'),
   path('remove_cart_item/<int:product_id>/<int:cart_item_id>/', views.remove_cart_item, name='remove_cart_item'),
+  path('discount/', views.apply_discount, name='apply_discount'),
+  # JSON API used by the cart page
+  path('api/add/<int:product_id>/', views.api_add, name='cart_api_add'),
+  path('api/add_many/', views.api_add_many, name='cart_api_add_many'),
+  path('api/decrement/<int:product_id>/<int:cart_item_id>/', views.api_decrement, name='cart_api_decrement'),
+  path('api/remove/<int:product_id>/<int:cart_item_id>/', views.api_remove, name='cart_api_remove'),
+  path('api/set/<int:product_id>/<int:cart_item_id>/', views.api_set_quantity, name='cart_api_set_quantity'),
 ]
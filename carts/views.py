@@ -1,25 +1,36 @@
+import json
+
 from django.shortcuts import render, redirect, get_object_or_404
-from store.models import Product, Variation
+from store.models import Product
+from store.reservations import OutOfStock, release, reservations_enabled, reserve
 from category.models import Category
-from .models import Cart, CartItem
-from django.http import HttpResponse
-from django.core.exceptions import ObjectDoesNotExist
+from .promotions import DISCOUNT_CODE_SESSION_KEY, promotion_index
+from .services import MAX_ITEM_QUANTITY, resolve_batch, resolve_variations
+from .storage import _cart_id, get_cart_storage
+
+from django.conf import settings
+from django.contrib import messages
+from django.http import HttpResponse, JsonResponse
+from django.views.decorators.http import require_POST
 
 
-def _cart_id(request):
+def _reserve(request, product_id, quantity):
   """
-    Get the ID of the current session's cart.
+    Hold units of a product for the session's cart, when stock reservations are enabled.
 
-    Args:
-      request: The Django request object.
+    Raises:
+      OutOfStock: If the product has not enough units left.
+  """
+  if reservations_enabled() and quantity > 0:
+    reserve(product_id, _cart_id(request), quantity)
 
-    Returns:
-      str: The ID of the session's cart.
+
+def _release(request, product_id, quantity):
+  """
+    Return units of a product removed from the cart to the stock, when stock reservations are enabled.
   """
-  cart = request.session.session_key
-  if not cart:
-    cart = request.session.create()
-  return cart
+  if reservations_enabled() and quantity > 0 and request.session.session_key:
+    release(request.session.session_key, product_id, quantity)
 
 
 def add_cart(request, product_id):
@@ -31,59 +42,23 @@ def add_cart(request, product_id):
       product_id (int): The ID of the product to add.
 
     Returns:
-      django.shortcuts.redirect: Redirect to the cart page.
+      django.shortcuts.redirect: Redirect to the cart page, or back to the product page when it is out of stock.
   """
   # Get the product based on the ID
   product = Product.objects.get(id=product_id)
-  product_variation = []
-  
-  if request.method == 'POST':
-    for item in request.POST:
-      key = item
-      value = request.POST[key]
-      try:
-        # Check if the variation exists for the product
-        variation = Variation.objects.get(product=product, variation_category__iexact=key, variation_value__iexact=value)
-        # Add the variation to the product's variation list
-        product_variation.append(variation)
-      except:
-        pass
+  # Resolve the selected variations (size, color) in one query
+  product_variation = resolve_variations(product, request.POST) if request.method == 'POST' else []
 
   try:
-    # Get the existing cart based on the session ID
-    cart = Cart.objects.get(cart_id=_cart_id(request))
-  except Cart.DoesNotExist:
-    # Create a new cart if it doesn't exist
-    cart = Cart.objects.create(cart_id = _cart_id(request))
-
-  cart.save()
-
-  # Check if the product with the same variations already exists in the cart
-  cart_items = CartItem.objects.filter(product=product, cart=cart)
-  added = False
-
-  for cart_item in cart_items:
-    existing_variations = cart_item.variations.all()
-    if set(existing_variations) == set(product_variation):
-      # Increase the quantity of the item in the cart
-      cart_item.quantity += 1
-      cart_item.save()
-      added = True
-      break
-
-  if not added:
-    # Create a new cart item with quantity 1
-    cart_item = CartItem.objects.create(
-      product=product,
-      quantity=1,
-      cart=cart,
-    )
-    if len(product_variation) > 0:
-      # Add the selected variations to the cart item
-      cart_item.variations.clear()
-      cart_item.variations.add(*product_variation)
-    cart_item.save()
-
+    # Hold a unit of the product for the cart
+    _reserve(request, product.id, 1)
+  except OutOfStock:
+    messages.error(request, "Sorry, this product is out of stock.")
+    return redirect(product.get_url())
+  # Increase the quantity of the item with the same variations, or create it
+  if not get_cart_storage(request).add(product, product_variation):
+    # The item already holds the maximum quantity
+    _release(request, product.id, 1)
   return redirect('cart')
 
 
@@ -99,22 +74,9 @@ def remove_cart(request, product_id, cart_item_id):
     Returns:
       django.shortcuts.redirect: Redirect to the cart page.
   """
-  # Get the cart based on the session ID
-  cart = Cart.objects.get(cart_id=_cart_id(request))
-  # Get the product based on the ID
-  product = get_object_or_404(Product, id=product_id)
-  try:
-    # Get the cart item corresponding to the product and cart item ID
-    cart_item = CartItem.objects.get(product=product, cart=cart, id=cart_item_id)
-    if cart_item.quantity > 1:
-      # Decrease the quantity of the cart item
-      cart_item.quantity -= 1
-      cart_item.save()
-    else:
-      # Completely remove the cart item
-      cart_item.delete()
-  except:
-    pass
+  # Decrease the quantity of the cart item, or remove it with its last unit
+  removed = get_cart_storage(request).decrement(product_id, cart_item_id)
+  _release(request, product_id, removed)
   return redirect('cart')
 
 
@@ -130,14 +92,9 @@ def remove_cart_item(request, product_id, cart_item_id):
     Returns:
       django.shortcuts.redirect: Redirect to the cart page.
   """
-  # Get the cart based on the session ID
-  cart = Cart.objects.get(cart_id=_cart_id(request))
-  # Get the product based on the ID
-  product = get_object_or_404(Product, id=product_id)
-  # Get the cart item corresponding to the product and cart item ID
-  cart_item = CartItem.objects.get(product=product, cart=cart.id, id=cart_item_id)
   # Completely remove the cart item
-  cart_item.delete()
+  removed = get_cart_storage(request).remove(product_id, cart_item_id)
+  _release(request, product_id, removed)
   return redirect('cart')
 
 
@@ -154,27 +111,232 @@ def cart(request, total=0, quantity=0, cart_items=None):
     Returns:
       django.shortcuts.render: Render the cart page.
   """
-  tax = 0
-  grand_total = 0
-  try:
-    # Get the cart based on the session ID
-    cart = Cart.objects.get(cart_id=_cart_id(request))
-    # Get all active cart items
-    cart_items = CartItem.objects.filter(cart=cart, is_active=True)
-    for cart_item in cart_items:
-      # Calculate the total by multiplying the product price by its quantity in the cart
-      total += (cart_item.product.price * cart_item.quantity)
-      # Calculate the total quantity of products in the cart
-      quantity += cart_item.quantity
-    # Calculate the tax by applying a fixed percentage (20%) on the total
-    tax = (20 * total)/100
-  except ObjectDoesNotExist:
-    pass
+  # Get the active items of the cart with their products, categories and variations,
+  # in a constant number of queries
+  storage = get_cart_storage(request)
+  # The items deleted or edited outside the cart views do not change the count of the navbar
+  storage.refresh_count()
+  cart_items = storage.items()
+  code = request.session.get(DISCOUNT_CODE_SESSION_KEY, '')
+  subtotal, discount, total, quantity, tax = _cart_totals(cart_items, code)
 
   context = {
+    'subtotal': subtotal,
+    'discount': discount,
+    'discount_code': code,
     'total': total,
     'quantity': quantity,
     'cart_items': cart_items,
     'tax': tax,
   }
   return render(request, 'store/cart.html', context)
+
+
+def _cart_totals(cart_items, code=''):
+  """
+    Calculate the totals of the cart.
+
+    Args:
+      cart_items (list): The items of the cart.
+      code (str): The discount code entered by the visitor (default: none).
+
+    Returns:
+      tuple: The subtotal, the discount of the promotions, the total, the total quantity
+        and the tax included in the total.
+  """
+  subtotal = 0
+  quantity = 0
+  for cart_item in cart_items:
+    # Calculate the subtotal by multiplying the product price by its quantity in the cart
+    subtotal += (cart_item.product.price * cart_item.quantity)
+    # Calculate the total quantity of products in the cart
+    quantity += cart_item.quantity
+  # Apply the compiled promotions (see carts.promotions)
+  lines, cart = promotion_index.get().evaluate(cart_items, code)
+  discount = min(sum(lines.values()) + cart, subtotal)
+  total = subtotal - discount
+  # Calculate the tax by applying the tax rate (settings.CART_TAX_RATE) on the total
+  tax = (getattr(settings, 'CART_TAX_RATE', 20) * total)/100
+  return subtotal, discount, total, quantity, tax
+
+
+def _cart_state(request, line=None, **extra):
+  """
+    Build the JSON response of the cart API: the changed line, the totals and the badge count.
+
+    Args:
+      request: The Django request object.
+      line (callable): Selects the changed item among the items of the cart (default: no line).
+      extra: Other values of the response.
+
+    Returns:
+      JsonResponse: The changed line (None if it was removed) and the totals of the cart, after discount.
+  """
+  cart_items = get_cart_storage(request).items()
+  subtotal, discount, total, quantity, tax = _cart_totals(cart_items, request.session.get(DISCOUNT_CODE_SESSION_KEY, ''))
+  item = next((cart_item for cart_item in cart_items if line and line(cart_item)), None)
+  return JsonResponse({
+    'line': item and {
+      'id': item.id,
+      'product_id': item.product.id,
+      'quantity': item.quantity,
+      'sub_total': round(item.sub_total(), 2),
+    },
+    'subtotal': round(subtotal, 2),
+    'discount': round(discount, 2),
+    'total': round(total, 2),
+    'tax': round(tax, 2),
+    'cart_count': quantity,
+    **extra,
+  })
+
+
+@require_POST
+def api_add(request, product_id):
+  """
+    Add a unit of a product with the posted variations to the cart.
+
+    Args:
+      request: The Django request object.
+      product_id (int): The ID of the product to add.
+
+    Returns:
+      JsonResponse: The line of the product and the totals of the cart.
+  """
+  product = get_object_or_404(Product, id=product_id)
+  variations = resolve_variations(product, request.POST)
+  try:
+    _reserve(request, product.id, 1)
+  except OutOfStock:
+    return JsonResponse({'error': 'This product is out of stock.'}, status=409)
+  if not get_cart_storage(request).add(product, variations):
+    _release(request, product.id, 1)
+  variation_ids = sorted(variation.pk for variation in variations)
+  return _cart_state(request, lambda item: (
+    item.product.id == product.id
+    and sorted(variation.pk for variation in item.selected_variations()) == variation_ids
+  ))
+
+
+# Maximum number of entries of a batch addition.
+MAX_BATCH_ENTRIES = 50
+
+
+@require_POST
+def api_add_many(request):
+  """
+    Add several products to the cart at once.
+
+    The JSON body is {"items": [{"product_id": 1, "variations": {"size": "M"}, "quantity": 2}, ...]}.
+    Every entry is validated before any is added: either all of them are added or none.
+
+    Returns:
+      JsonResponse: The number of units added and the totals of the cart, or the errors with status 400.
+  """
+  try:
+    entries = json.loads(request.body)['items']
+  except (ValueError, KeyError, TypeError):
+    return JsonResponse({'errors': ['The body must be a JSON object with an "items" list.']}, status=400)
+  if not isinstance(entries, list) or not 0 < len(entries) <= MAX_BATCH_ENTRIES:
+    return JsonResponse({'errors': ['Between 1 and %d items can be added at once.' % MAX_BATCH_ENTRIES]}, status=400)
+  resolved, errors = resolve_batch(entries)
+  if errors:
+    return JsonResponse({'errors': errors}, status=400)
+  reserved = []
+  try:
+    for product, variations, quantity in resolved:
+      _reserve(request, product.id, quantity)
+      reserved.append((product.id, quantity))
+  except OutOfStock:
+    # Add nothing: give back the units held for the previous entries
+    for product_id, quantity in reserved:
+      _release(request, product_id, quantity)
+    return JsonResponse({'errors': ['%s is out of stock.' % product]}, status=409)
+  added = get_cart_storage(request).add_many(resolved)
+  # Give back the units held beyond the maximum quantity of the items
+  held = {}
+  for product_id, quantity in reserved:
+    held[product_id] = held.get(product_id, 0) + quantity
+  for product_id, quantity in held.items():
+    if quantity > added.get(product_id, 0):
+      _release(request, product_id, quantity - added.get(product_id, 0))
+  return _cart_state(request, added=sum(added.values()))
+
+
+@require_POST
+def api_decrement(request, product_id, cart_item_id):
+  """
+    Remove a unit of a cart item.
+
+    Returns:
+      JsonResponse: The line of the item (None once its last unit is removed) and the totals of the cart.
+  """
+  removed = get_cart_storage(request).decrement(product_id, cart_item_id)
+  _release(request, product_id, removed)
+  return _cart_state(request, lambda item: item.id == cart_item_id)
+
+
+@require_POST
+def api_remove(request, product_id, cart_item_id):
+  """
+    Remove a cart item with all its units.
+
+    Returns:
+      JsonResponse: No line and the totals of the cart.
+  """
+  removed = get_cart_storage(request).remove(product_id, cart_item_id)
+  _release(request, product_id, removed)
+  return _cart_state(request)
+
+
+@require_POST
+def api_set_quantity(request, product_id, cart_item_id):
+  """
+    Set the quantity of a cart item from the posted 'quantity' (0 removes the item).
+
+    Returns:
+      JsonResponse: The line of the item and the totals of the cart, or an error with status 400.
+  """
+  try:
+    quantity = int(request.POST.get('quantity', ''))
+  except ValueError:
+    quantity = -1
+  if quantity < 0:
+    return JsonResponse({'error': 'The quantity must be a positive integer.'}, status=400)
+  if quantity > MAX_ITEM_QUANTITY:
+    return JsonResponse({'error': 'The quantity cannot exceed %d.' % MAX_ITEM_QUANTITY}, status=400)
+  storage = get_cart_storage(request)
+  delta = storage.set_quantity(product_id, cart_item_id, quantity)
+  if delta > 0:
+    try:
+      _reserve(request, product_id, delta)
+    except OutOfStock:
+      # Put the previous quantity back
+      storage.set_quantity(product_id, cart_item_id, quantity - delta)
+      return JsonResponse({'error': 'Not enough stock left for this quantity.'}, status=409)
+  else:
+    _release(request, product_id, -delta)
+  return _cart_state(request, lambda item: item.id == cart_item_id)
+
+
+@require_POST
+def apply_discount(request):
+  """
+    Apply the discount code entered on the cart page, or remove it when the field is empty.
+
+    Args:
+      request: The Django request object.
+
+    Returns:
+      django.shortcuts.redirect: Redirect to the cart page.
+  """
+  code = request.POST.get('discountCode', '').strip().upper()
+  if not code:
+    if request.session.pop(DISCOUNT_CODE_SESSION_KEY, None):
+      messages.info(request, "Discount code removed.")
+  elif promotion_index.get().is_valid_code(code):
+    request.session[DISCOUNT_CODE_SESSION_KEY] = code
+    messages.success(request, "Discount code %s applied." % code)
+  else:
+    messages.error(request, "This discount code is not valid.")
+  return redirect('cart')
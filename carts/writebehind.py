@@ -0,0 +1,283 @@
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from .models import Cart, CartItem
+
+
+# Cache keys of the write-behind journal.
+SEQUENCE_KEY = 'carts:wb:sequence'
+FLUSHED_KEY = 'carts:wb:flushed'
+FLUSHED_AT_KEY = 'carts:wb:flushed-at'
+LOCK_KEY = 'carts:wb:lock'
+
+
+def _entry_key(sequence):
+  return 'carts:wb:entry:%d' % sequence
+
+
+def _item_key(item_id):
+  return 'carts:wb:item:%d' % item_id
+
+
+def _cart_key(cart_pk):
+  return 'carts:wb:cart:%d' % cart_pk
+
+
+def _missing_key(sequence):
+  return 'carts:wb:missing:%d' % sequence
+
+
+def journal_cache():
+  """
+    Return the cache holding the pending cart changes (settings.CART_WRITE_BEHIND_CACHE).
+  """
+  return caches[getattr(settings, 'CART_WRITE_BEHIND_CACHE', 'cart_journal')]
+
+
+def _incr(cache, key, delta):
+  cache.add(key, 0, timeout=None)
+  return cache.incr(key, delta)
+
+
+def _decr(cache, key, delta):
+  try:
+    cache.incr(key, -delta)
+  except ValueError:
+    # The counter expired or was evicted
+    pass
+
+
+def record_change(cart_pk, item_id, delta):
+  """
+    Record a quantity change of a cart item without writing to the database.
+
+    The change is added to the pending counters of the item and of its cart, read back by
+    pending_item_deltas() and pending_cart_delta(), and appended to the journal replayed
+    by flush_pending_writes().
+
+    Args:
+      cart_pk (int): The primary key of the cart.
+      item_id (int): The ID of the cart item.
+      delta (int): The change of the quantity of the item.
+  """
+  cache = journal_cache()
+  # The flush interval starts with the first pending change
+  cache.add(FLUSHED_AT_KEY, time.time(), timeout=None)
+  _incr(cache, _item_key(item_id), delta)
+  _incr(cache, _cart_key(cart_pk), delta)
+  sequence = _incr(cache, SEQUENCE_KEY, 1)
+  cache.set(_entry_key(sequence), (cart_pk, item_id), timeout=None)
+
+
+def pending_item_deltas(item_ids):
+  """
+    Return the pending quantity changes of cart items.
+
+    Returns:
+      dict: The pending change of each item ID (0 for the items without change).
+  """
+  values = journal_cache().get_many([_item_key(item_id) for item_id in item_ids])
+  return dict((item_id, values.get(_item_key(item_id), 0)) for item_id in item_ids)
+
+
+def pending_cart_delta(cart_pk):
+  """
+    Return the pending change of the total quantity of a cart.
+  """
+  return journal_cache().get(_cart_key(cart_pk), 0)
+
+
+def pending_writes():
+  """
+    Return the number of journal entries waiting to be flushed.
+  """
+  cache = journal_cache()
+  return cache.get(SEQUENCE_KEY, 0) - cache.get(FLUSHED_KEY, 0)
+
+
+def maybe_flush():
+  """
+    Flush the pending changes when there are settings.CART_WRITE_BEHIND_BATCH of them, or when
+    the last flush is older than settings.CART_WRITE_BEHIND_INTERVAL seconds.
+  """
+  cache = journal_cache()
+  pending = pending_writes()
+  if not pending:
+    return 0
+  interval = getattr(settings, 'CART_WRITE_BEHIND_INTERVAL', 5)
+  if pending >= getattr(settings, 'CART_WRITE_BEHIND_BATCH', 100) or time.time() - cache.get(FLUSHED_AT_KEY, 0) >= interval:
+    return flush_pending_writes()
+  return 0
+
+
+def _entry_lost(cache, sequence):
+  """
+    Return True if a journal entry has been missing for settings.CART_WRITE_BEHIND_GRACE seconds.
+
+    An entry is missing for a moment while record_change() writes it; one still missing
+    after the grace period was lost (evicted, or a crash between the sequence and the entry).
+  """
+  cache.add(_missing_key(sequence), time.time(), timeout=None)
+  return time.time() - cache.get(_missing_key(sequence), time.time()) >= getattr(settings, 'CART_WRITE_BEHIND_GRACE', 30)
+
+
+def _pending_entries(chunk_size=1000):
+  """
+    Rebuild journal entries from the pending counters of every cart item.
+
+    The item of a lost entry is unknown, so the counters of all the items are read, one chunk
+    of items at a time.
+  """
+  cache = journal_cache()
+  items = CartItem.objects.order_by('id').values_list('id', 'cart_id')
+  last = 0
+  while True:
+    chunk = list(items.filter(id__gt=last)[:chunk_size])
+    deltas = cache.get_many([_item_key(item_id) for item_id, cart_pk in chunk])
+    for item_id, cart_pk in chunk:
+      if deltas.get(_item_key(item_id)):
+        yield cart_pk, item_id
+    if len(chunk) < chunk_size:
+      return
+    last = chunk[-1][0]
+
+
+def _apply_changes(cache, item_carts):
+  """
+    Apply the pending changes of cart items to the Cart and CartItem tables.
+
+    The items are updated with one bulk_update and the items left without unit are deleted,
+    in one transaction; a change removing more units than the item holds is clamped, and the
+    count of the cart gets the clamped change. The pending counters are then decreased by
+    the changes read, so that changes recorded meanwhile are kept.
+
+    Args:
+      cache (BaseCache): The journal cache.
+      item_carts (dict): The cart primary key of each item ID.
+  """
+  item_deltas = pending_item_deltas(item_carts)
+  cart_deltas = {}
+  with transaction.atomic():
+    items = list(CartItem.objects.select_for_update().filter(id__in=item_carts))
+    changed, emptied = [], []
+    for item in items:
+      delta = item_deltas[item.id]
+      if not delta:
+        continue
+      cart_deltas[item.cart_id] = cart_deltas.get(item.cart_id, 0) + max(item.quantity + delta, 0) - item.quantity
+      item.quantity += delta
+      (changed if item.quantity > 0 else emptied).append(item)
+    CartItem.objects.bulk_update(changed, ['quantity'])
+    CartItem.objects.filter(id__in=[item.id for item in emptied]).delete()
+    for cart_pk, delta in cart_deltas.items():
+      if delta:
+        Cart.objects.filter(pk=cart_pk).update(item_count=Greatest(F('item_count') + delta, 0), last_activity=timezone.now())
+
+  # Remove the applied changes from the pending counters, the changes of the items
+  # deleted meanwhile are dropped
+  cart_pending = {}
+  for item_id, delta in item_deltas.items():
+    if delta:
+      _decr(cache, _item_key(item_id), delta)
+      cart_pending[item_carts[item_id]] = cart_pending.get(item_carts[item_id], 0) + delta
+  for cart_pk, delta in cart_pending.items():
+    _decr(cache, _cart_key(cart_pk), delta)
+
+
+def pending_cart_count(cart_pk, item_count):
+  """
+    Return the total quantity of a cart with its pending changes.
+
+    Without pending change this is the count of the database. Otherwise the changes are added
+    item by item with the clamp of the flush, so that the count matches the items read back
+    even when the changes remove more units than an item holds.
+
+    Args:
+      cart_pk (int): The primary key of the cart.
+      item_count (int): The count of the cart in the database.
+  """
+  if not pending_cart_delta(cart_pk):
+    return item_count
+  quantities = dict(CartItem.objects.filter(cart_id=cart_pk).values_list('id', 'quantity'))
+  deltas = pending_item_deltas(quantities)
+  return sum(max(quantity + deltas[item_id], 0) for item_id, quantity in quantities.items())
+
+
+def apply_cart_writes(cart_pk):
+  """
+    Apply the pending changes of the items of one cart, e.g. before removing one of them.
+
+    The journal entries of the cart stay in place: the counters of their items are back to 0,
+    so flush_pending_writes() skips them later. When a flush is running, nothing is done; the
+    running flush applies the changes of the cart, and its row locks delay the writes to the
+    items until it is done.
+
+    Args:
+      cart_pk (int): The primary key of the cart.
+
+    Returns:
+      bool: True if the changes were applied here.
+  """
+  cache = journal_cache()
+  if not cache.add(LOCK_KEY, 1, timeout=60):
+    return False
+  try:
+    item_ids = CartItem.objects.filter(cart_id=cart_pk).values_list('id', flat=True)
+    _apply_changes(cache, dict.fromkeys(item_ids, cart_pk))
+    return True
+  finally:
+    cache.delete(LOCK_KEY)
+
+
+def flush_pending_writes():
+  """
+    Apply the pending changes of the journal to the Cart and CartItem tables.
+
+    The changes of each item are merged and applied by _apply_changes(). Only one flush runs at a time; the journal stays in the cache until it is applied, so pending
+    changes survive a worker restart when the cache is persistent (Redis).
+
+    An entry missing for longer than settings.CART_WRITE_BEHIND_GRACE seconds is skipped, and
+    the changes of every item with a pending counter are applied, so that a lost entry never
+    blocks the journal.
+
+    Returns:
+      int: The number of journal entries applied or skipped.
+  """
+  cache = journal_cache()
+  if not cache.add(LOCK_KEY, 1, timeout=60):
+    return 0
+  try:
+    flushed = cache.get(FLUSHED_KEY, 0)
+    last = cache.get(SEQUENCE_KEY, 0)
+    sequences = range(flushed + 1, last + 1)
+    entries = cache.get_many([_entry_key(sequence) for sequence in sequences])
+    # Stop at the first entry not written yet by a concurrent record_change(), skip the lost ones
+    applied, lost = [], []
+    for sequence in sequences:
+      key = _entry_key(sequence)
+      if key in entries:
+        applied.append(entries[key])
+      elif _entry_lost(cache, sequence):
+        lost.append(sequence)
+      else:
+        break
+    consumed = len(applied) + len(lost)
+    if lost:
+      # The changes of the lost entries are still in the pending counters of their items
+      applied.extend(_pending_entries())
+    if not consumed:
+      return 0
+
+    _apply_changes(cache, dict((item_id, cart_pk) for cart_pk, item_id in applied))
+    cache.set(FLUSHED_KEY, flushed + consumed, timeout=None)
+    cache.delete_many([_entry_key(sequence) for sequence in sequences[:consumed]] + [_missing_key(sequence) for sequence in lost])
+    cache.set(FLUSHED_AT_KEY, time.time(), timeout=None)
+    return consumed
+  finally:
+    cache.delete(LOCK_KEY)
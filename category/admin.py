@@ -9,9 +9,11 @@ class CategoryAdmin(admin.ModelAdmin):
     Attributes:
       prepopulated_fields (dict): Specifies the fields that should be prepopulated based on other fields.
       list_display (tuple): Specifies the fields to be displayed in the list view of the admin site.
+      search_fields (tuple): Specifies the fields searched from the list view and by the autocomplete widgets.
   """
   prepopulated_fields = {'slug': ('category_name',)}
   list_display = ('category_name', 'slug', 'gender', 'product_type')
+  search_fields = ('category_name', 'slug')
 
 # Register the Category model with the admin site using the CategoryAdmin class.
 admin.site.register(Category, CategoryAdmin)
@@ -1,15 +1,18 @@
-from .models import Category
+from .tree import category_tree
 
 
 def menu_links(request):
 	"""
 		Retrieves the menu links for the navigation bar.
 
+		The links come from the in-process category tree (see category.tree), without database query.
+
 		Args:
 			request (HttpRequest): The HTTP request object.
 
 		Returns:
 			dict: A dictionary containing the menu links.
 	"""
-	links = Category.objects.exclude(category_name="Best Seller")
+	# Case insensitive, like the default MySQL collation the former exclude() query relied on.
+	links = [node for node in category_tree.all() if node.category_name.lower() != "best seller"]
 	return dict(links=links)
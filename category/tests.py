@@ -1,5 +1,10 @@
-from django.test import TestCase
+from django.core.cache import cache
+from django.test import RequestFactory, TestCase
+from category.context_processors import menu_links
 from category.models import Category
+from category.tree import category_tree
+from dream_shop.context_processors import category_links
+from store.models import Product
 from django.urls import reverse
 import os
 
@@ -207,3 +212,71 @@ class CategoryModelTest(TestCase):
     )
     expected_filename = os.path.basename(image_path)
     self.assertIn(expected_filename, category.cat_image.path)
+
+
+class CategoryTreeTest(TestCase):
+  """
+    Test class for the in-process category tree.
+
+    Methods:
+      setUp: Set up the environment for each test.
+      test_groups: Test if the categories are grouped by gender and product type with their URLs.
+      test_context_processors_without_query: Test if the navbar links are read from the tree without query.
+      test_reloaded_on_category_change: Test if the tree is reloaded after a category is saved.
+      test_not_reloaded_on_product_change: Test if saving a product keeps the tree.
+  """
+  def setUp(self):
+    """
+      Set up the environment for each test.
+
+      Creates a women clothing, a men accessories and a best seller category.
+    """
+    cache.clear()
+    self.dresses = Category.objects.create(category_name='Robes', category_online='Robes', slug='robes', gender='F', product_type='B')
+    self.belts = Category.objects.create(category_name='Ceintures', category_online='Ceintures', slug='ceintures', gender='H', product_type='Y')
+    Category.objects.create(category_name='Best Seller', category_online='Best seller', slug='best-seller')
+
+
+  def test_groups(self):
+    """
+      Test if the categories are grouped by gender and product type with their URLs.
+    """
+    self.assertEqual([node.slug for node in category_tree.gender('F')], ['robes'])
+    self.assertEqual([node.get_url() for node in category_tree.product_type('Y')], ['/store/category/ceintures/'])
+    self.assertEqual(category_tree.product_type('A'), [])
+    self.assertEqual(len(category_tree.all()), 3)
+
+
+  def test_context_processors_without_query(self):
+    """
+      Test if the navbar links are read from the tree without query.
+    """
+    request = RequestFactory().get('/cart/')
+    category_tree.all()
+    with self.assertNumQueries(0):
+      links = category_links(request)
+      menu = menu_links(request)
+    self.assertEqual([node.slug for node in links['women_links']], ['robes'])
+    self.assertEqual([node.slug for node in links['men_links_all']], ['ceintures'])
+    self.assertEqual([node.slug for node in menu['links']], ['robes', 'ceintures'])
+
+
+  def test_reloaded_on_category_change(self):
+    """
+      Test if the tree is reloaded after a category is saved.
+    """
+    category_tree.all()
+    self.dresses.slug = 'longues-robes'
+    with self.captureOnCommitCallbacks(execute=True):
+      self.dresses.save()
+    self.assertEqual(category_tree.gender('F')[0].get_url(), '/store/category/longues-robes/')
+
+
+  def test_not_reloaded_on_product_change(self):
+    """
+      Test if saving a product keeps the tree.
+    """
+    category_tree.all()
+    Product.objects.create(product_name='Dress', slug='dress', category=self.dresses)
+    with self.assertNumQueries(0):
+      category_tree.all()
@@ -0,0 +1,87 @@
+from django.urls import reverse
+
+from store.cache import CATEGORIES, LocalIndex
+from .models import Category
+
+
+class CategoryNode:
+    """
+        Read-only copy of a category, with its URL resolved once.
+
+        Attributes:
+            id (int): The primary key of the category.
+            category_name (str): The name of the category.
+            category_online (str): The online name of the category.
+            slug (str): The slug of the category.
+            gender (str): The gender of the category.
+            product_type (str): The product type of the category.
+            url (str): The URL of the category page.
+    """
+    __slots__ = ('id', 'category_name', 'category_online', 'slug', 'gender', 'product_type', 'url')
+
+    def __init__(self, category):
+        self.id = category.id
+        self.category_name = category.category_name
+        self.category_online = category.category_online
+        self.slug = category.slug
+        self.gender = category.gender
+        self.product_type = category.product_type
+        self.url = reverse('products_by_category', args=[category.slug])
+
+    def get_url(self):
+        """
+            Returns the URL of the category, like Category.get_url.
+        """
+        return self.url
+
+    def __str__(self):
+        return self.category_name
+
+
+class CategoryTree(LocalIndex):
+    """
+        In-process tree of the categories, grouped by gender and by product type.
+
+        Loaded with one query and shared by the context processors and the home page;
+        it is reloaded only when a category is saved or deleted (the 'categories' version).
+    """
+    namespaces = (CATEGORIES,)
+
+    def __init__(self):
+        super().__init__()
+        self.nodes = []
+        self.by_gender = {}
+        self.by_product_type = {}
+
+    def load(self):
+        nodes = [CategoryNode(category) for category in Category.objects.order_by('id')]
+        by_gender = {}
+        by_product_type = {}
+        for node in nodes:
+            by_gender.setdefault(node.gender, []).append(node)
+            by_product_type.setdefault(node.product_type, []).append(node)
+        self.nodes, self.by_gender, self.by_product_type = nodes, by_gender, by_product_type
+
+    def all(self):
+        """
+            Return every category.
+        """
+        self.ensure_current()
+        return self.nodes
+
+    def gender(self, gender):
+        """
+            Return the categories of a gender ('H', 'F' or 'O').
+        """
+        self.ensure_current()
+        return self.by_gender.get(gender, [])
+
+    def product_type(self, product_type):
+        """
+            Return the categories of a product type ('A', 'B', 'X', 'Y' or 'O').
+        """
+        self.ensure_current()
+        return self.by_product_type.get(product_type, [])
+
+
+category_tree = CategoryTree()
@@ -1,4 +1,5 @@
 from pathlib import Path
+import sys
 import pymysql
 pymysql.install_as_MySQLdb()
 
@@ -40,6 +41,7 @@ MIDDLEWARE = [
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
+    'carts.middleware.CartStorageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
@@ -59,6 +61,7 @@ TEMPLATES = [
                 'category.context_processors.menu_links',
                 'carts.context_processors.counter',
                 'dream_shop.context_processors.category_links',
+                'store.context_processors.facet_counts',
             ],
         },
     },
@@ -83,6 +86,41 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+# Use a shared backend (Redis, Memcached) when running several workers, so that
+# catalog invalidations reach every process.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'dream_shop',
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+        },
+    },
+    # Journal of the write-behind cart storage (see carts.writebehind): never culled, its
+    # entries are deleted once applied. In production, a persistent cache that does not
+    # evict (Redis with maxmemory-policy noeviction), separate from the view cache.
+    'cart_journal': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'dream_shop-cart-journal',
+        'TIMEOUT': None,
+        'OPTIONS': {
+            'MAX_ENTRIES': sys.maxsize,
+        },
+    },
+}
+
+# Cached catalog views are invalidated by product, variation and category changes,
+# not by expiry (see store.cache.cached_view_data).
+STORE_VIEW_CACHE_TIMEOUT = None
+
+# Rebuild the home page snapshot in a background thread when the catalog changes,
+# serving the previous one meanwhile (see dream_shop.snapshots).
+HOME_SNAPSHOT_BACKGROUND = True
+
+
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
 
@@ -127,6 +165,17 @@ STATICFILES_DIRS = [
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR /'media'
 
+# Uploads are stored once per content under MEDIA_ROOT/blobs (see store.storage); the
+# deduplicate_media command moves the files uploaded before to their blobs.
+STORAGES = {
+    'default': {
+        'BACKEND': 'store.storage.ContentAddressedStorage',
+    },
+    'staticfiles': {
+        'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage',
+    },
+}
+
 
 from django.contrib.messages import constants as messages
 
@@ -139,4 +188,61 @@ MESSAGE_TAGS = {
 # https://docs.djangoproject.com/en/4.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
-LANGUAGE_CODE = "en-US"
\ No newline at end of file
+LANGUAGE_CODE = "en-US"
+
+# Product search
+# The backend defaults to the one matching the database vendor (MySQL FULLTEXT, SQLite FTS5),
+# see store.search. Set STORE_SEARCH_BACKEND to a dotted path to override it.
+
+STORE_SEARCH_MAX_RESULTS = 500
+
+# Cart storage
+# 'database' keeps every cart in the Cart and CartItem tables. 'cookie' keeps the carts of
+# anonymous visitors in a signed cookie, moved to the database when they grow past
+# CART_COOKIE_MAX_LINES lines or when the visitor logs in (see carts.storage).
+# 'write_behind' records quantity changes in the CART_WRITE_BEHIND_CACHE cache and writes
+# them in batches (see carts.writebehind); that cache must be shared and persistent
+# (Redis) for the pending changes to survive a worker restart, and must not evict. A journal
+# entry still missing after CART_WRITE_BEHIND_GRACE seconds is skipped.
+
+CART_STORAGE = 'database'
+CART_COOKIE_MAX_LINES = 20
+CART_COOKIE_AGE = 60 * 60 * 24 * 30
+CART_WRITE_BEHIND_CACHE = 'cart_journal'
+CART_WRITE_BEHIND_BATCH = 100
+CART_WRITE_BEHIND_INTERVAL = 5
+CART_WRITE_BEHIND_GRACE = 30
+
+# Tax rate (%) of the cart summary, applied on the total after discount.
+CART_TAX_RATE = 20
+
+# Age of the carts deleted by the purge_carts command.
+CART_PURGE_AGE_DAYS = 30
+
+# Stock reservations
+# When enabled, adding to the cart holds the units (see store.reservations): they are taken
+# from Product.stock, or from its stock shards when the stock was spread with
+# benchmark_reservations/shard_stock(), and given back when the item is removed or when the
+# hold is older than STOCK_RESERVATION_TTL seconds (sweep_reservations command).
+
+STOCK_RESERVATIONS = False
+STOCK_RESERVATION_TTL = 15 * 60
+
+# Product feeds
+# Served by the product_feed view, or written by the export_catalog command, whose links
+# start with FEED_BASE_URL (see store.feeds).
+
+FEED_BASE_URL = 'http://localhost:8000'
+FEED_CURRENCY = 'EUR'
+FEED_TITLE = 'Dream Shop'
+
+# Responsive images
+# Every uploaded product and category image gets a WebP and a JPEG derivative per width,
+# stored next to it (see store.images) by IMAGE_DERIVATIVE_WORKERS processes (0: during the
+# request). When IMAGE_DERIVATIVES is enabled, the templates serve them with srcset: run the
+# generate_image_derivatives command on the existing images before enabling it.
+
+IMAGE_DERIVATIVES = False
+IMAGE_DERIVATIVE_WIDTHS = (160, 320, 640, 960)
+IMAGE_DERIVATIVE_QUALITY = 80
+IMAGE_DERIVATIVE_WORKERS = 2
@@ -0,0 +1,106 @@
+import threading
+
+from django.conf import settings
+from django.db import connections, transaction
+
+from category.tree import category_tree
+from store.cache import LocalIndex, get_versions
+from store.models import Product
+
+
+# Product types of the category link groups of the home page.
+HOME_LINK_GROUPS = {
+	'women_links': 'B',
+	'men_links': 'A',
+	'women_acc': 'X',
+	'men_acc': 'Y',
+}
+
+
+class HomeSnapshot(LocalIndex):
+	"""
+		In-memory snapshot of the catalog data of the home page.
+
+		Holds the best seller products with their URLs and image URLs already resolved, and the
+		category link groups of the category tree (see category.tree). When the catalog changes, the current snapshot keeps being served
+		while a new one is built in a background thread (settings.HOME_SNAPSHOT_BACKGROUND),
+		so the home page runs no catalog query once the first snapshot is built.
+	"""
+
+	def __init__(self):
+		super().__init__()
+		self.data = None
+		self.refreshing = False
+
+	def load(self):
+		self.data = build_home_data()
+
+	def get(self):
+		"""
+			Return the current home page data, refreshing it if the catalog changed.
+		"""
+		versions = get_versions(self.namespaces)
+		if versions != self.versions:
+			if self.data is not None and getattr(settings, 'HOME_SNAPSHOT_BACKGROUND', True):
+				self.refresh_in_background(versions)
+			else:
+				with self.lock:
+					self.load()
+					self.versions = versions
+		return self.data
+
+	def refresh_in_background(self, versions):
+		"""
+			Build a new snapshot in a background thread once the current transaction is committed.
+
+			The thread reads through its own connection, which cannot see the changes of an
+			open transaction; a rolled back transaction starts no refresh.
+		"""
+		transaction.on_commit(lambda: self.start_refresh(versions))
+
+	def start_refresh(self, versions):
+		"""
+			Start the background thread building a new snapshot, unless one is already being built.
+		"""
+		with self.lock:
+			if self.refreshing:
+				return
+			self.refreshing = True
+
+		def refresh():
+			try:
+				data = build_home_data()
+				with self.lock:
+					self.data = data
+					self.versions = versions
+			finally:
+				with self.lock:
+					self.refreshing = False
+				connections.close_all()
+
+		threading.Thread(target=refresh, name='home-snapshot', daemon=True).start()
+
+
+def build_home_data():
+	"""
+		Build the catalog data of the home page.
+
+		Returns:
+			dict: The best seller products, as plain values, and the category link groups.
+	"""
+	products = []
+	best_seller = next((node for node in category_tree.all() if node.category_online == "Best seller"), None)
+	if best_seller is not None:
+		for product in Product.objects.filter(is_available=True, category_id=best_seller.id).select_related('category')[:3]:
+			products.append({
+				'title_online': product.title_online,
+				'price': product.price,
+				'url': product.get_url(),
+				'image_url': product.images.url if product.images else '',
+			})
+	data = dict((name, category_tree.product_type(product_type)) for name, product_type in HOME_LINK_GROUPS.items())
+	data['products'] = products
+	return data
+
+
+home_snapshot = HomeSnapshot()
@@ -0,0 +1,84 @@
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from category.models import Category
+from store.models import Product
+from .snapshots import home_snapshot
+
+
+@override_settings(HOME_SNAPSHOT_BACKGROUND=False)
+class HomeSnapshotTest(TestCase):
+  """
+    Test class for the in-memory snapshot of the home page.
+
+    Methods:
+      setUp: Set up environment for each test.
+      test_snapshot_content: Test if the snapshot holds the best sellers and the category links.
+      test_home_without_catalog_query: Test if the home page runs no catalog query once the snapshot is built.
+      test_snapshot_follows_catalog: Test if the snapshot is rebuilt after a catalog change.
+      test_background_refresh_serves_previous_snapshot: Test if the previous snapshot is served while a new one is built.
+  """
+  def setUp(self):
+    """
+      Set up environment for each test.
+
+      Creates a best seller category with four products and a women clothing category.
+    """
+    cache.clear()
+    self.best = Category.objects.create(category_name='Best', category_online='Best seller', slug='best')
+    self.dresses = Category.objects.create(category_name='Robes', category_online='Robes', slug='robes', product_type='B')
+    for i in range(4):
+      Product.objects.create(product_name='Top %d' % i, title_online='Top %d' % i, slug='top-%d' % i, images='photos/products/top.jpg', category=self.best)
+
+
+  def test_snapshot_content(self):
+    """
+      Test if the snapshot holds the best sellers and the category links.
+    """
+    data = home_snapshot.get()
+    self.assertEqual(len(data['products']), 3)
+    self.assertEqual(data['products'][0]['url'], '/store/category/best/top-0/')
+    self.assertEqual(data['products'][0]['image_url'], '/media/photos/products/top.jpg')
+    self.assertEqual([(node.category_online, node.get_url()) for node in data['women_links']], [('Robes', '/store/category/robes/')])
+    self.assertEqual(data['men_acc'], [])
+
+
+  def test_home_without_catalog_query(self):
+    """
+      Test if the home page runs no catalog query once the snapshot is built.
+    """
+    self.client.get(reverse('home'))
+    with CaptureQueriesContext(connection) as queries:
+      response = self.client.get(reverse('home'))
+    self.assertFalse([query for query in queries if 'FROM "store_product"' in query['sql']])
+    self.assertContains(response, 'Top 2')
+
+
+  def test_snapshot_follows_catalog(self):
+    """
+      Test if the snapshot is rebuilt after a catalog change.
+    """
+    home_snapshot.get()
+    with self.captureOnCommitCallbacks(execute=True):
+      Product.objects.filter(slug='top-0').get().delete()
+    titles = [product['title_online'] for product in home_snapshot.get()['products']]
+    self.assertEqual(titles, ['Top 1', 'Top 2', 'Top 3'])
+
+
+  def test_background_refresh_serves_previous_snapshot(self):
+    """
+      Test if the previous snapshot is served while a new one is built.
+
+      The refresh only starts once the transaction of the test is committed, so no thread is started.
+    """
+    previous = home_snapshot.get()
+    with self.captureOnCommitCallbacks(execute=True):
+      self.best.category_online = 'Former best seller'
+      self.best.save()
+    with self.settings(HOME_SNAPSHOT_BACKGROUND=True), self.assertNumQueries(0):
+      with self.captureOnCommitCallbacks() as callbacks:
+        self.assertIs(home_snapshot.get(), previous)
+    self.assertEqual(len(callbacks), 1)
+    self.assertFalse(home_snapshot.refreshing)
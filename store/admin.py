@@ -1,31 +1,151 @@
-from django.contrib import admin
+from django import forms
+from django.contrib import admin, messages
+from django.contrib.admin.helpers import ActionForm
+from django.core.exceptions import ValidationError
+from django.db.models import F
+from django.db.models.functions import Round
+from .cache import CATALOG, bump_version, invalidate_tags, product_tags
 from .models import Product, Variation
+from .pagination import EstimatedCountPaginator
+
+
+def bulk_update_products(products, **values):
+	"""
+	    Update the given products with one UPDATE, then invalidate the caches showing them.
+
+	    A bulk UPDATE sends no signal, so the cache tags of the products are read before the
+	    update (which may change the selection) and invalidated after it.
+
+	    Args:
+	      products (QuerySet): The products to update.
+	      values: The new values, as for QuerySet.update().
+
+	    Returns:
+	      int: The number of updated products.
+	"""
+	tags = set()
+	rows = products.values_list('slug', 'category__slug', 'category__gender', 'category__product_type')
+	for slug, category_slug, gender, product_type in rows.iterator():
+		tags.update(product_tags(slug, category_slug, gender, product_type))
+	updated = products.update(**values)
+	bump_version(CATALOG)
+	invalidate_tags(tags)
+	return updated
+
+
+class ProductActionForm(ActionForm):
+	"""
+	    Action form of the product changelist, with the percentage of the price adjustment.
+	"""
+	percent = forms.DecimalField(required=False, max_digits=6, decimal_places=2, label='Price change (%)')
 
 
 class ProductAdmin(admin.ModelAdmin):
 	"""
 		Admin configuration for the Product model.
-	
+
+		The changelist stays fast on large catalogs: the category is joined, the total count
+		comes from the table statistics (see EstimatedCountPaginator), and the bulk actions
+		run one UPDATE for the whole selection.
+
 		Attributes:
 			list_display (tuple): Fields to display in the admin list view.
+			list_select_related (tuple): Foreign keys joined to the changelist query.
+			list_filter (tuple): Fields to use for filtering in the admin list view.
+			search_fields (tuple): Fields searched from the list view and by the autocomplete widgets.
 			prepopulated_fields (dict): Fields to prepopulate based on other fields.
+			paginator (class): Counts the whole table from its statistics.
+			show_full_result_count (bool): Disabled, to skip the COUNT of the whole table on filtered lists.
+			action_form (class): Action form with the percentage of adjust_price.
+			actions (list): Bulk actions run as one UPDATE.
 	"""
 	list_display = ('product_name', 'price', 'stock', 'category', 'modified_date', 'is_available')
+	list_select_related = ('category',)
+	list_filter = ('is_available', 'category')
+	search_fields = ('product_name', 'slug')
 	prepopulated_fields = {'slug': ('product_name',)}
+	paginator = EstimatedCountPaginator
+	show_full_result_count = False
+	action_form = ProductActionForm
+	actions = ['adjust_price', 'mark_unavailable_when_out_of_stock']
+
+	@admin.action(description='Adjust the price of the selected products by the percentage')
+	def adjust_price(self, request, queryset):
+		"""
+		      Change the price of the selected products by the percentage of the action form, rounded to the cent.
+		"""
+		try:
+			percent = ProductActionForm.base_fields['percent'].clean(request.POST.get('percent'))
+		except ValidationError:
+			percent = None
+		if percent is None:
+			self.message_user(request, 'Enter the percentage of the price change.', messages.ERROR)
+			return
+		factor = 1 + float(percent) / 100
+		if factor < 0:
+			self.message_user(request, 'A price cannot decrease by more than 100%.', messages.ERROR)
+			return
+		updated = bulk_update_products(queryset, price=Round(F('price') * factor, 2))
+		self.message_user(request, '%d product(s) repriced.' % updated, messages.SUCCESS)
+
+	@admin.action(description='Mark the selected products out of stock as unavailable')
+	def mark_unavailable_when_out_of_stock(self, request, queryset):
+		"""
+		      Mark unavailable the selected products whose stock is 0 or less.
+		"""
+		updated = bulk_update_products(queryset.filter(stock__lte=0, is_available=True), is_available=False)
+		self.message_user(request, '%d product(s) marked unavailable.' % updated, messages.SUCCESS)
 
 
 class VariationAdmin(admin.ModelAdmin):
 	"""
 	    Admin configuration for the Variation model.
-	
+
+	    The filters only list the variation categories and the activation state; variations
+	    are found by product name or value with the search box.
+
 	    Attributes:
 	      list_display (tuple): Fields to display in the admin list view.
+	      list_select_related (tuple): Foreign keys joined to the changelist query.
 	      list_editable (tuple): Fields that can be edited directly in the list view.
 	      list_filter (tuple): Fields to use for filtering in the admin list view.
+	      search_fields (tuple): Fields searched from the list view.
+	      autocomplete_fields (tuple): Foreign keys chosen with a search widget instead of a select of every row.
+	      paginator (class): Counts the whole table from its statistics.
+	      show_full_result_count (bool): Disabled, to skip the COUNT of the whole table on filtered lists.
+	      actions (list): Bulk actions run as one UPDATE.
   	"""
 	list_display = ('product', 'variation_category', 'variation_value', 'is_active')
+	list_select_related = ('product',)
 	list_editable = ('is_active',)
-	list_filter = ('product', 'variation_category', 'variation_value')
+	list_filter = ('variation_category', 'is_active')
+	search_fields = ('product__product_name', 'variation_value')
+	autocomplete_fields = ('product',)
+	paginator = EstimatedCountPaginator
+	show_full_result_count = False
+	actions = ['activate_variations', 'deactivate_variations']
+
+	def _set_active(self, request, queryset, is_active):
+		# Read the product pages to invalidate before the UPDATE changes the selection
+		slugs = Product.objects.filter(variation__in=queryset).values_list('slug', flat=True).distinct()
+		tags = set('product:%s' % slug for slug in slugs.iterator())
+		updated = queryset.update(is_active=is_active)
+		invalidate_tags(tags)
+		self.message_user(request, '%d variation(s) %s.' % (updated, 'activated' if is_active else 'deactivated'), messages.SUCCESS)
+
+	@admin.action(description='Activate the selected variations')
+	def activate_variations(self, request, queryset):
+		"""
+		      Activate the selected variations.
+		"""
+		self._set_active(request, queryset, True)
+
+	@admin.action(description='Deactivate the selected variations')
+	def deactivate_variations(self, request, queryset):
+		"""
+		      Deactivate the selected variations.
+		"""
+		self._set_active(request, queryset, False)
 
 # Register the Product model with its corresponding admin configuration.
 admin.site.register(Product, ProductAdmin)
@@ -11,3 +11,9 @@ class StoreConfig(AppConfig):
 	"""
 	default_auto_field = 'django.db.models.BigAutoField'
 	name = 'store'
+
+	def ready(self):
+		"""
+		Connect the signal receivers keeping the search index up to date.
+		"""
+		from . import signals  # noqa: F401
@@ -0,0 +1,155 @@
+import unicodedata
+from bisect import bisect_left, insort
+
+from django.urls import reverse
+
+from category.models import Category
+from .cache import LocalIndex
+from .models import Product
+
+
+# Maximum number of suggestions returned by the autocomplete endpoint.
+MAX_SUGGESTIONS = 20
+
+
+def normalize(text):
+    """
+        Fold a text for prefix matching: lower case, without accents or surrounding spaces.
+    """
+    decomposed = unicodedata.normalize('NFKD', text or '')
+    return ''.join(char for char in decomposed if not unicodedata.combining(char)).casefold().strip()
+
+
+def word_starts(key):
+    """
+        Return the suffixes of a normalized name starting at each of its words but the first.
+    """
+    starts = []
+    for index in range(1, len(key)):
+        if key[index].isalnum() and not key[index - 1].isalnum():
+            starts.append(key[index:])
+    return starts
+
+
+class AutocompleteIndex(LocalIndex):
+    """
+        In-memory prefix index of the product and category names.
+
+        Two sorted arrays of (key, kind, pk) tuples are searched with a binary search: one with
+        the whole names, one with the names starting at each of their other words, so that
+        'shirt' also suggests 'Oxford shirt' after the names starting with 'shirt'. Suggestions
+        are answered from memory only, the database is read when the index is (re)loaded.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.names = []
+        self.words = []
+        self.entries = {}
+        self.category_products = {}
+
+    def load(self):
+        self.names, self.words, self.entries, self.category_products = [], [], {}, {}
+        for category in Category.objects.all():
+            self._add_category(category)
+        for product in Product.objects.filter(is_available=True).select_related('category').iterator():
+            self._add_product(product)
+        self.names.sort()
+        self.words.sort()
+
+    def _add(self, kind, pk, labels, url, keep_sorted=True):
+        keys = set()
+        for label in labels:
+            key = normalize(label)
+            if key:
+                keys.add(key)
+        add = insort if keep_sorted else list.append
+        for key in keys:
+            add(self.names, (key, kind, pk))
+            for start in word_starts(key):
+                add(self.words, (start, kind, pk))
+        self.entries[(kind, pk)] = {'label': labels[0], 'url': url, 'keys': keys}
+
+    def _remove(self, kind, pk):
+        entry = self.entries.pop((kind, pk), None)
+        if entry is None:
+            return
+        for key in entry['keys']:
+            del self.names[bisect_left(self.names, (key, kind, pk))]
+            for start in word_starts(key):
+                del self.words[bisect_left(self.words, (start, kind, pk))]
+
+    def _add_category(self, category, keep_sorted=False):
+        self._add('category', category.pk, [category.category_name], category.get_url(), keep_sorted)
+
+    def _add_product(self, product, keep_sorted=False):
+        labels = [product.title_online or product.product_name, product.product_name]
+        self._add('product', product.pk, labels, product.get_url(), keep_sorted)
+        self.entries[('product', product.pk)]['slug'] = product.slug
+        self.category_products.setdefault(product.category_id, set()).add(product.pk)
+
+    def suggest(self, prefix, limit=8):
+        """
+            Return up to `limit` products and categories whose name, or a word of it, starts with `prefix`.
+
+            Returns:
+              list: {'type', 'label', 'url'} dictionaries, whole-name matches first, each in name order.
+        """
+        self.ensure_current()
+        prefix = normalize(prefix)
+        if not prefix:
+            return []
+        results = []
+        seen = set()
+        with self.lock:
+            for array in (self.names, self.words):
+                index = bisect_left(array, (prefix,))
+                while index < len(array) and len(results) < limit:
+                    key, kind, pk = array[index]
+                    if not key.startswith(prefix):
+                        break
+                    if (kind, pk) not in seen:
+                        seen.add((kind, pk))
+                        entry = self.entries[(kind, pk)]
+                        results.append({'type': kind, 'label': entry['label'], 'url': entry['url']})
+                    index += 1
+        return results
+
+    def product_saved(self, product):
+        """
+            Replace the entries of a saved product, or drop them if it is unavailable.
+        """
+        self._remove('product', product.pk)
+        for products in self.category_products.values():
+            products.discard(product.pk)
+        if product.is_available:
+            self._add_product(product, keep_sorted=True)
+
+    def product_deleted(self, product_id):
+        """
+            Drop the entries of a deleted product.
+        """
+        self._remove('product', product_id)
+        for products in self.category_products.values():
+            products.discard(product_id)
+
+    def category_saved(self, category):
+        """
+            Replace the entry of a saved category and refresh the URLs of its products.
+        """
+        self._remove('category', category.pk)
+        self._add_category(category, keep_sorted=True)
+        for product_id in self.category_products.get(category.pk, ()):
+            entry = self.entries[('product', product_id)]
+            entry['url'] = reverse('product_detail', args=[category.slug, entry['slug']])
+
+    def category_deleted(self, category_id):
+        """
+            Drop the entries of a deleted category and of its products.
+        """
+        self._remove('category', category_id)
+        for product_id in self.category_products.pop(category_id, set()):
+            self._remove('product', product_id)
+
+
+autocomplete_index = AutocompleteIndex()
@@ -0,0 +1,253 @@
+import hashlib
+import random
+import threading
+
+from django.conf import settings
+from django.core.cache import cache
+
+
+# Version namespaces: every catalog change bumps 'catalog', category changes also bump 'categories'.
+CATALOG = 'catalog'
+CATEGORIES = 'categories'
+
+VERSION_KEY = 'store:version:%s'
+
+
+def get_versions(namespaces):
+    """
+        Return the current version tokens of the given namespaces, in the same order.
+
+        A version is a counter started at a random value rather than at 0, so that a cleared
+        or restarted cache can never hand out a version that an in-process index already has.
+    """
+    keys = [VERSION_KEY % namespace for namespace in namespaces]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            cache.add(key, random.randrange(1 << 52), timeout=None)
+            versions[key] = cache.get(key)
+    return tuple(versions[key] for key in keys)
+
+
+def get_version(namespace=CATALOG):
+    """
+        Return the current version token of a namespace.
+    """
+    return get_versions([namespace])[0]
+
+
+def bump_version(namespace=CATALOG):
+    """
+        Move a namespace to a new version, invalidating every value cached under the old one.
+
+        The counter is incremented atomically by the cache, so concurrent writers each get
+        their own version and the exact previous one.
+
+        Returns:
+          tuple: The previous and the new version tokens.
+    """
+    key = VERSION_KEY % namespace
+    while True:
+        try:
+            version = cache.incr(key)
+        except ValueError:
+            # Missing (or cleared) counter: start it, then increment
+            cache.add(key, random.randrange(1 << 52), timeout=None)
+            continue
+        return version - 1, version
+
+
+def get_catalog_version():
+    """
+        Return the current version of the catalog.
+    """
+    return get_version(CATALOG)
+
+
+def bump_catalog_version():
+    """
+        Invalidate every cached catalog value by moving to a new catalog version.
+    """
+    return bump_version(CATALOG)
+
+
+def catalog_key(name, *parts):
+    """
+        Build a cache key bound to the current catalog version.
+
+        The variable parts usually come from the query string, so they are hashed
+        to keep the key short and valid for every cache backend.
+    """
+    digest = hashlib.md5(repr(parts).encode('utf-8')).hexdigest()
+    return 'store:%s:%s:%s' % (get_catalog_version(), name, digest)
+
+
+def invalidate_tags(tags):
+    """
+        Move every given tag to a new version, invalidating the views cached under it.
+    """
+    # Random counters, so that a tag sharing its key with a namespace can still be bumped
+    cache.set_many(dict((VERSION_KEY % tag, random.randrange(1 << 52)) for tag in set(tags)), timeout=None)
+
+
+def product_tags(slug, category_slug, gender, product_type):
+    """
+        Return the tags of the cached views showing a product.
+    """
+    return [
+        'product:%s' % slug,
+        'listing:%s' % category_slug,
+        'listing:all',
+        'listing:gender:%s' % gender,
+        'listing:type:%s' % product_type,
+    ]
+
+
+def category_tags(slug, gender, product_type):
+    """
+        Return the tags of the cached views depending on a category.
+    """
+    return [
+        'category:%s' % slug,
+        'listing:%s' % slug,
+        'listing:all',
+        'listing:gender:%s' % gender,
+        'listing:type:%s' % product_type,
+        'categories',
+    ]
+
+
+def listing_tags(gender=None, product_type=None):
+    """
+        Return the tags of a store listing filtered by gender and product type.
+    """
+    tags = []
+    if gender is not None:
+        tags.append('listing:gender:%s' % gender)
+    if product_type is not None:
+        tags.append('listing:type:%s' % product_type)
+    return tags or ['listing:all']
+
+
+STATS_KEY = 'store:stats:%s:%s'
+
+# Views cached with cached_view_data, listed for view_cache_stats.
+CACHED_VIEWS = ('store', 'product_detail')
+
+
+def _count(view, outcome):
+    key = STATS_KEY % (view, outcome)
+    try:
+        cache.incr(key)
+    except ValueError:
+        if not cache.add(key, 1, timeout=None):
+            cache.incr(key)
+
+
+def cached_view_data(view, params, tags, build):
+    """
+        Return the catalog data of a view, built by `build` on a cache miss.
+
+        Only the catalog part of a page is cached, never the response: the navbar, the cart
+        badge and the CSRF token still come from the request. The entry is bound to the
+        versions of its tags (see invalidate_tags), so it is replaced as soon as a related
+        product, variation or category changes, and is otherwise kept without expiry.
+
+        Args:
+          view (str): The name of the view, used in the key and the hit/miss counters.
+          params (tuple): The request values the data depends on.
+          tags (list): The tags invalidating the data.
+          build (callable): Builds the data on a miss; may raise Http404, which is not cached.
+    """
+    versions = get_versions(tags)
+    digest = hashlib.md5(repr((params, versions)).encode('utf-8')).hexdigest()
+    key = 'store:view:%s:%s' % (view, digest)
+    data = cache.get(key)
+    if data is None:
+        _count(view, 'misses')
+        data = build()
+        cache.set(key, data, timeout=getattr(settings, 'STORE_VIEW_CACHE_TIMEOUT', None))
+    else:
+        _count(view, 'hits')
+    return data
+
+
+def view_cache_stats():
+    """
+        Return the hit and miss counters of the cached views.
+
+        Returns:
+          dict: {view: {'hits': int, 'misses': int}}
+    """
+    keys = [STATS_KEY % (view, outcome) for view in CACHED_VIEWS for outcome in ('hits', 'misses')]
+    counters = cache.get_many(keys)
+    return dict(
+        (view, dict((outcome, counters.get(STATS_KEY % (view, outcome), 0)) for outcome in ('hits', 'misses')))
+        for view in CACHED_VIEWS
+    )
+
+
+def reset_view_cache_stats():
+    """
+        Reset the hit and miss counters of the cached views.
+    """
+    cache.delete_many([STATS_KEY % (view, outcome) for view in CACHED_VIEWS for outcome in ('hits', 'misses')])
+
+
+class LocalIndex:
+    """
+        Base class of the in-process structures derived from the catalog.
+
+        The structure is loaded from the database on first use and tagged with the versions
+        of its namespaces. The process that saves a row applies the change in place through
+        `apply`; the other processes see a new version and reload on their next read.
+
+        Subclasses implement `load`, which (re)builds the structure from the database.
+    """
+    namespaces = (CATALOG,)
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.versions = None
+
+    def load(self):
+        raise NotImplementedError
+
+    def ensure_current(self):
+        """
+            Reload the structure if a namespace moved to a version it has not seen.
+        """
+        versions = get_versions(self.namespaces)
+        if versions != self.versions:
+            with self.lock:
+                if versions != self.versions:
+                    self.load()
+                    self.versions = versions
+
+    def apply(self, namespace, previous, version, change):
+        """
+            Apply a local change made while `namespace` moved from `previous` to `version`.
+
+            If the structure had missed an earlier change it is marked stale instead,
+            and reloaded on next use.
+        """
+        if namespace not in self.namespaces:
+            return
+        with self.lock:
+            if self.versions is None:
+                return
+            index = self.namespaces.index(namespace)
+            if self.versions[index] != previous:
+                self.versions = None
+                return
+            change()
+            versions = list(self.versions)
+            versions[index] = version
+            self.versions = tuple(versions)
+
+    def reset(self):
+        """
+            Drop the structure; it is reloaded on next use.
+        """
+        with self.lock:
+            self.versions = None
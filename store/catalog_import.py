@@ -0,0 +1,383 @@
+import csv
+import json
+import math
+import time
+
+from django.db import transaction
+from django.utils import timezone
+from django.utils.text import slugify
+
+from category.models import Category
+from .cache import CATALOG, CATEGORIES, bump_version, category_tags, invalidate_tags, product_tags
+from .models import Product, Variation
+from .search import get_backend
+from .storage import ContentAddressedStorage
+
+
+# Columns of a feed row copied to the product, with their parsers.
+PRODUCT_FIELDS = {
+    'title_online': str,
+    'description': str,
+    'price': float,
+    'stock': int,
+    'images': str,
+    'is_available': lambda value: value if isinstance(value, bool) else str(value).strip().lower() in ('1', 'true', 'yes', 'y'),
+}
+
+# Columns of a feed row copied to a new or updated category.
+CATEGORY_FIELDS = ('category_online', 'gender', 'product_type')
+
+# Columns of a feed row listing the variations of the product, with their variation category.
+VARIATION_COLUMNS = {
+    'sizes': 'size',
+    'colors': 'color',
+}
+
+
+class CatalogImportError(Exception):
+    """
+        Raised for a feed row that cannot be imported.
+    """
+
+
+def read_rows(path, feed_format=None):
+    """
+        Stream the rows of a CSV or JSON Lines feed, one dict at a time.
+
+        The CSV variation columns (sizes, colors) separate their values with '|'.
+
+        Args:
+            path (str): The path of the feed.
+            feed_format (str): 'csv' or 'jsonl' (default: from the file extension).
+
+        Yields:
+            tuple: The line number and the row.
+    """
+    feed_format = feed_format or ('jsonl' if path.endswith(('.jsonl', '.ndjson')) else 'csv')
+    with open(path, encoding='utf-8-sig', newline='') as feed:
+        if feed_format == 'jsonl':
+            for number, line in enumerate(feed, 1):
+                if line.strip():
+                    try:
+                        yield number, json.loads(line)
+                    except ValueError as error:
+                        yield number, error
+        else:
+            reader = csv.DictReader(feed)
+            for row in reader:
+                for column in VARIATION_COLUMNS:
+                    if row.get(column) is not None:
+                        row[column] = [value for value in row[column].split('|') if value.strip()]
+                yield reader.line_num, row
+
+
+def available_slug(value, taken, max_length=200, own=None):
+    """
+        Return the slug of `value`, with a numeric suffix if it is already in `taken`.
+
+        `own`, the current slug of the row, does not count as taken.
+    """
+    base = slugify(value)[:max_length] or 'item'
+    slug, number = base, 1
+    while slug in taken and slug != own:
+        number += 1
+        suffix = '-%d' % number
+        slug = base[:max_length - len(suffix)] + suffix
+    return slug
+
+
+def unique_slug(value, taken, max_length=200):
+    """
+        Return the slug of `value`, with a numeric suffix if it is already in `taken`, and add it to `taken`.
+    """
+    slug = available_slug(value, taken, max_length)
+    taken.add(slug)
+    return slug
+
+
+def check_field(model, name, value):
+    """
+        Check a value against the length and the choices of a model field.
+
+        Raises:
+            CatalogImportError: If the value is too long or not one of the choices.
+    """
+    field = model._meta.get_field(name)
+    if isinstance(value, str) and field.max_length is not None and len(value) > field.max_length:
+        raise CatalogImportError('%s is longer than %d characters.' % (name, field.max_length))
+    if field.choices and value not in dict(field.flatchoices):
+        raise CatalogImportError('Invalid %s: %r.' % (name, value))
+
+
+class CatalogImporter:
+    """
+        Create and update categories, products and variations from feed rows, in batches.
+
+        Each row describes one product (matched on product_name) with its category (matched
+        on category name, created when missing) and, optionally, the complete list of its
+        sizes and colors: listed variations are created or reactivated, the others are
+        deactivated. A batch is written in one transaction with bulk_create/bulk_update and
+        a fixed number of queries, whatever its size: categories and slugs are resolved from
+        maps loaded once, the products of the batch are read with one query.
+
+        Bulk writes send no model signal, so the importer refreshes the search documents of
+        each batch, counts the references of the image blobs and moves the catalog caches to
+        new versions itself.
+
+        Attributes:
+            batch_size (int): The number of rows written per transaction.
+            stats (dict): The counters of the import.
+            errors (list): The (line, message) of the rejected rows.
+    """
+
+    def __init__(self, batch_size=1000):
+        self.batch_size = batch_size
+        self.stats = dict.fromkeys(
+            ('rows', 'categories_created', 'categories_updated', 'products_created', 'products_updated',
+             'products_unchanged', 'variations_created', 'variations_updated'), 0,
+        )
+        self.errors = []
+        self.categories = dict((category.category_name, category) for category in Category.objects.all())
+        self.category_slugs = set(category.slug for category in self.categories.values())
+        self.product_slugs = set(Product.objects.values_list('slug', flat=True).iterator())
+        self.backend = get_backend()
+
+    def run(self, rows, progress=None):
+        """
+            Import every row, `batch_size` rows at a time.
+
+            Args:
+                rows (iterable): The (line number, row) pairs, see read_rows.
+                progress (callable): Called with the stats after each batch (default: none).
+
+            Returns:
+                dict: The counters of the import, with the elapsed time and the rows per second.
+        """
+        start = time.monotonic()
+        batch = []
+        for number, row in rows:
+            try:
+                batch.append(self.clean(row))
+            except CatalogImportError as error:
+                self.errors.append((number, str(error)))
+            if len(batch) >= self.batch_size:
+                self.write(batch)
+                batch = []
+                if progress:
+                    progress(self.stats)
+        if batch:
+            self.write(batch)
+            if progress:
+                progress(self.stats)
+        elapsed = time.monotonic() - start
+        return dict(self.stats, elapsed=elapsed, rate=self.stats['rows'] / elapsed if elapsed else 0)
+
+    def clean(self, row):
+        """
+            Validate a feed row and convert its values.
+
+            Raises:
+                CatalogImportError: If the row has no product name or category, a value its model field refuses,
+                    a price that is not a finite number or a negative stock.
+        """
+        if isinstance(row, Exception):
+            raise CatalogImportError('Invalid JSON: %s' % row)
+        if not isinstance(row, dict):
+            raise CatalogImportError('A row must be an object.')
+        name = str(row.get('product_name') or '').strip()
+        category = str(row.get('category') or '').strip()
+        if not name or not category:
+            raise CatalogImportError('product_name and category are required.')
+        # Checked here, so that a value the database would refuse rejects the row, not the batch
+        check_field(Product, 'product_name', name)
+        check_field(Category, 'category_name', category)
+        cleaned = {'product_name': name, 'category': category, 'slug': row.get('slug') or None, 'fields': {}}
+        for field, parse in PRODUCT_FIELDS.items():
+            if row.get(field) not in (None, ''):
+                try:
+                    cleaned['fields'][field] = parse(row[field])
+                except (TypeError, ValueError):
+                    raise CatalogImportError('Invalid %s: %r.' % (field, row[field]))
+                check_field(Product, field, cleaned['fields'][field])
+        if 'price' in cleaned['fields'] and not math.isfinite(cleaned['fields']['price']):
+            raise CatalogImportError('Invalid price: %r.' % row['price'])
+        if cleaned['fields'].get('stock', 0) < 0:
+            raise CatalogImportError('The stock cannot be negative.')
+        cleaned['category_fields'] = dict((field, str(row[field])) for field in CATEGORY_FIELDS if row.get(field))
+        for field, value in cleaned['category_fields'].items():
+            check_field(Category, field, value)
+        cleaned['category_slug'] = row.get('category_slug') or None
+        cleaned['variations'] = {}
+        for column, variation_category in VARIATION_COLUMNS.items():
+            if row.get(column) is not None:
+                if not isinstance(row[column], list):
+                    raise CatalogImportError('%s must be a list.' % column)
+                cleaned['variations'][variation_category] = [str(value).strip() for value in row[column]]
+                for value in cleaned['variations'][variation_category]:
+                    check_field(Variation, 'variation_value', value)
+        return cleaned
+
+    def write(self, batch):
+        """
+            Write a batch of cleaned rows in one transaction.
+        """
+        # The last row of a product wins
+        rows = dict((row['product_name'], row) for row in batch)
+        tags = set()
+        with transaction.atomic():
+            categories_changed = self.write_categories(rows.values(), tags)
+            products, changed = self.write_products(rows, tags)
+            variations_changed = self.write_variations(rows, products)
+            self.backend.index(changed)
+        tags.update('product:%s' % product.slug for product in products.values() if product.pk in variations_changed)
+        if categories_changed:
+            bump_version(CATEGORIES)
+        if tags:
+            bump_version(CATALOG)
+            invalidate_tags(tags)
+        self.stats['rows'] += len(batch)
+
+    def write_categories(self, rows, tags):
+        created, updated = {}, {}
+        for row in rows:
+            category = self.categories.get(row['category']) or created.get(row['category'])
+            if category is None:
+                category = Category(
+                    category_name=row['category'],
+                    slug=unique_slug(row['category_slug'] or row['category'], self.category_slugs, 100),
+                    **row['category_fields']
+                )
+                created[row['category']] = category
+            elif any(getattr(category, field) != value for field, value in row['category_fields'].items()):
+                if category.pk is not None:
+                    tags.update(category_tags(category.slug, category.gender, category.product_type))
+                    updated[category.pk] = category
+                for field, value in row['category_fields'].items():
+                    setattr(category, field, value)
+        if created:
+            Category.objects.bulk_create(created.values())
+            # Backends without RETURNING (MySQL) leave the primary keys unset
+            pks = dict(Category.objects.filter(category_name__in=created).values_list('category_name', 'pk'))
+            for name, category in created.items():
+                category.pk = pks[name]
+                self.categories[name] = category
+        if updated:
+            Category.objects.bulk_update(updated.values(), CATEGORY_FIELDS)
+            for category in updated.values():
+                tags.update(category_tags(category.slug, category.gender, category.product_type))
+        self.stats['categories_created'] += len(created)
+        self.stats['categories_updated'] += len(updated)
+        return bool(created or updated)
+
+    def write_products(self, rows, tags):
+        existing = dict((product.product_name, product) for product in Product.objects.filter(product_name__in=rows))
+        categories_by_pk = dict((category.pk, category) for category in self.categories.values())
+        now = timezone.now()
+        products, created, updated = {}, [], []
+        update_fields = set()
+        # The image names written and the ones they replaced, see count_images
+        images, replaced = [], []
+        for name, row in rows.items():
+            category = self.categories[row['category']]
+            product = existing.get(name)
+            if product is None:
+                product = Product(product_name=name, title_online=name, category=category)
+                product.slug = unique_slug(row['slug'] or name, self.product_slugs)
+                for field, value in row['fields'].items():
+                    setattr(product, field, value)
+                images.append(product.images.name)
+                created.append(product)
+            else:
+                # Rows repeating the current values write nothing
+                changed = [field for field, value in row['fields'].items() if getattr(product, field) != value]
+                # The slug of the row may have been given a suffix, see unique_slug
+                if row['slug'] and available_slug(row['slug'], self.product_slugs, own=product.slug) != product.slug:
+                    changed.append('slug')
+                if product.category_id != category.pk:
+                    changed.append('category')
+                if changed:
+                    old_category = categories_by_pk.get(product.category_id)
+                    if old_category is not None:
+                        tags.update(product_tags(product.slug, old_category.slug, old_category.gender, old_category.product_type))
+                    if 'slug' in changed:
+                        self.product_slugs.discard(product.slug)
+                        product.slug = unique_slug(row['slug'], self.product_slugs)
+                    if 'images' in changed:
+                        replaced.append(product.images.name)
+                    for field, value in row['fields'].items():
+                        setattr(product, field, value)
+                    if 'images' in changed:
+                        images.append(product.images.name)
+                    product.modified_date = now
+                    update_fields.update(changed)
+                    updated.append(product)
+                product.category = category
+            products[name] = product
+        if created:
+            Product.objects.bulk_create(created)
+            pks = dict(Product.objects.filter(product_name__in=[product.product_name for product in created]).values_list('product_name', 'pk'))
+            for product in created:
+                product.pk = pks[product.product_name]
+        if updated:
+            Product.objects.bulk_update(updated, sorted(update_fields | {'modified_date'}))
+        self.count_images(images, replaced)
+        for product in created + updated:
+            tags.update(product_tags(product.slug, product.category.slug, product.category.gender, product.category.product_type))
+        self.stats['products_created'] += len(created)
+        self.stats['products_updated'] += len(updated)
+        self.stats['products_unchanged'] += len(rows) - len(created) - len(updated)
+        return products, created + updated
+
+    def count_images(self, names, replaced):
+        """
+            Reference the blobs of the imported images and release the ones they replaced, as the
+            post_save signal of a saved product does.
+
+            Args:
+                names (list): The image names written, one per product.
+                replaced (list): The image names the products no longer use.
+        """
+        storage = Product._meta.get_field('images').storage
+        if not isinstance(storage, ContentAddressedStorage):
+            return
+        storage.acquire_many(names)
+        for name in replaced:
+            if name:
+                storage.release(name)
+
+    def write_variations(self, rows, products):
+        synced = dict((products[name].pk, row['variations']) for name, row in rows.items() if row['variations'])
+        if not synced:
+            return set()
+        existing = {}
+        for variation in Variation.objects.filter(product_id__in=synced, variation_category__in=VARIATION_COLUMNS.values()):
+            existing.setdefault(variation.product_id, {})[(variation.variation_category, variation.variation_value)] = variation
+        created, activate, deactivate = [], [], []
+        changed = set()
+        for product_id, variations in synced.items():
+            current = existing.get(product_id, {})
+            wanted = set()
+            for variation_category, values in variations.items():
+                for value in values:
+                    key = (variation_category, value)
+                    if key in wanted:
+                        continue
+                    wanted.add(key)
+                    variation = current.get(key)
+                    if variation is None:
+                        created.append(Variation(product_id=product_id, variation_category=variation_category, variation_value=value))
+                        changed.add(product_id)
+                    elif not variation.is_active:
+                        activate.append(variation.pk)
+                        changed.add(product_id)
+            # Only the variation categories present in the row are synchronized
+            for key, variation in current.items():
+                if key[0] in variations and key not in wanted and variation.is_active:
+                    deactivate.append(variation.pk)
+                    changed.add(product_id)
+        Variation.objects.bulk_create(created)
+        Variation.objects.filter(pk__in=activate).update(is_active=True)
+        Variation.objects.filter(pk__in=deactivate).update(is_active=False)
+        self.stats['variations_created'] += len(created)
+        self.stats['variations_updated'] += len(activate) + len(deactivate)
+        return changed
@@ -0,0 +1,16 @@
+from .facets import facet_index
+
+
+def facet_counts(request):
+	"""
+		Provides the number of available products behind each store filter of the navbar.
+
+		Args:
+			request (HttpRequest): The HTTP request object.
+
+		Returns:
+			dict: A dictionary with the 'facet_counts' of the store filters, read from the in-memory facets.
+	"""
+	if 'admin' in request.path:
+		return {}
+	return dict(facet_counts=facet_index.filter_counts())
@@ -0,0 +1,192 @@
+from collections import Counter
+
+from django.db import transaction
+
+from category.models import Category
+from .cache import CATALOG, CATEGORIES, bump_version, category_tags, invalidate_tags, product_tags
+from .images import DERIVATIVE_FORMATS, PRODUCT_IMAGE_FIELDS, derivative_name, derivative_widths
+from .models import MediaBlob, Product
+from .storage import ContentAddressedStorage, content_digest
+
+
+class DeduplicationError(Exception):
+    """
+        Raised when the media storage is not content-addressed.
+    """
+
+
+class MediaDeduplicator:
+    """
+        Move the images of the products and categories to content-addressed blobs.
+
+        Every file referenced by an ImageField that is not a blob yet is hashed and stored as
+        the blob of its content (identical files share one blob), the rows are rewritten to
+        the blob names in batches of bulk_update, the reference counts of the blobs are set
+        to the number of fields referencing them once rewritten, and the original files, with their
+        derivatives, are removed once nothing references them. Derivatives are copied to the
+        names of the blobs, so the srcset of the templates stays complete.
+
+        Bulk updates send no model signal, so the catalog caches are moved to new versions
+        and the pages of the rewritten products and categories invalidated here.
+
+        Attributes:
+            storage (ContentAddressedStorage): The storage of the images.
+            batch_size (int): The number of rows written per transaction.
+            dry_run (bool): Only hash the files and count the duplicates.
+            keep_originals (bool): Leave the original files in place.
+            stats (dict): The counters of the deduplication.
+            missing (list): The referenced names without file.
+    """
+
+    def __init__(self, storage=None, batch_size=1000, dry_run=False, keep_originals=False):
+        self.storage = storage or Product._meta.get_field('images').storage
+        if not isinstance(self.storage, ContentAddressedStorage):
+            raise DeduplicationError('The media storage is not a ContentAddressedStorage, see settings.STORAGES.')
+        self.batch_size = batch_size
+        self.dry_run = dry_run
+        self.keep_originals = keep_originals
+        self.stats = dict.fromkeys(
+            ('files', 'duplicate_bytes', 'blobs_created', 'products_updated', 'categories_updated', 'files_deleted'), 0,
+        )
+        self.missing = []
+
+    def run(self):
+        """
+            Deduplicate every image, see the class documentation.
+
+            Returns:
+                dict: The counters of the deduplication.
+        """
+        references = self.referenced_names()
+        blobs = dict(MediaBlob.objects.values_list('digest', 'name'))
+        blob_names = set(blobs.values())
+        renamed = self.store_blobs(sorted(name for name in references if name not in blob_names), blobs)
+        if self.dry_run:
+            return self.stats
+        self.copy_derivatives(renamed)
+        tags = set()
+        self.stats['products_updated'] = self.rewrite(
+            Product, PRODUCT_IMAGE_FIELDS, renamed, tags,
+            ('slug', 'category__slug', 'category__gender', 'category__product_type'), product_tags,
+        )
+        self.stats['categories_updated'] = self.rewrite(
+            Category, ('cat_image',), renamed, tags, ('slug', 'gender', 'product_type'), category_tags,
+        )
+        self.count_references()
+        if self.stats['products_updated']:
+            bump_version(CATALOG)
+        if self.stats['categories_updated']:
+            bump_version(CATEGORIES)
+        invalidate_tags(tags)
+        if not self.keep_originals:
+            self.delete_originals(renamed)
+        return self.stats
+
+    def referenced_names(self):
+        """
+            Return the number of fields referencing each image name.
+        """
+        references = Counter()
+        for model, fields in ((Product, PRODUCT_IMAGE_FIELDS), (Category, ('cat_image',))):
+            for row in model.objects.values_list(*fields).iterator():
+                references.update(name for name in row if name)
+        return references
+
+    def store_blobs(self, names, blobs):
+        """
+            Hash the files of `names` and store their contents as blobs (unless dry_run).
+
+            Args:
+                names (list): The names of the files that are not blobs.
+                blobs (dict): The blob name of each digest, completed with the new blobs.
+
+            Returns:
+                dict: The blob name of each stored file.
+        """
+        renamed = {}
+        for name in names:
+            if not self.storage.exists(name):
+                self.missing.append(name)
+                continue
+            with self.storage.open(name) as original:
+                digest, size = content_digest(original)
+                self.stats['files'] += 1
+                if digest in blobs:
+                    self.stats['duplicate_bytes'] += size
+                else:
+                    self.stats['blobs_created'] += 1
+                if not self.dry_run:
+                    renamed[name] = self.storage.store_blob(digest, size, name, original).name
+                blobs[digest] = renamed.get(name)
+        return renamed
+
+    def copy_derivatives(self, renamed):
+        """
+            Copy the derivatives of the original files to the names of their blobs, when missing.
+        """
+        for name, blob_name in renamed.items():
+            for width in derivative_widths():
+                for image_format in DERIVATIVE_FORMATS:
+                    source, target = derivative_name(name, width, image_format), derivative_name(blob_name, width, image_format)
+                    if self.storage.exists(source) and not self.storage.exists(target):
+                        with self.storage.open(source) as derivative:
+                            self.storage.save_derived(target, derivative)
+
+    def rewrite(self, model, fields, renamed, tags, tag_columns, tags_of):
+        """
+            Replace the renamed images of the rows of a model, `batch_size` rows at a time.
+
+            Rows are read with a keyset on the primary key, so no cursor is open on the table
+            while it is updated.
+
+            Returns:
+                int: The number of rows rewritten.
+        """
+        rows = model.objects.order_by('pk').values_list('pk', *(fields + tag_columns))
+        updated, last = 0, None
+        while True:
+            chunk = list((rows if last is None else rows.filter(pk__gt=last))[:self.batch_size])
+            batch = []
+            for row in chunk:
+                names = row[1:len(fields) + 1]
+                if any(name in renamed for name in names):
+                    batch.append(model(pk=row[0], **dict((field, renamed.get(name, name)) for field, name in zip(fields, names))))
+                    tags.update(tags_of(*row[len(fields) + 1:]))
+            if batch:
+                with transaction.atomic():
+                    model.objects.bulk_update(batch, fields)
+                updated += len(batch)
+            if len(chunk) < self.batch_size:
+                return updated
+            last = chunk[-1][0]
+
+    def count_references(self):
+        """
+            Set the reference count of every blob to the number of fields referencing it.
+
+            The blobs are locked before the fields are counted, in one transaction: a save
+            committed before the lock is in the counts, and the acquire() or release() of a
+            later one waits for the new counts and applies to them.
+        """
+        with transaction.atomic():
+            blobs = list(MediaBlob.objects.select_for_update().only('pk', 'name', 'references').order_by('pk'))
+            counts = self.referenced_names()
+            changed = []
+            for blob in blobs:
+                if blob.references != counts[blob.name]:
+                    blob.references = counts[blob.name]
+                    changed.append(blob)
+            MediaBlob.objects.bulk_update(changed, ['references'], batch_size=self.batch_size)
+
+    def delete_originals(self, renamed):
+        """
+            Remove the original files moved to blobs, with their derivatives.
+        """
+        for name in renamed:
+            self.storage.delete(name)
+            self.stats['files_deleted'] += 1
+            for width in derivative_widths():
+                for image_format in DERIVATIVE_FORMATS:
+                    derivative = derivative_name(name, width, image_format)
+                    if self.storage.exists(derivative):
+                        self.storage.delete(derivative)
@@ -0,0 +1,137 @@
+from bisect import bisect_left, insort
+from heapq import merge
+
+from category.models import Category
+from .cache import LocalIndex
+from .models import Product
+
+
+# Store filters from the query string: gender=<key> and category=<key>, with their page titles.
+GENDER_FILTERS = {
+    'men': ('H', "Collection Homme"),
+    'women': ('F', "Collection Femme"),
+}
+PRODUCT_TYPE_FILTERS = {
+    'clothingMen': ('A', "Vêtements Homme"),
+    'clothingWomen': ('B', "Vêtements Femme"),
+    'clothingAccessMen': ('Y', "Accessoires Homme"),
+    'clothingAccessWomen': ('X', "Accessoires Femme"),
+}
+
+
+class FacetIndex(LocalIndex):
+    """
+        In-memory facets of the available products.
+
+        Holds the sorted ids of the available products of every category, with the gender
+        and product type of each category, so that the store filters and their counts are
+        answered without querying the database. Results of a (gender, product_type, category)
+        combination are memoized until the next change.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.categories = {}
+        self.cells = {}
+        self.products = {}
+        self.results = {}
+
+    def load(self):
+        categories = dict(
+            (pk, (gender, product_type))
+            for pk, gender, product_type in Category.objects.values_list('id', 'gender', 'product_type')
+        )
+        cells = {}
+        products = {}
+        available = Product.objects.filter(is_available=True).order_by('id').values_list('id', 'category_id')
+        for product_id, category_id in available.iterator():
+            cells.setdefault(category_id, []).append(product_id)
+            products[product_id] = category_id
+        self.categories, self.cells, self.products, self.results = categories, cells, products, {}
+
+    def product_ids(self, gender=None, product_type=None, category_id=None):
+        """
+            Return the sorted ids of the available products matching the given facets.
+        """
+        self.ensure_current()
+        key = (gender, product_type, category_id)
+        with self.lock:
+            if key not in self.results:
+                cells = [
+                    self.cells.get(pk, [])
+                    for pk, (category_gender, category_type) in self.categories.items()
+                    if (gender is None or category_gender == gender)
+                    and (product_type is None or category_type == product_type)
+                    and (category_id is None or pk == category_id)
+                ]
+                self.results[key] = cells[0] if len(cells) == 1 else list(merge(*cells))
+            return self.results[key]
+
+    def is_available(self, product_id):
+        """
+            Return whether a product is available.
+        """
+        self.ensure_current()
+        return product_id in self.products
+
+    def count(self, gender=None, product_type=None, category_id=None):
+        """
+            Return the number of available products matching the given facets.
+        """
+        return len(self.product_ids(gender, product_type, category_id))
+
+    def filter_counts(self):
+        """
+            Return the number of available products behind each store filter of the navbar.
+        """
+        counts = {'all': self.count()}
+        for key, (gender, title) in GENDER_FILTERS.items():
+            counts[key] = self.count(gender=gender)
+        for key, (product_type, title) in PRODUCT_TYPE_FILTERS.items():
+            counts[key] = self.count(product_type=product_type)
+        return counts
+
+    def _discard(self, product_id):
+        category_id = self.products.pop(product_id, None)
+        if category_id is not None:
+            cell = self.cells[category_id]
+            del cell[bisect_left(cell, product_id)]
+
+    def product_saved(self, product):
+        """
+            Move a saved product to the cell of its category, or drop it if unavailable.
+        """
+        self._discard(product.pk)
+        if product.is_available:
+            if product.category_id not in self.categories:
+                category = product.category
+                self.categories[category.pk] = (category.gender, category.product_type)
+            insort(self.cells.setdefault(product.category_id, []), product.pk)
+            self.products[product.pk] = product.category_id
+        self.results = {}
+
+    def product_deleted(self, product_id):
+        """
+            Drop a deleted product.
+        """
+        self._discard(product_id)
+        self.results = {}
+
+    def category_saved(self, category):
+        """
+            Record the gender and product type of a saved category.
+        """
+        self.categories[category.pk] = (category.gender, category.product_type)
+        self.results = {}
+
+    def category_deleted(self, category_id):
+        """
+            Drop a deleted category and its products.
+        """
+        self.categories.pop(category_id, None)
+        for product_id in self.cells.pop(category_id, []):
+            self.products.pop(product_id, None)
+        self.results = {}
+
+
+facet_index = FacetIndex()
@@ -0,0 +1,164 @@
+import csv
+import json
+import re
+from xml.sax.saxutils import escape
+
+from django.conf import settings
+from django.urls import reverse
+
+from .models import Product
+
+
+# Columns of the CSV and JSON Lines feeds, in order.
+FEED_FIELDS = ('id', 'title', 'description', 'link', 'image_link', 'price', 'availability', 'product_type')
+
+# Content types of the feed formats.
+FEED_CONTENT_TYPES = {
+    'csv': 'text/csv; charset=utf-8',
+    'jsonl': 'application/x-ndjson; charset=utf-8',
+    'xml': 'application/xml; charset=utf-8',
+}
+
+# Characters XML 1.0 does not allow, even escaped (C0 controls other than tab and newlines).
+CONTROL_CHARACTERS_RE = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+# Columns of the product and its category read for the feeds.
+PRODUCT_COLUMNS = (
+    'id', 'product_name', 'title_online', 'description', 'price', 'stock', 'is_available', 'slug', 'images',
+    'category__slug', 'category__category_name',
+)
+
+
+def iter_feed_products(chunk_size=1000, available_only=True):
+    """
+        Iterate over the products, joined to their category, one chunk at a time.
+
+        Chunks are read with a keyset on the primary key (WHERE id > last id LIMIT n) rather
+        than one cursor, so no database driver ever holds more than one chunk, even those
+        without server-side cursors (MySQL), and rows are plain dicts, not model instances.
+
+        Args:
+            chunk_size (int): The number of products read per query (default: 1000).
+            available_only (bool): Skip the products not available (default: True).
+
+        Yields:
+            dict: The values of PRODUCT_COLUMNS of a product.
+    """
+    products = Product.objects.order_by('id')
+    if available_only:
+        products = products.filter(is_available=True)
+    last = 0
+    while True:
+        chunk = list(products.filter(id__gt=last).values(*PRODUCT_COLUMNS)[:chunk_size])
+        yield from chunk
+        if len(chunk) < chunk_size:
+            return
+        last = chunk[-1]['id']
+
+
+def feed_item(row, base_url):
+    """
+        Build the feed entry of a product.
+
+        Args:
+            row (dict): The values of the product, see iter_feed_products.
+            base_url (str): The scheme and host prefixed to the links (e.g. 'https://shop.example').
+
+        Returns:
+            dict: The values of FEED_FIELDS.
+    """
+    storage = Product._meta.get_field('images').storage
+    return {
+        'id': row['id'],
+        'title': row['title_online'] or row['product_name'],
+        'description': row['description'],
+        # Same URL as Product.get_url(), without loading the category
+        'link': base_url + reverse('product_detail', args=[row['category__slug'], row['slug']]),
+        'image_link': base_url + storage.url(row['images']) if row['images'] else '',
+        'price': '%.2f %s' % (row['price'], getattr(settings, 'FEED_CURRENCY', 'EUR')),
+        'availability': 'in stock' if row['is_available'] and row['stock'] > 0 else 'out of stock',
+        'product_type': row['category__category_name'],
+    }
+
+
+class _Echo:
+    """
+        File-like object returning what is written, so that csv.writer produces lines one at a time.
+    """
+
+    def write(self, value):
+        return value
+
+
+def csv_feed(items):
+    """
+        Yield the lines of the CSV feed, header first.
+    """
+    writer = csv.writer(_Echo())
+    yield writer.writerow(FEED_FIELDS)
+    for item in items:
+        yield writer.writerow([item[field] for field in FEED_FIELDS])
+
+
+def jsonl_feed(items):
+    """
+        Yield the lines of the JSON Lines feed, one product per line.
+    """
+    for item in items:
+        yield json.dumps(item, ensure_ascii=False) + '\n'
+
+
+def xml_text(value):
+    """
+        Return a value as XML text, without the characters XML does not allow.
+    """
+    return escape(CONTROL_CHARACTERS_RE.sub('', str(value)))
+
+
+def xml_feed(items, base_url):
+    """
+        Yield the Google Shopping RSS 2.0 feed, one <item> at a time.
+    """
+    yield (
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        '<rss version="2.0" xmlns:g="http://base.google.com/ns/1.0">\n<channel>\n'
+        '<title>%s</title>\n<link>%s</link>\n<description>Product feed</description>\n'
+    ) % (xml_text(getattr(settings, 'FEED_TITLE', 'Dream Shop')), xml_text(base_url + '/'))
+    for item in items:
+        yield (
+            '<item>\n'
+            '<g:id>%(id)s</g:id>\n'
+            '<title>%(title)s</title>\n'
+            '<description>%(description)s</description>\n'
+            '<link>%(link)s</link>\n'
+            '<g:image_link>%(image_link)s</g:image_link>\n'
+            '<g:price>%(price)s</g:price>\n'
+            '<g:availability>%(availability)s</g:availability>\n'
+            '<g:product_type>%(product_type)s</g:product_type>\n'
+            '</item>\n'
+        ) % dict((field, xml_text(value)) for field, value in item.items())
+    yield '</channel>\n</rss>\n'
+
+
+def product_feed(feed_format, base_url, chunk_size=1000, available_only=True):
+    """
+        Yield the chunks of a product feed, in constant memory.
+
+        Args:
+            feed_format (str): 'csv', 'jsonl' or 'xml'.
+            base_url (str): The scheme and host prefixed to the links, without trailing slash.
+            chunk_size (int): The number of products read per query (default: 1000).
+            available_only (bool): Skip the products not available (default: True).
+
+        Raises:
+            ValueError: If the format is unknown.
+    """
+    if feed_format not in FEED_CONTENT_TYPES:
+        raise ValueError('Unknown feed format %r.' % feed_format)
+    base_url = base_url.rstrip('/')
+    items = (feed_item(row, base_url) for row in iter_feed_products(chunk_size, available_only))
+    if feed_format == 'csv':
+        return csv_feed(items)
+    if feed_format == 'jsonl':
+        return jsonl_feed(items)
+    return xml_feed(items, base_url)
@@ -0,0 +1,258 @@
+import hashlib
+import logging
+import posixpath
+import re
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from io import BytesIO
+from itertools import islice
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps
+
+from category.models import Category
+from .models import Product
+
+
+logger = logging.getLogger(__name__)
+
+# Formats of the derivatives: Pillow format and file extension.
+DERIVATIVE_FORMATS = {
+    'webp': ('WEBP', 'webp'),
+    'jpeg': ('JPEG', 'jpg'),
+}
+
+# Image fields of the products, in order.
+PRODUCT_IMAGE_FIELDS = ('images', 'second_image', 'third_image', 'fourth_image', 'fifth_image')
+
+# Names of the derivatives themselves, skipped by the backfill.
+DERIVATIVE_RE = re.compile(r'\.\d+w\.(webp|jpg)$')
+
+# Cache key of the existence of the derivatives of an image, and how long a missing one is remembered.
+READY_KEY = 'store:derivatives:%s'
+NOT_READY_TIMEOUT = 60
+
+
+def derivatives_enabled():
+    """
+        Return True if the templates reference the derivatives (settings.IMAGE_DERIVATIVES).
+    """
+    return getattr(settings, 'IMAGE_DERIVATIVES', False)
+
+
+def derivative_widths():
+    """
+        Return the widths of the derivatives, in pixels (settings.IMAGE_DERIVATIVE_WIDTHS).
+    """
+    return tuple(getattr(settings, 'IMAGE_DERIVATIVE_WIDTHS', (160, 320, 640, 960)))
+
+
+def derivative_name(name, width, image_format):
+    """
+        Return the name of a derivative, stored next to its original.
+
+        'photos/products/shirt.png' gives 'photos/products/shirt.320w.webp' for the 320px WebP.
+    """
+    root = posixpath.splitext(name)[0]
+    return '%s.%dw.%s' % (root, width, DERIVATIVE_FORMATS[image_format][1])
+
+
+def derivative_url(image, width, image_format):
+    """
+        Return the URL of a derivative of an image.
+
+        Args:
+            image: An ImageField value, or the URL of the original.
+            width (int): The width of the derivative.
+            image_format (str): 'webp' or 'jpeg'.
+
+        Returns:
+            str: The URL of the derivative, or None for a URL it cannot be derived from (query string).
+    """
+    if hasattr(image, 'storage'):
+        return image.storage.url(derivative_name(image.name, width, image_format))
+    if '?' in image:
+        return None
+    return derivative_name(image, width, image_format)
+
+
+def derivatives_ready(name, storage=None):
+    """
+        Return True if every derivative of an image exists.
+
+        The answer is cached: without expiry once the derivatives exist, for NOT_READY_TIMEOUT
+        seconds while some are missing (being generated, or failed), so that the templates
+        check the storage at most once a minute per image.
+
+        Args:
+            name (str): The name of the original in the storage.
+            storage: The storage of the original and its derivatives (default: default_storage).
+    """
+    storage = storage or default_storage
+    widths = derivative_widths()
+    key = READY_KEY % hashlib.md5(repr((name, widths)).encode('utf-8')).hexdigest()
+    ready = cache.get(key)
+    if ready is None:
+        ready = all(
+            storage.exists(derivative_name(name, width, image_format))
+            for width in widths
+            for image_format in DERIVATIVE_FORMATS
+        )
+        cache.set(key, ready, timeout=None if ready else NOT_READY_TIMEOUT)
+    return ready
+
+
+def generate_derivatives(name, force=False, storage=None):
+    """
+        Generate the missing derivatives of an image: one WebP and one JPEG per width.
+
+        An original narrower than a width is not enlarged: the derivative keeps its size, so
+        that every width exists and the srcset of the templates never points at a missing file.
+
+        Args:
+            name (str): The name of the original in the storage.
+            force (bool): Regenerate the existing derivatives (default: False).
+            storage: The storage of the original and its derivatives (default: default_storage).
+
+        Returns:
+            int: The number of derivatives written.
+    """
+    storage = storage or default_storage
+    targets = [
+        (width, image_format)
+        for width in derivative_widths()
+        for image_format in DERIVATIVE_FORMATS
+        if force or not storage.exists(derivative_name(name, width, image_format))
+    ]
+    if not targets:
+        return 0
+    with storage.open(name, 'rb') as original:
+        image = Image.open(original)
+        image.load()
+    image = ImageOps.exif_transpose(image)
+    quality = getattr(settings, 'IMAGE_DERIVATIVE_QUALITY', 80)
+    resized = {}
+    for width, image_format in targets:
+        if width not in resized:
+            if image.width > width:
+                resized[width] = image.resize((width, max(1, round(image.height * width / image.width))), Image.LANCZOS)
+            else:
+                resized[width] = image
+        variant = resized[width]
+        if image_format == 'jpeg' and variant.mode not in ('RGB', 'L'):
+            # JPEG has no transparency: flatten on white
+            background = Image.new('RGB', variant.size, (255, 255, 255))
+            rgba = variant.convert('RGBA')
+            background.paste(rgba, mask=rgba.getchannel('A'))
+            variant = background
+        elif image_format == 'webp' and variant.mode not in ('RGB', 'RGBA'):
+            variant = variant.convert('RGBA')
+        buffer = BytesIO()
+        variant.save(buffer, DERIVATIVE_FORMATS[image_format][0], quality=quality)
+        target = derivative_name(name, width, image_format)
+        if hasattr(storage, 'save_derived'):
+            # Content-addressed storage: written at its name, next to the blob
+            storage.save_derived(target, ContentFile(buffer.getvalue()))
+            continue
+        if storage.exists(target):
+            storage.delete(target)
+        storage.save(target, ContentFile(buffer.getvalue()))
+    return len(targets)
+
+
+def _generate(name, force=False):
+    try:
+        return name, generate_derivatives(name, force), None
+    except Exception as error:
+        return name, 0, '%s: %s' % (type(error).__name__, error)
+
+
+def generate_in_pool(names, processes=None, force=False, batch_size=1000):
+    """
+        Generate the derivatives of many images in a process pool.
+
+        The names are submitted `batch_size` at a time, so any number of images can be
+        processed with bounded memory. With processes=0, the images are processed in this
+        process.
+
+        Args:
+            names (iterable): The names of the originals.
+            processes (int): The number of worker processes (default: the number of CPUs).
+            force (bool): Regenerate the existing derivatives (default: False).
+            batch_size (int): The number of names submitted at a time (default: 1000).
+
+        Yields:
+            tuple: The name, the number of derivatives written and the error message (or None) of each image.
+    """
+    names = iter(names)
+    if processes == 0:
+        for name in names:
+            yield _generate(name, force)
+        return
+    with ProcessPoolExecutor(processes) as pool:
+        while True:
+            batch = list(islice(names, batch_size))
+            if not batch:
+                return
+            yield from pool.map(_generate, batch, [force] * len(batch), chunksize=max(1, len(batch) // 32))
+
+
+_executor = None
+
+
+def schedule_derivatives(names):
+    """
+        Generate the derivatives of uploaded images in the background, when they are enabled.
+
+        The images go to a process pool of settings.IMAGE_DERIVATIVE_WORKERS processes shared
+        by the requests of this process, or are processed at once when it is 0. A pool broken
+        by a dead worker is replaced.
+    """
+    global _executor
+    names = [name for name in names if name and not DERIVATIVE_RE.search(name)]
+    if not names or not derivatives_enabled():
+        return
+    workers = getattr(settings, 'IMAGE_DERIVATIVE_WORKERS', 2)
+    if not workers:
+        for name, count, error in map(_generate, names):
+            if error:
+                logger.error('Cannot generate the derivatives of %s: %s', name, error)
+        return
+    for name in names:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(workers)
+        try:
+            future = _executor.submit(_generate, name)
+        except BrokenProcessPool:
+            # A worker died: the pool accepts no more work, start a new one
+            _executor.shutdown(wait=False)
+            _executor = ProcessPoolExecutor(workers)
+            future = _executor.submit(_generate, name)
+        future.add_done_callback(_log_error)
+
+
+def _log_error(future):
+    try:
+        name, count, error = future.result()
+    except BrokenProcessPool as broken:
+        logger.error('Cannot generate derivatives: %s', broken)
+        return
+    if error:
+        logger.error('Cannot generate the derivatives of %s: %s', name, error)
+
+
+def image_names():
+    """
+        Yield the names of every original image of the catalog (products and categories), without duplicate.
+    """
+    seen = set()
+    sources = [Product.objects.values_list(*PRODUCT_IMAGE_FIELDS), Category.objects.values_list('cat_image')]
+    for rows in sources:
+        for row in rows.iterator():
+            for name in row:
+                if name and name not in seen and not DERIVATIVE_RE.search(name):
+                    seen.add(name)
+                    yield name
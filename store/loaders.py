@@ -0,0 +1,65 @@
+from django.db.models import F, FilteredRelation, Q
+
+from .models import Product, Variation
+
+
+# Image fields of Product, in display order.
+IMAGE_FIELDS = ('images', 'second_image', 'third_image', 'fourth_image', 'fifth_image')
+
+
+class ProductBundle:
+    """
+        Everything the product page shows, assembled once and cached.
+
+        Attributes:
+          product (Product): The product, with its category already loaded.
+          sizes (list): The active size variations of the product.
+          colors (list): The active color variations of the product.
+          main_image_url (str): The URL of the first image that is set, or None.
+          thumbnail_urls (list): The URLs of the other images that are set.
+    """
+
+    def __init__(self, product, sizes, colors):
+        self.product = product
+        self.sizes = sizes
+        self.colors = colors
+        urls = [getattr(product, name).url for name in IMAGE_FIELDS if getattr(product, name)]
+        self.main_image_url = urls[0] if urls else None
+        self.thumbnail_urls = urls[1:]
+
+
+def load_product_bundle(category_slug, product_slug):
+    """
+        Load a product, its category and its active variations in a single query.
+
+        The active variations are LEFT JOINed through a FilteredRelation, so the query
+        returns one row per variation (or a single row without variation).
+
+        Raises:
+          Product.DoesNotExist: If no product matches the slugs.
+    """
+    rows = list(
+        Product.objects.select_related('category')
+        .filter(category__slug=category_slug, slug=product_slug)
+        .annotate(
+            active_variation=FilteredRelation('variation', condition=Q(variation__is_active=True)),
+            variation_pk=F('active_variation__id'),
+            variation_kind=F('active_variation__variation_category'),
+            variation_label=F('active_variation__variation_value'),
+        )
+        .order_by('variation_pk')
+    )
+    if not rows:
+        raise Product.DoesNotExist('Product matching query does not exist.')
+    product = rows[0]
+    variations = {'size': [], 'color': []}
+    for row in rows:
+        if row.variation_pk is not None and row.variation_kind in variations:
+            variations[row.variation_kind].append(Variation(
+                id=row.variation_pk,
+                product=product,
+                variation_category=row.variation_kind,
+                variation_value=row.variation_label,
+                is_active=True,
+            ))
+    return ProductBundle(product, variations['size'], variations['color'])
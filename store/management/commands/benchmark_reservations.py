@@ -0,0 +1,89 @@
+import threading
+import time
+import uuid
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.db.models import Sum
+
+from category.models import Category
+from store.models import Product, StockReservation
+from store.reservations import OutOfStock, available_stock, reserve, shard_stock
+
+
+class Command(BaseCommand):
+    """
+        Reserve units of one product from several threads and check that it is never oversold.
+
+        A temporary product with `--stock` units, spread over `--shards` stock shards, is
+        created. Every thread tries `--attempts` reservations of one unit; when all the
+        threads are done, the held units must equal the initial stock (or all the attempts, if
+        fewer), the held and the left units must add up to the initial stock, and no counter
+        may be negative. The product and its holds are deleted afterwards.
+    """
+    help = 'Benchmark concurrent stock reservations of one product and check that it is never oversold.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=8, help='Number of concurrent threads.')
+        parser.add_argument('--attempts', type=int, default=100, help='Reservations tried by each thread.')
+        parser.add_argument('--stock', type=int, default=500, help='Initial stock of the product.')
+        parser.add_argument('--shards', type=int, default=0, help='Number of stock shards of the product.')
+
+    def handle(self, *args, **options):
+        threads, attempts, stock = options['threads'], options['attempts'], options['stock']
+        category = Category.objects.order_by('id').first()
+        if category is None:
+            raise CommandError('No category for the benchmark product.')
+        name = 'benchmark-%s' % uuid.uuid4().hex
+        product = Product.objects.create(
+            product_name=name, title_online=name, slug=name, price=0, stock=stock, is_available=False, category=category,
+        )
+        shard_stock(product.id, options['shards'])
+        counts = {'reserved': 0, 'refused': 0}
+        errors = []
+        lock = threading.Lock()
+        barrier = threading.Barrier(threads)
+
+        def worker(number):
+            reserved = refused = 0
+            try:
+                barrier.wait()
+                for _ in range(attempts):
+                    try:
+                        reserve(product.id, '%s-%d' % (name, number))
+                        reserved += 1
+                    except OutOfStock:
+                        refused += 1
+            except Exception as error:
+                errors.append(error)
+            finally:
+                with lock:
+                    counts['reserved'] += reserved
+                    counts['refused'] += refused
+                connections.close_all()
+
+        workers = [threading.Thread(target=worker, args=(number,)) for number in range(threads)]
+        start = time.monotonic()
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        elapsed = time.monotonic() - start
+
+        try:
+            if errors:
+                raise CommandError('%d thread(s) failed: %r' % (len(errors), errors[0]))
+            held = StockReservation.objects.filter(product=product).aggregate(units=Sum('quantity'))['units'] or 0
+            left = available_stock(product.id)
+            negative = Product.objects.filter(pk=product.pk, stock__lt=0).exists() or product.stock_shards.filter(available__lt=0).exists()
+            rate = counts['reserved'] / elapsed if elapsed else float('inf')
+            self.stdout.write('%d reservations, %d refused, by %d threads over %d shard(s) in %.2fs (%.0f reservations/s).' % (
+                counts['reserved'], counts['refused'], threads, options['shards'], elapsed, rate,
+            ))
+            self.stdout.write('Held %d units, %d left, initial stock %d.' % (held, left, stock))
+            expected = min(stock, threads * attempts)
+            if negative or held != counts['reserved'] or held != expected or held + left != stock:
+                raise CommandError('Oversold: held %d units and %d left for a stock of %d.' % (held, left, stock))
+        finally:
+            product.delete()
+        self.stdout.write(self.style.SUCCESS('The product was never oversold.'))
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from store.cache import reset_view_cache_stats, view_cache_stats
+
+
+class Command(BaseCommand):
+    """
+        Print the hit and miss counters of the cached catalog views.
+
+        The counters live in the default cache, so they are shared with the web workers
+        only when a shared cache backend (Redis, Memcached) is configured.
+    """
+    help = 'Print the hit and miss counters of the cached catalog views.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true', help='Reset the counters after printing them.')
+
+    def handle(self, *args, **options):
+        for view, counters in view_cache_stats().items():
+            total = counters['hits'] + counters['misses']
+            ratio = 100.0 * counters['hits'] / total if total else 0.0
+            self.stdout.write('%-16s hits=%-8d misses=%-8d hit ratio=%.1f%%' % (view, counters['hits'], counters['misses'], ratio))
+        if options['reset']:
+            reset_view_cache_stats()
+            self.stdout.write(self.style.SUCCESS('Counters reset.'))
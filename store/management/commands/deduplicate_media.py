@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from store.deduplication import DeduplicationError, MediaDeduplicator
+
+
+class Command(BaseCommand):
+    """
+        Move the product and category images to content-addressed blobs, one file per content.
+
+        Identical files (e.g. 'shoes.png' and 'shoes_8g4Qc58.png') end up as one blob, the
+        ImageFields are rewritten to its name and the originals are removed. Running the
+        command again only processes the files that are not blobs yet. See store.deduplication.
+    """
+    help = 'Store the product and category images once per content and rewrite their paths.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Only count the duplicates.')
+        parser.add_argument('--keep-originals', action='store_true', help='Leave the original files in place.')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Rows written per transaction.')
+
+    def handle(self, *args, **options):
+        if options['batch_size'] <= 0:
+            raise CommandError('--batch-size must be positive.')
+        try:
+            deduplicator = MediaDeduplicator(
+                batch_size=options['batch_size'], dry_run=options['dry_run'], keep_originals=options['keep_originals'],
+            )
+        except DeduplicationError as error:
+            raise CommandError(str(error))
+        stats = deduplicator.run()
+        for name in deduplicator.missing[:20]:
+            self.stderr.write('Missing file: %s' % name)
+        self.stdout.write(
+            '%(files)d files, %(blobs_created)d new blobs, %(duplicate_bytes)d bytes of duplicates.' % stats
+        )
+        if options['dry_run']:
+            return
+        self.stdout.write(self.style.SUCCESS(
+            'Rewrote %(products_updated)d products and %(categories_updated)d categories, '
+            'deleted %(files_deleted)d files.' % stats
+        ))
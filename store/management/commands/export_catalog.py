@@ -0,0 +1,33 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from store.feeds import FEED_CONTENT_TYPES, product_feed
+
+
+class Command(BaseCommand):
+    """
+        Write the product feed (CSV, JSON Lines or Google Shopping XML) in constant memory.
+
+        The products are read one chunk at a time and every line is written as soon as it is
+        built, see store.feeds.
+    """
+    help = 'Export the product feed as CSV, JSON Lines or Google Shopping XML.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=sorted(FEED_CONTENT_TYPES), default='csv', help='Format of the feed.')
+        parser.add_argument('--output', help='Path of the feed (default: standard output).')
+        parser.add_argument('--base-url', help='Scheme and host of the links (default: settings.FEED_BASE_URL).')
+        parser.add_argument('--chunk-size', type=int, default=1000, help='Products read per query.')
+        parser.add_argument('--all', action='store_true', help='Include the products not available.')
+
+    def handle(self, *args, **options):
+        base_url = options['base_url'] or getattr(settings, 'FEED_BASE_URL', 'http://localhost:8000')
+        chunks = product_feed(options['format'], base_url, options['chunk_size'], not options['all'])
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8', newline='') as output:
+                for chunk in chunks:
+                    output.write(chunk)
+            self.stderr.write(self.style.SUCCESS('Feed written to %s.' % options['output']))
+        else:
+            for chunk in chunks:
+                self.stdout.write(chunk, ending='')
@@ -0,0 +1,41 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from store.images import generate_in_pool, image_names
+
+
+class Command(BaseCommand):
+    """
+        Generate the missing derivatives of every product and category image in a process pool.
+
+        Images whose derivatives all exist are skipped, so the command can be interrupted and
+        run again. See store.images.
+    """
+    help = 'Generate the resized WebP and JPEG derivatives of the product and category images.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, help='Worker processes (default: the number of CPUs, 0: none).')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Images submitted to the pool at a time.')
+        parser.add_argument('--force', action='store_true', help='Regenerate the existing derivatives.')
+
+    def handle(self, *args, **options):
+        if options['batch_size'] <= 0:
+            raise CommandError('--batch-size must be positive.')
+        if options['processes'] is not None and options['processes'] < 0:
+            raise CommandError('--processes cannot be negative.')
+        start = time.monotonic()
+        images = derivatives = errors = 0
+        results = generate_in_pool(image_names(), options['processes'], options['force'], options['batch_size'])
+        for name, count, error in results:
+            images += 1
+            derivatives += count
+            if error:
+                errors += 1
+                self.stderr.write('%s: %s' % (name, error))
+            elif options['verbosity'] >= 2 and images % 100 == 0:
+                self.stdout.write('%d images processed...' % images)
+        elapsed = time.monotonic() - start
+        self.stdout.write(self.style.SUCCESS('Processed %d images in %.2fs (%.0f images/s): %d derivatives written, %d errors.' % (
+            images, elapsed, images / elapsed if elapsed else 0, derivatives, errors,
+        )))
@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from store.catalog_import import CatalogImporter, read_rows
+
+
+class Command(BaseCommand):
+    """
+        Import a CSV or JSON Lines catalog feed of any size with bounded memory.
+
+        Every row is one product: product_name and category are required; slug, title_online,
+        description, price, stock, images, is_available, category_slug, category_online,
+        gender, product_type, sizes and colors are optional (CSV lists separated by '|').
+        See store.catalog_import.
+    """
+    help = 'Create and update categories, products and variations from a CSV or JSON Lines feed.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Path of the feed.')
+        parser.add_argument('--format', choices=['csv', 'jsonl'], help='Format of the feed (default: from the extension).')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Rows written per transaction.')
+
+    def handle(self, *args, **options):
+        if options['batch_size'] <= 0:
+            raise CommandError('--batch-size must be positive.')
+        try:
+            rows = read_rows(options['path'], options['format'])
+            importer = CatalogImporter(batch_size=options['batch_size'])
+            progress = None
+            if options['verbosity'] >= 2:
+                progress = lambda stats: self.stdout.write('%d rows imported...' % stats['rows'])
+            stats = importer.run(rows, progress)
+        except OSError as error:
+            raise CommandError('Cannot read %s: %s' % (options['path'], error))
+        for number, message in importer.errors[:20]:
+            self.stderr.write('Line %d: %s' % (number, message))
+        self.stdout.write(
+            'Categories: %(categories_created)d created, %(categories_updated)d updated. '
+            'Products: %(products_created)d created, %(products_updated)d updated, %(products_unchanged)d unchanged. '
+            'Variations: %(variations_created)d created, %(variations_updated)d updated.' % stats
+        )
+        self.stdout.write(self.style.SUCCESS('Imported %d rows in %.2fs (%.0f rows/s), %d rejected.' % (
+            stats['rows'], stats['elapsed'], stats['rate'], len(importer.errors),
+        )))
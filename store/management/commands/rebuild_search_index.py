@@ -0,0 +1,24 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from store.search import get_backend
+
+
+class Command(BaseCommand):
+    """
+        Rebuild the product search index from the Product and Category tables.
+    """
+    help = 'Rebuild the product full-text search index in bulk.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Number of documents written per INSERT.')
+
+    def handle(self, *args, **options):
+        backend = get_backend()
+        start = time.monotonic()
+        count = backend.rebuild(batch_size=options['batch_size'])
+        elapsed = time.monotonic() - start
+        self.stdout.write(self.style.SUCCESS(
+            'Indexed %d products with %s in %.2fs.' % (count, type(backend).__name__, elapsed)
+        ))
@@ -0,0 +1,27 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from store.reservations import sweep_expired
+
+
+class Command(BaseCommand):
+    """
+        Return the units of the expired stock reservations to the stock.
+
+        Run it from cron, or as a background process with --interval. Several sweepers can
+        run at once: each one skips the holds locked by the others.
+    """
+    help = 'Return the units of the expired stock reservations to the stock.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Holds expired per transaction.')
+        parser.add_argument('--interval', type=float, default=0, help='Sweep again every N seconds (default: sweep once).')
+
+    def handle(self, *args, **options):
+        while True:
+            expired = sweep_expired(batch_size=options['batch_size'])
+            self.stdout.write('%d expired reservation(s) released.' % expired)
+            if not options['interval']:
+                return
+            time.sleep(options['interval'])
@@ -0,0 +1,53 @@
+# Generated by Django 4.2.30 on 2026-10-18 07:10
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def create_search_index(apps, schema_editor):
+    from store.search import create_index_structures
+    create_index_structures(schema_editor)
+
+
+def drop_search_index(apps, schema_editor):
+    from store.search import drop_index_structures
+    drop_index_structures(schema_editor)
+
+
+def index_existing_products(apps, schema_editor):
+    Product = apps.get_model('store', 'Product')
+    ProductSearchDocument = apps.get_model('store', 'ProductSearchDocument')
+    db_alias = schema_editor.connection.alias
+    products = Product.objects.using(db_alias).select_related('category').order_by('pk')
+    ProductSearchDocument.objects.using(db_alias).bulk_create([
+        ProductSearchDocument(
+            product_id=product.pk,
+            product_name=product.product_name,
+            title_online=product.title_online,
+            description=product.description,
+            category_name=product.category.category_name,
+        )
+        for product in products.iterator(chunk_size=1000)
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductSearchDocument',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='search_document', serialize=False, to='store.product')),
+                ('product_name', models.CharField(max_length=200)),
+                ('title_online', models.CharField(blank=True, max_length=200)),
+                ('description', models.TextField(blank=True)),
+                ('category_name', models.CharField(blank=True, max_length=50)),
+            ],
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+        migrations.RunPython(index_existing_products, migrations.RunPython.noop),
+    ]
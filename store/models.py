@@ -117,3 +117,111 @@ class Variation(models.Model):
       			Returns a string representation of the variation.
     		"""
 		return self.variation_value
+
+
+
+class ProductSearchDocument(models.Model):
+	"""
+	    Denormalized copy of the searchable text of a product.
+
+	    The active search backend (see store.search) builds its full-text index on this table:
+	    a FULLTEXT index on MySQL, an external-content FTS5 table on SQLite.
+
+	    Attributes:
+	      product (OneToOneField): The indexed product, also used as primary key (on_delete: models.CASCADE).
+	      product_name (CharField): Copy of Product.product_name.
+	      title_online (CharField): Copy of Product.title_online.
+	      description (TextField): Copy of Product.description.
+	      category_name (CharField): Copy of the name of the product's category.
+  	"""
+	product = models.OneToOneField(Product, on_delete=models.CASCADE, primary_key=True, related_name='search_document')
+	product_name = models.CharField(max_length=200)
+	title_online = models.CharField(max_length=200, blank=True)
+	description = models.TextField(blank=True)
+	category_name = models.CharField(max_length=50, blank=True)
+
+	def __str__(self):
+		"""
+      			Returns a string representation of the search document.
+    		"""
+		return self.product_name
+
+
+
+class StockShard(models.Model):
+	"""
+	    Part of the available stock of a hot product, moved out of Product.stock.
+
+	    Reservations of a product decrement Product.stock or one of its shards with a
+	    conditional UPDATE; spreading the stock of a hot product over several rows spreads
+	    the row locks of concurrent reservations (see store.reservations).
+
+	    Attributes:
+	      product (ForeignKey): The product (on_delete: models.CASCADE).
+	      index (PositiveSmallIntegerField): The number of the shard, unique per product.
+	      available (PositiveIntegerField): The units of the shard that can be reserved.
+  	"""
+	product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='stock_shards')
+	index = models.PositiveSmallIntegerField()
+	available = models.PositiveIntegerField(default=0)
+
+	class Meta:
+		constraints = [
+			models.UniqueConstraint(fields=['product', 'index'], name='unique_stock_shard'),
+		]
+
+	def __str__(self):
+		"""
+      			Returns a string representation of the shard.
+    		"""
+		return '%s #%d' % (self.product, self.index)
+
+
+
+class StockReservation(models.Model):
+	"""
+	    Units of a product held for a cart until they expire.
+
+	    Attributes:
+	      product (ForeignKey): The reserved product (on_delete: models.CASCADE).
+	      shard (ForeignKey): The shard the units were taken from, or None for Product.stock (on_delete: models.CASCADE).
+	      cart_id (CharField): The ID of the cart holding the units (the session key).
+	      quantity (PositiveIntegerField): The number of units held.
+	      expires_at (DateTimeField): When the units return to the stock.
+  	"""
+	product = models.ForeignKey(Product, on_delete=models.CASCADE)
+	shard = models.ForeignKey(StockShard, on_delete=models.CASCADE, null=True, blank=True)
+	cart_id = models.CharField(max_length=250, db_index=True)
+	quantity = models.PositiveIntegerField()
+	expires_at = models.DateTimeField(db_index=True)
+
+	def __str__(self):
+		"""
+      			Returns a string representation of the reservation.
+    		"""
+		return '%d x %s' % (self.quantity, self.product)
+
+
+
+class MediaBlob(models.Model):
+	"""
+	    A media file stored once under the hash of its content (see store.storage).
+
+	    Attributes:
+	      digest (CharField): The SHA-256 of the content, unique.
+	      name (CharField): The name of the file in the storage.
+	      size (PositiveBigIntegerField): The size of the file, in bytes.
+	      references (PositiveIntegerField): The number of image fields referencing the blob; the file is removed at 0.
+	      created_at (DateTimeField): When the content was first stored.
+  	"""
+	digest = models.CharField(max_length=64, unique=True)
+	name = models.CharField(max_length=255, unique=True)
+	size = models.PositiveBigIntegerField()
+	references = models.PositiveIntegerField(default=0)
+	created_at = models.DateTimeField(auto_now_add=True)
+
+	def __str__(self):
+		"""
+      			Returns a string representation of the blob.
+    		"""
+		return self.name
@@ -0,0 +1,232 @@
+import base64
+from bisect import bisect_right
+import json
+import math
+
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+
+
+# Number of page links shown on each side of the current page.
+PAGE_WINDOW = 2
+
+
+def encode_cursor(values, number):
+    """
+        Encode the ids before a page and the page number into a URL-safe token.
+    """
+    payload = json.dumps({'k': values, 'n': number}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def _positive_int(value):
+    return isinstance(value, int) and not isinstance(value, bool) and value > 0
+
+
+def decode_cursor(token):
+    """
+        Decode a token built by encode_cursor.
+
+        The ids must be a non-empty list of positive integers and the page number an integer
+        of at least 2 (the first page has no cursor).
+
+        Returns:
+            tuple: The ids and the page number, (None, 1) for a missing token, or (None, None)
+            for an invalid one.
+    """
+    if not token:
+        return None, 1
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        values, number = payload['k'], payload['n']
+    except (ValueError, TypeError, KeyError, OverflowError):
+        return None, None
+    if not isinstance(values, list) or not values or not all(_positive_int(value) for value in values):
+        return None, None
+    if not _positive_int(number) or number < 2:
+        return None, None
+    return values, number
+
+
+def decode_id_cursor(token):
+    """
+        Decode the cursor of an IdListPaginator page.
+
+        Returns:
+            tuple: The last id before the page and the page number, or None for a missing or
+            invalid token (it must hold a single id).
+    """
+    values, number = decode_cursor(token)
+    if values is None or len(values) != 1:
+        return None
+    return values[0], number
+
+
+class KeysetPage:
+    """
+        A page of an IdListPaginator.
+
+        Attributes:
+          object_list (list): The rows of the page.
+          number (int): The page number, carried by the cursor.
+          per_page (int): The maximum number of rows of a page.
+          next_cursor (str): The cursor of the next page, or None.
+          previous_cursor (str): The cursor of the previous page (None on the first page).
+          window (list): (number, cursor) pairs of the pages around this one, this one included.
+    """
+    cursor_param = 'cursor'
+
+    def __init__(self, object_list, number, window, per_page):
+        self.object_list = object_list
+        self.number = number
+        self.per_page = per_page
+        self.window = window
+        cursors = dict(window)
+        self.previous_cursor = cursors.get(number - 1)
+        self.next_cursor = cursors.get(number + 1)
+
+    def has_next(self):
+        return (self.number + 1) in dict(self.window)
+
+    def has_previous(self):
+        return self.number > 1
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+
+class IdListPaginator:
+    """
+        Cursor based paginator for an in-memory sorted list of ids.
+
+        A cursor holds the last id before its page and the page number; the page is located
+        with a binary search, whatever its depth, and its number is derived from its position,
+        so that pages reached with the same id are the same whatever the number of the token.
+        The pages hold ids; the caller loads the matching rows.
+    """
+
+    def __init__(self, ids, per_page, window=PAGE_WINDOW):
+        self.ids = ids
+        self.per_page = per_page
+        self.window = window
+
+    @property
+    def count(self):
+        return len(self.ids)
+
+    def page(self, cursor=None):
+        """
+            Return the page located by `cursor` (the first page when it is missing or invalid).
+        """
+        anchor = decode_id_cursor(cursor)
+        start = bisect_right(self.ids, anchor[0]) if anchor is not None else 0
+        number = -(-start // self.per_page) + 1
+        window = [(number, encode_cursor([self.ids[start - 1]], number) if number > 1 else None)]
+        for offset in range(1, self.window + 1):
+            position = start + offset * self.per_page
+            if position >= len(self.ids):
+                break
+            window.append((number + offset, encode_cursor([self.ids[position - 1]], number + offset)))
+        for offset in range(1, self.window + 1):
+            position = start - offset * self.per_page
+            if number - offset < 1 or position + self.per_page <= 0:
+                break
+            if number - offset == 1 or position <= 0:
+                window.insert(0, (1, None))
+                break
+            window.insert(0, (number - offset, encode_cursor([self.ids[position - 1]], number - offset)))
+        return KeysetPage(self.ids[start:start + self.per_page], number, window, self.per_page)
+
+
+# Table statistics giving the estimated number of rows of a table, per database vendor.
+ESTIMATE_QUERIES = {
+    'postgresql': 'SELECT reltuples::bigint FROM pg_class WHERE oid = to_regclass(%s)',
+    'mysql': 'SELECT table_rows FROM information_schema.tables WHERE table_schema = DATABASE() AND table_name = %s',
+}
+
+
+def estimated_count(model, using='default'):
+    """
+        Return the number of rows of the table of a model from the table statistics, without scanning it.
+
+        Returns:
+            int: The estimated number of rows, or None when the database keeps no estimate (SQLite).
+    """
+    connection = connections[using]
+    sql = ESTIMATE_QUERIES.get(connection.vendor)
+    if sql is None:
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [model._meta.db_table])
+        row = cursor.fetchone()
+    return row[0] if row and row[0] is not None and row[0] >= 0 else None
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+        Paginator counting the unfiltered rows of a large table from the table statistics.
+
+        A COUNT(*) of a whole InnoDB table scans an index of every row; when the queryset has
+        no WHERE clause and the statistics estimate more than `estimate_threshold` rows, the
+        estimate is used instead. Filtered querysets and small tables are counted exactly.
+    """
+    estimate_threshold = 10000
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if getattr(queryset, 'query', None) is not None and not queryset.query.where:
+            estimate = estimated_count(queryset.model, queryset.db)
+            if estimate is not None and estimate > self.estimate_threshold:
+                return estimate
+        return super().count
+
+
+def page_window(number, num_pages, window=PAGE_WINDOW):
+    """
+        Return the page numbers shown around `number` in a numbered page strip.
+    """
+    return range(max(1, number - window), min(num_pages, number + window) + 1)
+
+
+def pagination_links(request, page, count=None):
+    """
+        Build the navigation links of a page for the includes/pagination.html template.
+
+        Works for a KeysetPage (cursor links) and for a django.core.paginator.Page (page numbers),
+        keeping the other parameters of the query string.
+
+        Returns:
+          dict: previous_url, next_url, links (list of (number, url) pairs), number and num_pages.
+    """
+    def url(param, value):
+        query = request.GET.copy()
+        query.pop('page', None)
+        query.pop(KeysetPage.cursor_param, None)
+        if value is not None:
+            query[param] = value
+        return '?' + query.urlencode()
+
+    if isinstance(page, KeysetPage):
+        links = [(number, url(KeysetPage.cursor_param, cursor)) for number, cursor in page.window]
+        num_pages = max(1, math.ceil(count / page.per_page)) if count is not None else None
+    else:
+        links = [(number, url('page', number)) for number in page_window(page.number, page.paginator.num_pages)]
+        num_pages = page.paginator.num_pages
+    targets = dict(links)
+    return {
+        'has_other_pages': page.has_other_pages(),
+        'previous_url': targets.get(page.number - 1),
+        'next_url': targets.get(page.number + 1),
+        'links': links,
+        'number': page.number,
+        'num_pages': num_pages,
+    }
@@ -0,0 +1,181 @@
+import datetime
+import random
+from collections import Counter
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Sum
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import Product, StockReservation, StockShard
+
+
+class OutOfStock(Exception):
+    """
+        Raised when a product has not enough units left to reserve.
+    """
+
+
+def reservations_enabled():
+    """
+        Return True if adding to the cart reserves stock (settings.STOCK_RESERVATIONS).
+    """
+    return getattr(settings, 'STOCK_RESERVATIONS', False)
+
+
+def _expiry(ttl=None):
+    if ttl is None:
+        ttl = getattr(settings, 'STOCK_RESERVATION_TTL', 15 * 60)
+    return timezone.now() + datetime.timedelta(seconds=ttl)
+
+
+def _return_units(product_id, shard_id, units):
+    if shard_id is None:
+        Product.objects.filter(pk=product_id).update(stock=F('stock') + units)
+    else:
+        StockShard.objects.filter(pk=shard_id).update(available=F('available') + units)
+
+
+def reserve(product_id, cart_id, quantity=1, ttl=None):
+    """
+        Hold units of a product for a cart.
+
+        The units are taken with a conditional UPDATE (available >= quantity) from one of the
+        stock shards of the product, tried in random order so that concurrent reservations
+        lock different rows, then from Product.stock. No row is read and locked beforehand,
+        so reservations of a hot product do not queue behind each other. The other holds of
+        the product for the cart are extended to the same expiry; the holds of other products
+        keep theirs.
+
+        Args:
+            product_id (int): The ID of the product.
+            cart_id (str): The ID of the cart (the session key).
+            quantity (int): The number of units to hold (default: 1).
+            ttl (int): Seconds before the units return to the stock (default: settings.STOCK_RESERVATION_TTL).
+
+        Returns:
+            StockReservation: The new hold.
+
+        Raises:
+            OutOfStock: If neither a shard nor the product has `quantity` units left.
+    """
+    expires_at = _expiry(ttl)
+    shard_ids = list(
+        StockShard.objects.filter(product_id=product_id, available__gte=quantity).values_list('pk', flat=True)
+    )
+    random.shuffle(shard_ids)
+    with transaction.atomic():
+        for shard_id in shard_ids + [None]:
+            if shard_id is None:
+                taken = Product.objects.filter(pk=product_id, stock__gte=quantity).update(stock=F('stock') - quantity)
+            else:
+                taken = StockShard.objects.filter(pk=shard_id, available__gte=quantity).update(available=F('available') - quantity)
+            if taken:
+                StockReservation.objects.filter(cart_id=cart_id, product_id=product_id).update(expires_at=expires_at)
+                return StockReservation.objects.create(
+                    product_id=product_id, shard_id=shard_id, cart_id=cart_id, quantity=quantity, expires_at=expires_at,
+                )
+    raise OutOfStock('Not enough stock left for product %d.' % product_id)
+
+
+def release(cart_id, product_id, quantity):
+    """
+        Return up to `quantity` held units of a product to the stock, newest holds first.
+
+        Returns:
+            int: The number of units returned.
+    """
+    remaining = quantity
+    with transaction.atomic():
+        holds = StockReservation.objects.select_for_update().filter(cart_id=cart_id, product_id=product_id).order_by('-pk')
+        for hold in holds:
+            if remaining <= 0:
+                break
+            units = min(hold.quantity, remaining)
+            _return_units(hold.product_id, hold.shard_id, units)
+            if units == hold.quantity:
+                hold.delete()
+            else:
+                StockReservation.objects.filter(pk=hold.pk).update(quantity=F('quantity') - units)
+            remaining -= units
+    return quantity - remaining
+
+
+def move_holds(old_cart_id, new_cart_id):
+    """
+        Move the holds of a cart to a new cart ID, e.g. the session key rotated on login.
+
+        Returns:
+            int: The number of holds moved.
+    """
+    return StockReservation.objects.filter(cart_id=old_cart_id).update(cart_id=new_cart_id)
+
+
+def sweep_expired(batch_size=500, now=None):
+    """
+        Return the units of the expired holds to the stock, in batches.
+
+        Each batch is one transaction: the expired holds are locked (skipping the ones locked
+        by a concurrent sweeper or release), their units are added back per product and
+        shard with one UPDATE each, and the holds are deleted.
+
+        Returns:
+            int: The number of holds expired.
+    """
+    now = now or timezone.now()
+    expired = 0
+    while True:
+        with transaction.atomic():
+            holds = list(
+                StockReservation.objects.select_for_update(skip_locked=True)
+                .filter(expires_at__lte=now)
+                .order_by('pk')
+                .values_list('pk', 'product_id', 'shard_id', 'quantity')[:batch_size]
+            )
+            if not holds:
+                return expired
+            units = Counter()
+            for pk, product_id, shard_id, quantity in holds:
+                units[(product_id, shard_id)] += quantity
+            for (product_id, shard_id), quantity in units.items():
+                _return_units(product_id, shard_id, quantity)
+            StockReservation.objects.filter(pk__in=[hold[0] for hold in holds]).delete()
+        expired += len(holds)
+
+
+def shard_stock(product_id, shards):
+    """
+        Spread the available stock of a product over `shards` stock shards.
+
+        With 0 shards, all the stock goes back to Product.stock. Shards are never deleted, as
+        holds may still point at them; the unused ones are left empty.
+
+        Returns:
+            int: The total available stock of the product.
+    """
+    with transaction.atomic():
+        product = Product.objects.select_for_update().only('stock').get(pk=product_id)
+        existing = dict((shard.index, shard) for shard in StockShard.objects.select_for_update().filter(product_id=product_id))
+        total = max(product.stock, 0) + sum(shard.available for shard in existing.values())
+        per_shard, extra = divmod(total, shards) if shards else (0, 0)
+        for index in range(max(shards, len(existing))):
+            available = per_shard + (1 if index < extra else 0) if index < shards else 0
+            if index in existing:
+                StockShard.objects.filter(pk=existing[index].pk).update(available=available)
+            else:
+                StockShard.objects.create(product_id=product_id, index=index, available=available)
+        Product.objects.filter(pk=product_id).update(stock=0 if shards else total)
+    return total
+
+
+def available_stock(product_id):
+    """
+        Return the units of a product that can still be reserved (Product.stock plus its shards).
+    """
+    return (
+        Product.objects.filter(pk=product_id)
+        .annotate(shards=Coalesce(Sum('stock_shards__available'), 0))
+        .values_list(F('stock') + F('shards'), flat=True)
+        .first()
+    ) or 0
@@ -0,0 +1,266 @@
+import re
+
+from django.conf import settings
+from django.db import connection, connections, transaction
+from django.db.models import Q
+from django.utils.module_loading import import_string
+
+from .models import Product, ProductSearchDocument
+
+
+# Name of the FTS5 table (SQLite) and of the FULLTEXT index (MySQL) built on ProductSearchDocument.
+FTS_TABLE = 'store_productsearchdocument_fts'
+FULLTEXT_INDEX = 'store_productsearch_fulltext'
+
+# Columns of ProductSearchDocument that are indexed, in index order.
+SEARCH_COLUMNS = ('product_name', 'title_online', 'description', 'category_name')
+
+# Backend used when STORE_SEARCH_BACKEND is not set, by database vendor.
+DEFAULT_BACKENDS = {
+    'mysql': 'store.search.MySQLFullTextBackend',
+    'sqlite': 'store.search.SQLiteFTSBackend',
+}
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def tokenize(keyword):
+    """
+        Split a search keyword into the words sent to the full-text engine.
+    """
+    return TOKEN_RE.findall(keyword or '')
+
+
+def build_document(product):
+    """
+        Build the (unsaved) search document of a product.
+    """
+    return ProductSearchDocument(
+        product_id=product.pk,
+        product_name=product.product_name,
+        title_online=product.title_online,
+        description=product.description,
+        category_name=product.category.category_name,
+    )
+
+
+class BaseSearchBackend:
+    """
+        Base class of the product search backends.
+
+        Every backend stores its documents in ProductSearchDocument; subclasses only
+        implement `search`, and optionally `optimize` to compact their index after a rebuild.
+    """
+    batch_size = 1000
+
+    def __init__(self, using='default'):
+        self.using = using
+
+    @property
+    def max_results(self):
+        return getattr(settings, 'STORE_SEARCH_MAX_RESULTS', 500)
+
+    def search(self, keyword):
+        """
+            Return the ids of the products matching `keyword`, most relevant first.
+        """
+        raise NotImplementedError
+
+    def index(self, products):
+        """
+            Create or refresh the search documents of the given products.
+        """
+        documents = [build_document(product) for product in products]
+        if not documents:
+            return
+        features = connections[self.using].features
+        options = {
+            'update_conflicts': True,
+            'update_fields': SEARCH_COLUMNS,
+        }
+        if features.supports_update_conflicts_with_target:
+            options['unique_fields'] = ('product',)
+        ProductSearchDocument.objects.using(self.using).bulk_create(documents, **options)
+
+    def remove(self, product_ids):
+        """
+            Remove the search documents of the given product ids.
+        """
+        ProductSearchDocument.objects.using(self.using).filter(product_id__in=product_ids).delete()
+
+    def update_category(self, category):
+        """
+            Propagate a category rename to the documents of its products.
+        """
+        ProductSearchDocument.objects.using(self.using).filter(product__category=category).update(
+            category_name=category.category_name,
+        )
+
+    def rebuild(self, batch_size=None):
+        """
+            Rebuild every search document from the Product table.
+
+            Returns:
+                int: The number of indexed products.
+        """
+        batch_size = batch_size or self.batch_size
+        products = Product.objects.using(self.using).select_related('category').order_by('pk')
+        count = 0
+        with transaction.atomic(using=self.using):
+            ProductSearchDocument.objects.using(self.using).all().delete()
+            batch = []
+            for product in products.iterator(chunk_size=batch_size):
+                batch.append(build_document(product))
+                if len(batch) >= batch_size:
+                    ProductSearchDocument.objects.using(self.using).bulk_create(batch)
+                    count += len(batch)
+                    batch = []
+            if batch:
+                ProductSearchDocument.objects.using(self.using).bulk_create(batch)
+                count += len(batch)
+        self.optimize()
+        return count
+
+    def optimize(self):
+        """
+            Hook called once a bulk rebuild is done.
+        """
+
+
+class DatabaseSearchBackend(BaseSearchBackend):
+    """
+        Portable fallback using `icontains` on the search documents.
+
+        Only meant for databases without a full-text backend; results are ordered by creation date.
+    """
+
+    def search(self, keyword):
+        words = tokenize(keyword)
+        if not words:
+            return []
+        documents = ProductSearchDocument.objects.using(self.using)
+        for word in words:
+            condition = Q()
+            for column in SEARCH_COLUMNS:
+                condition |= Q(**{'%s__icontains' % column: word})
+            documents = documents.filter(condition)
+        documents = documents.order_by('-product__created_date')
+        return list(documents.values_list('product_id', flat=True)[:self.max_results])
+
+
+class SQLiteFTSBackend(BaseSearchBackend):
+    """
+        SQLite backend using an external-content FTS5 table kept in sync by triggers.
+
+        Each word of the keyword is matched as a prefix and results are ranked with bm25,
+        weighting the product name above the online title, the category and the description.
+    """
+    weights = (10.0, 5.0, 1.0, 2.0)
+
+    def search(self, keyword):
+        words = tokenize(keyword)
+        if not words:
+            return []
+        expression = ' '.join('"%s"*' % word for word in words)
+        weights = ', '.join(str(weight) for weight in self.weights)
+        sql = (
+            'SELECT rowid FROM {table} WHERE {table} MATCH %s '
+            'ORDER BY bm25({table}, {weights}) LIMIT %s'
+        ).format(table=FTS_TABLE, weights=weights)
+        with connections[self.using].cursor() as cursor:
+            cursor.execute(sql, [expression, self.max_results])
+            return [row[0] for row in cursor.fetchall()]
+
+    def optimize(self):
+        with connections[self.using].cursor() as cursor:
+            cursor.execute("INSERT INTO {table}({table}) VALUES ('optimize')".format(table=FTS_TABLE))
+
+
+class MySQLFullTextBackend(BaseSearchBackend):
+    """
+        MySQL backend using an InnoDB FULLTEXT index in boolean mode.
+
+        Every word is required and matched as a prefix; results are ordered by MATCH relevance.
+    """
+
+    def search(self, keyword):
+        words = tokenize(keyword)
+        if not words:
+            return []
+        expression = ' '.join('+%s*' % word for word in words)
+        match = 'MATCH ({columns}) AGAINST (%s IN BOOLEAN MODE)'.format(columns=', '.join(SEARCH_COLUMNS))
+        sql = (
+            'SELECT product_id FROM {table} WHERE {match} ORDER BY {match} DESC LIMIT %s'
+        ).format(table=ProductSearchDocument._meta.db_table, match=match)
+        with connections[self.using].cursor() as cursor:
+            cursor.execute(sql, [expression, expression, self.max_results])
+            return [row[0] for row in cursor.fetchall()]
+
+    def optimize(self):
+        with connections[self.using].cursor() as cursor:
+            cursor.execute('OPTIMIZE TABLE {table}'.format(table=ProductSearchDocument._meta.db_table))
+
+
+def get_backend():
+    """
+        Return the configured search backend.
+
+        Uses the dotted path in settings.STORE_SEARCH_BACKEND, or the backend matching
+        the database vendor, falling back to DatabaseSearchBackend.
+    """
+    path = getattr(settings, 'STORE_SEARCH_BACKEND', None)
+    if not path:
+        path = DEFAULT_BACKENDS.get(connection.vendor, 'store.search.DatabaseSearchBackend')
+    return import_string(path)()
+
+
+def create_index_structures(schema_editor):
+    """
+        Create the vendor specific full-text structures on top of ProductSearchDocument.
+    """
+    table = ProductSearchDocument._meta.db_table
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        columns = ', '.join(SEARCH_COLUMNS)
+        new_values = ', '.join('new.%s' % column for column in SEARCH_COLUMNS)
+        old_values = ', '.join('old.%s' % column for column in SEARCH_COLUMNS)
+        schema_editor.execute(
+            "CREATE VIRTUAL TABLE {fts} USING fts5({columns}, content='{table}', "
+            "content_rowid='product_id', tokenize='unicode61 remove_diacritics 2')".format(
+                fts=FTS_TABLE, columns=columns, table=table)
+        )
+        schema_editor.execute(
+            'CREATE TRIGGER {fts}_ai AFTER INSERT ON {table} BEGIN '
+            'INSERT INTO {fts}(rowid, {columns}) VALUES (new.product_id, {new}); END'.format(
+                fts=FTS_TABLE, table=table, columns=columns, new=new_values)
+        )
+        schema_editor.execute(
+            'CREATE TRIGGER {fts}_ad AFTER DELETE ON {table} BEGIN '
+            "INSERT INTO {fts}({fts}, rowid, {columns}) VALUES ('delete', old.product_id, {old}); END".format(
+                fts=FTS_TABLE, table=table, columns=columns, old=old_values)
+        )
+        schema_editor.execute(
+            'CREATE TRIGGER {fts}_au AFTER UPDATE ON {table} BEGIN '
+            "INSERT INTO {fts}({fts}, rowid, {columns}) VALUES ('delete', old.product_id, {old}); "
+            'INSERT INTO {fts}(rowid, {columns}) VALUES (new.product_id, {new}); END'.format(
+                fts=FTS_TABLE, table=table, columns=columns, old=old_values, new=new_values)
+        )
+    elif vendor == 'mysql':
+        schema_editor.execute(
+            'ALTER TABLE {table} ADD FULLTEXT INDEX {index} ({columns})'.format(
+                table=table, index=FULLTEXT_INDEX, columns=', '.join(SEARCH_COLUMNS))
+        )
+
+
+def drop_index_structures(schema_editor):
+    """
+        Drop the structures created by create_index_structures.
+    """
+    table = ProductSearchDocument._meta.db_table
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        for suffix in ('ai', 'ad', 'au'):
+            schema_editor.execute('DROP TRIGGER IF EXISTS {fts}_{suffix}'.format(fts=FTS_TABLE, suffix=suffix))
+        schema_editor.execute('DROP TABLE IF EXISTS {fts}'.format(fts=FTS_TABLE))
+    elif vendor == 'mysql':
+        schema_editor.execute('ALTER TABLE {table} DROP INDEX {index}'.format(table=table, index=FULLTEXT_INDEX))
@@ -0,0 +1,236 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from category.models import Category
+from .cache import CATALOG, CATEGORIES, bump_version, category_tags, invalidate_tags, product_tags
+from .autocomplete import autocomplete_index
+from .facets import facet_index
+from .images import PRODUCT_IMAGE_FIELDS, schedule_derivatives
+from .models import Product, Variation
+from .search import get_backend
+from .storage import ContentAddressedStorage
+
+
+# Image fields of the models, whose blobs count the rows referencing them.
+IMAGE_FIELDS = {Product: PRODUCT_IMAGE_FIELDS, Category: ('cat_image',)}
+
+
+@receiver(post_save, sender=Product)
+def index_product(sender, instance, raw=False, **kwargs):
+    """
+        Refresh the search document of a saved product.
+
+        Deleted products lose their document through the OneToOne cascade.
+    """
+    if raw:
+        return
+    get_backend().index([instance])
+
+
+@receiver(post_save, sender=Category)
+def reindex_category_products(sender, instance, created=False, raw=False, **kwargs):
+    """
+        Propagate the category name to the search documents of its products.
+    """
+    if raw or created:
+        return
+    get_backend().update_category(instance)
+
+
+def _catalog_changed(facet_change, autocomplete_change, categories=False):
+    """
+        Once the transaction is committed, move the catalog (and the categories) to a new
+        version and apply the change to the in-memory indexes of this process.
+
+        Before the commit, other processes would reload their indexes from data they cannot
+        see yet and keep them until the next change; a rolled back change is never applied.
+    """
+    def changed():
+        if categories:
+            bump_version(CATEGORIES)
+        previous, version = bump_version(CATALOG)
+        facet_index.apply(CATALOG, previous, version, facet_change)
+        autocomplete_index.apply(CATALOG, previous, version, autocomplete_change)
+    transaction.on_commit(changed)
+
+
+@receiver(post_save, sender=Product)
+def product_saved(sender, instance, **kwargs):
+    """
+        Move the catalog to a new version and update the in-memory indexes with the saved product.
+    """
+    _catalog_changed(lambda: facet_index.product_saved(instance), lambda: autocomplete_index.product_saved(instance))
+
+
+@receiver(post_delete, sender=Product)
+def product_deleted(sender, instance, **kwargs):
+    """
+        Move the catalog to a new version and drop the deleted product from the in-memory indexes.
+    """
+    # The primary key is cleared once the deletion is done
+    pk = instance.pk
+    _catalog_changed(lambda: facet_index.product_deleted(pk), lambda: autocomplete_index.product_deleted(pk))
+
+
+@receiver(post_save, sender=Category)
+def category_saved(sender, instance, **kwargs):
+    """
+        Move the catalog and the categories to a new version and update the in-memory indexes with the category.
+    """
+    _catalog_changed(
+        lambda: facet_index.category_saved(instance), lambda: autocomplete_index.category_saved(instance), categories=True,
+    )
+
+
+@receiver(post_delete, sender=Category)
+def category_deleted(sender, instance, **kwargs):
+    """
+        Move the catalog and the categories to a new version and drop the category from the in-memory indexes.
+    """
+    pk = instance.pk
+    _catalog_changed(
+        lambda: facet_index.category_deleted(pk), lambda: autocomplete_index.category_deleted(pk), categories=True,
+    )
+
+
+def _product_tags(product):
+    category = product.category
+    return product_tags(product.slug, category.slug, category.gender, category.product_type)
+
+
+@receiver(pre_save, sender=Product)
+def remember_product_tags(sender, instance, raw=False, **kwargs):
+    """
+        Remember the cache tags of a product before it is updated, in case its slug or category changes.
+    """
+    instance._cache_tags = []
+    if raw or instance._state.adding:
+        return
+    old = Product.objects.filter(pk=instance.pk).values(
+        'slug', 'category__slug', 'category__gender', 'category__product_type'
+    ).first()
+    if old is not None:
+        instance._cache_tags = product_tags(
+            old['slug'], old['category__slug'], old['category__gender'], old['category__product_type']
+        )
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def invalidate_product_views(sender, instance, **kwargs):
+    """
+        Invalidate the cached views showing a saved or deleted product, once the transaction is committed.
+
+        Before the commit, a request could rebuild a page from the old rows and cache it
+        under the new tag versions, without expiry.
+    """
+    tags = getattr(instance, '_cache_tags', []) + _product_tags(instance)
+    transaction.on_commit(lambda: invalidate_tags(tags))
+
+
+@receiver(post_save, sender=Variation)
+@receiver(post_delete, sender=Variation)
+def invalidate_variation_views(sender, instance, **kwargs):
+    """
+        Invalidate the cached detail page of the product of a saved or deleted variation, once the transaction is committed.
+    """
+    tags = ['product:%s' % instance.product.slug]
+    transaction.on_commit(lambda: invalidate_tags(tags))
+
+
+@receiver(pre_save, sender=Category)
+def remember_category_tags(sender, instance, raw=False, **kwargs):
+    """
+        Remember the cache tags of a category before it is updated, in case its slug or filters change.
+    """
+    instance._cache_tags = []
+    if raw or instance._state.adding:
+        return
+    old = Category.objects.filter(pk=instance.pk).values('slug', 'gender', 'product_type').first()
+    if old is not None:
+        instance._cache_tags = category_tags(old['slug'], old['gender'], old['product_type'])
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_category_views(sender, instance, **kwargs):
+    """
+        Invalidate the cached views depending on a saved or deleted category, once the transaction is committed.
+    """
+    tags = getattr(instance, '_cache_tags', []) + category_tags(instance.slug, instance.gender, instance.product_type)
+    transaction.on_commit(lambda: invalidate_tags(tags))
+
+
+@receiver(post_save, sender=Product)
+def generate_product_derivatives(sender, instance, raw=False, **kwargs):
+    """
+        Generate the missing derivatives of the images of a saved product, once the transaction is committed.
+    """
+    if raw:
+        return
+    names = [getattr(instance, field).name for field in PRODUCT_IMAGE_FIELDS]
+    transaction.on_commit(lambda: schedule_derivatives(names))
+
+
+@receiver(post_save, sender=Category)
+def generate_category_derivatives(sender, instance, raw=False, **kwargs):
+    """
+        Generate the missing derivatives of the image of a saved category, once the transaction is committed.
+    """
+    if raw:
+        return
+    name = instance.cat_image.name
+    transaction.on_commit(lambda: schedule_derivatives([name]))
+
+
+@receiver(pre_save, sender=Product)
+@receiver(pre_save, sender=Category)
+def remember_images(sender, instance, **kwargs):
+    """
+        Remember the images of a row before it is updated, to release the blobs it stops referencing.
+    """
+    fields = IMAGE_FIELDS[sender]
+    instance._old_images = dict.fromkeys(fields, '')
+    if instance._state.adding:
+        return
+    old = sender.objects.filter(pk=instance.pk).values(*fields).first()
+    if old is not None:
+        instance._old_images = dict((field, name or '') for field, name in old.items())
+
+
+def _image_storages(sender):
+    for field in IMAGE_FIELDS[sender]:
+        storage = sender._meta.get_field(field).storage
+        if isinstance(storage, ContentAddressedStorage):
+            yield field, storage
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_save, sender=Category)
+def count_image_references(sender, instance, **kwargs):
+    """
+        Reference the blobs of the new images of a saved row and release the ones it replaced.
+
+        Done in the transaction of the save, so that a rolled back save leaves the counts unchanged.
+    """
+    old = getattr(instance, '_old_images', {})
+    for field, storage in _image_storages(sender):
+        name, previous = getattr(instance, field).name or '', old.get(field, '')
+        if name == previous:
+            continue
+        if name:
+            storage.acquire(name)
+        if previous:
+            storage.release(previous)
+
+
+@receiver(post_delete, sender=Product)
+@receiver(post_delete, sender=Category)
+def release_images(sender, instance, **kwargs):
+    """
+        Release the blobs of the images of a deleted row.
+    """
+    for field, storage in _image_storages(sender):
+        if getattr(instance, field).name:
+            storage.release(getattr(instance, field).name)
@@ -0,0 +1,172 @@
+import hashlib
+import os
+import posixpath
+import uuid
+from collections import Counter
+from functools import partial
+
+from django.core.files.base import File
+from django.core.files.storage import FileSystemStorage
+from django.db import transaction
+from django.db.models import Case, F, Value, When
+
+from .models import MediaBlob
+
+
+def content_digest(content):
+    """
+        Return the SHA-256 hex digest and the size of a file, read chunk by chunk.
+    """
+    digest = hashlib.sha256()
+    size = 0
+    for chunk in content.chunks():
+        if isinstance(chunk, str):
+            chunk = chunk.encode()
+        digest.update(chunk)
+        size += len(chunk)
+    return digest.hexdigest(), size
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """
+        File system storage keeping one file per content, named after its SHA-256.
+
+        Saving a file stores it as 'blobs/<2 first hex digits>/<digest><extension>', whatever
+        the name it was uploaded with, unless a blob of the same content exists: the existing
+        blob is reused, so a re-uploaded image costs no disk space and keeps its URL (and the
+        caches of the browsers and of the CDN). Each blob has a MediaBlob row counting the
+        image fields referencing it, maintained by the save and delete hooks of the models
+        (see store.signals): release() drops one reference and removes the file with the
+        last, delete() only removes a blob that nothing references.
+
+        A blob row is locked while its file is written or removed, so that a concurrent save
+        of the same content never reuses a file that is being removed.
+
+        Files stored before the storage was enabled keep working and are deleted at once; the
+        deduplicate_media command moves them to blobs.
+
+        Attributes:
+            blob_directory (str): The directory of the blobs in the storage (default: 'blobs').
+    """
+
+    def __init__(self, blob_directory='blobs', **kwargs):
+        super().__init__(**kwargs)
+        self.blob_directory = blob_directory
+
+    def blob_name(self, digest, name):
+        """
+            Return the name of the blob of a digest, with the lowercase extension of `name`.
+        """
+        extension = posixpath.splitext(name)[1].lower()
+        return posixpath.join(self.blob_directory, digest[:2], digest + extension)
+
+    def get_available_name(self, name, max_length=None):
+        # The name is replaced by the one of the blob, see _save
+        return name
+
+    def _save(self, name, content):
+        # The reference is added by the model saving the name, so that saving the same
+        # content again to the same field does not count twice
+        digest, size = content_digest(content)
+        return self.store_blob(digest, size, name, content).name
+
+    def store_blob(self, digest, size, name, content, references=0):
+        """
+            Store the content of a digest as a blob, unless it exists, and add references to it.
+
+            Args:
+                digest (str): The SHA-256 of the content.
+                size (int): The size of the content.
+                name (str): The name of the file, giving the extension of a new blob.
+                content (File): The content.
+                references (int): The number of references to add (default: 0).
+
+            Returns:
+                MediaBlob: The blob of the content.
+        """
+        while True:
+            with transaction.atomic():
+                MediaBlob.objects.get_or_create(digest=digest, defaults={'name': self.blob_name(digest, name), 'size': size})
+                blob = MediaBlob.objects.select_for_update().filter(digest=digest).first()
+                if blob is None:
+                    # Removed by _remove_blob meanwhile, create it again
+                    continue
+                if not self.exists(blob.name):
+                    self._write(blob.name, content)
+                if references:
+                    MediaBlob.objects.filter(pk=blob.pk).update(references=F('references') + references)
+                return blob
+
+    def save_derived(self, name, content):
+        """
+            Write a file derived from a blob (e.g. a resized image) at `name`, replacing it.
+
+            Derived files are named after their blob rather than after their own content, and
+            have no reference count.
+        """
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        self._write(name, content)
+        return name
+
+    def _write(self, name, content):
+        # Write under a temporary name and rename, so that concurrent saves of the same
+        # content never expose a partial file or get a suffixed name
+        temporary = super()._save('%s.%s.tmp' % (name, uuid.uuid4().hex), content)
+        os.replace(self.path(temporary), self.path(name))
+
+    def acquire(self, name):
+        """
+            Add a reference to the blob of `name`, if it is one.
+        """
+        MediaBlob.objects.filter(name=name).update(references=F('references') + 1)
+
+    def acquire_many(self, names):
+        """
+            Add a reference to the blobs of `names` for each time they are listed, with one query.
+        """
+        counts = Counter(name for name in names if name)
+        if counts:
+            MediaBlob.objects.filter(name__in=counts).update(references=F('references') + Case(
+                *[When(name=name, then=Value(count)) for name, count in counts.items()], default=Value(0),
+            ))
+
+    def release(self, name):
+        """
+            Release one reference of the blob of `name`, and remove its file with the last one.
+
+            The file is removed once the transaction is committed; names that are not blobs
+            are left alone.
+        """
+        with transaction.atomic():
+            blob = MediaBlob.objects.select_for_update().filter(name=name).first()
+            if blob is None:
+                return
+            if blob.references > 1:
+                MediaBlob.objects.filter(pk=blob.pk).update(references=F('references') - 1)
+                return
+            MediaBlob.objects.filter(pk=blob.pk).update(references=0)
+            transaction.on_commit(partial(self._remove_blob, blob.pk))
+
+    def _remove_blob(self, pk):
+        # Under the lock of the row, so that a concurrent store_blob either sees the row
+        # referenced again and keeps the file, or no row and writes the file again
+        with transaction.atomic():
+            blob = MediaBlob.objects.select_for_update().filter(pk=pk, references=0).first()
+            if blob is not None:
+                super().delete(blob.name)
+                blob.delete()
+
+    def delete(self, name):
+        """
+            Remove a file, unless it is a blob still referenced by an image field.
+
+            The file of a blob is removed once the transaction is committed; a file that is
+            not a blob is removed at once.
+        """
+        with transaction.atomic():
+            blob = MediaBlob.objects.select_for_update().filter(name=name).first()
+            if blob is None:
+                super().delete(name)
+            elif not blob.references:
+                transaction.on_commit(partial(self._remove_blob, blob.pk))
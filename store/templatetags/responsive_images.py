@@ -0,0 +1,60 @@
+from django import template
+from django.utils.html import format_html, format_html_join
+
+from django.core.files.storage import default_storage
+
+from store.images import derivative_url, derivative_widths, derivatives_enabled, derivatives_ready
+
+
+register = template.Library()
+
+
+def _ready(image):
+    if hasattr(image, 'storage'):
+        return derivatives_ready(image.name, image.storage)
+    # URL of an original of the default storage
+    base_url = default_storage.base_url
+    return image.startswith(base_url) and derivatives_ready(image[len(base_url):])
+
+
+def _srcset(image, image_format):
+    urls = [(derivative_url(image, width, image_format), width) for width in derivative_widths()]
+    if any(url is None for url, width in urls):
+        return None
+    return format_html_join(', ', '{} {}w', urls)
+
+
+@register.simple_tag
+def responsive_image(image, sizes, alt='', css_class=''):
+    """
+        Render an <img> of an image with the srcset of its derivatives.
+
+        The browser picks the WebP derivative, or the JPEG one, closest to the displayed
+        width given by `sizes`; the original stays the src of browsers without srcset. Without
+        derivatives (settings.IMAGE_DERIVATIVES disabled, or not generated yet), a plain <img>
+        of the original is rendered.
+
+        Args:
+            image: An ImageField value, or the URL of the original.
+            sizes (str): The displayed width of the image (e.g. '(max-width: 768px) 50vw, 25vw').
+            alt (str): The alternative text (default: none).
+            css_class (str): The class of the <img> (default: none).
+
+        Usage:
+            {% load responsive_images %}
+            {% responsive_image product.images "100px" alt="product image" %}
+    """
+    if not image:
+        return ''
+    src = image.url if hasattr(image, 'url') else image
+    class_attribute = format_html(' class="{}"', css_class) if css_class else ''
+    webp = jpeg = None
+    if derivatives_enabled() and _ready(image):
+        webp, jpeg = _srcset(image, 'webp'), _srcset(image, 'jpeg')
+    if webp is None or jpeg is None:
+        return format_html('<img{} src="{}" alt="{}">', class_attribute, src, alt)
+    return format_html(
+        '<picture><source type="image/webp" srcset="{}" sizes="{}">'
+        '<img{} src="{}" srcset="{}" sizes="{}" alt="{}"></picture>',
+        webp, sizes, class_attribute, src, jpeg, sizes, alt,
+    )
@@ -1,8 +1,44 @@
-from django.test import TestCase
-from store.models import Product, Variation
+from django.test import TestCase, TransactionTestCase, override_settings, skipUnlessDBFeature
+from store.models import MediaBlob, Product, ProductSearchDocument, StockReservation, StockShard, Variation
+from store.autocomplete import autocomplete_index
+from store.catalog_import import CatalogImporter, read_rows
+from store.deduplication import MediaDeduplicator
+from store.cache import CATALOG, bump_version, get_version, view_cache_stats
+from store.facets import facet_index
+from store.feeds import iter_feed_products
+from store import images
+from store.images import derivative_name, generate_derivatives, generate_in_pool, image_names, schedule_derivatives
+from store.loaders import load_product_bundle
+from store.signals import product_deleted, product_saved
+from store.pagination import EstimatedCountPaginator, IdListPaginator, decode_cursor, encode_cursor, estimated_count
+from store.reservations import OutOfStock, available_stock, release, reserve, shard_stock, sweep_expired
+from store.search import get_backend
 from category.models import Category
+from carts.models import Cart
 from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage, default_storage
 from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.core.management.base import CommandError
+from django.urls import reverse
+from accounts.models import Account
+from unittest import mock
+from django.utils import timezone
+from io import BytesIO, StringIO
+from PIL import Image
+from concurrent.futures.process import BrokenProcessPool
+import base64
+import datetime
+import json
+import csv
+import os
+import shutil
+import tempfile
+from xml.etree import ElementTree
 
 
 class ProductModelTest(TestCase):
@@ -253,3 +289,1719 @@ class ProductModelTest(TestCase):
         invalid_variation.clean_fields()
     exception_message = str(context.exception)
     self.assertIn("invalid_category", exception_message)
+
+
+class ProductSearchTest(TestCase):
+  """
+    Test class for the full-text product search.
+
+    Methods:
+      setUp: Set up environment for each test.
+      test_document_created_on_save: Test if saving a product indexes it.
+      test_search_ranks_name_matches_first: Test if matches on the product name rank above description matches.
+      test_search_matches_prefix_and_category: Test if words are matched as prefixes and on the category name.
+      test_category_rename_is_indexed: Test if renaming a category updates the documents of its products.
+      test_deleted_product_not_found: Test if a deleted product disappears from the results.
+      test_rebuild_command: Test if the rebuild_search_index command reindexes every product.
+      test_search_view_paginates: Test if the search view renders ranked, paginated results.
+  """
+  def setUp(self):
+    """
+      Set up environment for each test.
+
+      Creates a category with a shirt, a dress whose description mentions a shirt, and eleven socks.
+    """
+    self.category = Category.objects.create(category_name='Chemises', slug='chemises')
+    self.shirt = Product.objects.create(product_name='Oxford shirt', title_online='Blue oxford', slug='oxford-shirt', category=self.category)
+    self.dress = Product.objects.create(product_name='Summer dress', slug='summer-dress', description='Goes well with a shirt', category=self.category)
+    for i in range(11):
+      Product.objects.create(product_name='Sock %d' % i, slug='sock-%d' % i, images='photos/products/sock.jpg', category=self.category)
+
+
+  def test_document_created_on_save(self):
+    """
+      Test if saving a product indexes it.
+
+      Asserts that the search document copies the product and category names.
+    """
+    document = ProductSearchDocument.objects.get(product=self.shirt)
+    self.assertEqual(document.product_name, 'Oxford shirt')
+    self.assertEqual(document.category_name, 'Chemises')
+
+
+  def test_search_ranks_name_matches_first(self):
+    """
+      Test if matches on the product name rank above description matches.
+    """
+    self.assertEqual(get_backend().search('shirt'), [self.shirt.id, self.dress.id])
+
+
+  def test_search_matches_prefix_and_category(self):
+    """
+      Test if words are matched as prefixes and on the category name.
+    """
+    self.assertEqual(get_backend().search('oxf'), [self.shirt.id])
+    self.assertEqual(len(get_backend().search('chemises')), 13)
+
+
+  def test_category_rename_is_indexed(self):
+    """
+      Test if renaming a category updates the documents of its products.
+    """
+    self.category.category_name = 'Tops'
+    self.category.save()
+    self.assertEqual(len(get_backend().search('tops')), 13)
+    self.assertEqual(get_backend().search('chemises'), [])
+
+
+  def test_deleted_product_not_found(self):
+    """
+      Test if a deleted product disappears from the results.
+    """
+    self.shirt.delete()
+    self.assertEqual(get_backend().search('oxford'), [])
+
+
+  def test_rebuild_command(self):
+    """
+      Test if the rebuild_search_index command reindexes every product.
+    """
+    ProductSearchDocument.objects.all().delete()
+    call_command('rebuild_search_index', batch_size=5, stdout=StringIO())
+    self.assertEqual(ProductSearchDocument.objects.count(), 13)
+    self.assertEqual(get_backend().search('summer'), [self.dress.id])
+
+
+  def test_search_view_paginates(self):
+    """
+      Test if the search view renders ranked, paginated results.
+    """
+    response = self.client.get(reverse('search'), {'keyword': 'sock'})
+    self.assertEqual(response.context['product_count'], 11)
+    self.assertEqual(len(response.context['products']), 9)
+    response = self.client.get(reverse('search'), {'keyword': 'sock', 'page': 2})
+    self.assertEqual(len(response.context['products']), 2)
+
+
+class KeysetPaginationTest(TestCase):
+  """
+    Test class for the keyset pagination of the store.
+
+    Methods:
+      setUpTestData: Set up initial data for the test class.
+      test_first_page: Test if the first page has no previous page and links to the following ones.
+      test_walk_forward_and_back: Test if following the cursors visits every product once, in both directions.
+      test_deep_page_window: Test if a deep page links to the pages around it.
+      test_invalid_cursor: Test if an invalid cursor, or one whose key is not an id, falls back to the first page.
+      test_decode_cursor_checks_values: Test if cursors with a key or a page number out of range are invalid.
+      test_store_count_is_cached: Test if the product count is read without COUNT query and follows the catalog.
+  """
+  @classmethod
+  def setUpTestData(cls):
+    """
+      Set up initial data for the test class.
+
+      Creates a category with 25 available products.
+    """
+    cls.category = Category.objects.create(category_name='Pulls', slug='pulls', gender='F', product_type='B')
+    for i in range(25):
+      Product.objects.create(product_name='Pull %02d' % i, slug='pull-%02d' % i, images='photos/products/pull.jpg', category=cls.category)
+    cls.ids = list(Product.objects.order_by('id').values_list('id', flat=True))
+
+
+  def setUp(self):
+    """
+      Set up environment for each test.
+
+      Clears the cache so that the in-memory catalog structures are reloaded.
+    """
+    cache.clear()
+
+
+  def test_first_page(self):
+    """
+      Test if the first page has no previous page and links to the following ones.
+    """
+    page = IdListPaginator(self.ids, 10).page()
+    self.assertEqual(page.object_list, self.ids[:10])
+    self.assertFalse(page.has_previous())
+    self.assertTrue(page.has_next())
+    self.assertEqual([number for number, cursor in page.window], [1, 2, 3])
+
+
+  def test_walk_forward_and_back(self):
+    """
+      Test if following the cursors visits every product once, in both directions.
+    """
+    paginator = IdListPaginator(self.ids, 10)
+    page = paginator.page()
+    seen = list(page)
+    while page.has_next():
+      page = paginator.page(page.next_cursor)
+      seen += list(page)
+    self.assertEqual(seen, self.ids)
+    self.assertEqual(page.number, 3)
+    page = paginator.page(page.previous_cursor)
+    self.assertEqual(page.object_list, self.ids[10:20])
+    page = paginator.page(page.previous_cursor)
+    self.assertEqual(page.number, 1)
+    self.assertEqual(page.object_list, self.ids[:10])
+
+
+  def test_deep_page_window(self):
+    """
+      Test if a deep page links to the pages around it.
+    """
+    paginator = IdListPaginator(self.ids, 2)
+    page = paginator.page()
+    for _ in range(5):
+      page = paginator.page(page.next_cursor)
+    self.assertEqual(page.number, 6)
+    self.assertEqual([number for number, cursor in page.window], [4, 5, 6, 7, 8])
+    target = dict(page.window)[4]
+    self.assertEqual(paginator.page(target).object_list, self.ids[6:8])
+
+
+  def test_invalid_cursor(self):
+    """
+      Test if an invalid cursor, or one whose key is not an id, falls back to the first page.
+    """
+    paginator = IdListPaginator(self.ids, 10)
+    for cursor in ['not-a-cursor'] + [encode_cursor(values, 2) for values in (['a'], [None], [{}], [True], [], [1, 2])]:
+      page = paginator.page(cursor)
+      self.assertEqual(page.number, 1)
+      self.assertEqual(page.object_list, self.ids[:10])
+
+
+  def test_decode_cursor_checks_values(self):
+    """
+      Test if cursors with a key or a page number out of range are invalid.
+    """
+    def token(payload):
+      return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+    self.assertEqual(decode_cursor(None), (None, 1))
+    self.assertEqual(decode_cursor(encode_cursor([7], 3)), ([7], 3))
+    for payload in ('{"k":[7],"n":Infinity}', '{"k":[7],"n":NaN}', '{"k":[7],"n":1}', '{"k":[7],"n":"3"}',
+                    '{"k":[7],"n":2.5}', '{"k":[0],"n":2}', '{"k":[-7],"n":2}', '{"k":[7.0],"n":2}', '[7, 2]'):
+      self.assertEqual(decode_cursor(token(payload)), (None, None), payload)
+
+
+  def test_store_count_is_cached(self):
+    """
+      Test if the product count is read without COUNT query and follows the catalog.
+    """
+    url = reverse('store') + '?gender=women'
+    self.assertEqual(self.client.get(url).context['product_count'], 25)
+    with CaptureQueriesContext(connection) as queries:
+      response = self.client.get(url)
+    self.assertFalse([query for query in queries if 'COUNT(' in query['sql']])
+    self.assertEqual(response.context['pagination']['num_pages'], 3)
+    with self.captureOnCommitCallbacks(execute=True):
+      Product.objects.create(product_name='Pull new', slug='pull-new', images='photos/products/pull.jpg', category=self.category)
+    self.assertEqual(self.client.get(url).context['product_count'], 26)
+
+
+class FacetIndexTest(TestCase):
+  """
+    Test class for the in-memory facets of the store filters.
+
+    Methods:
+      setUp: Set up environment for each test.
+      test_filters: Test the product ids of the gender, product type and category filters.
+      test_filter_counts: Test the counts shown next to the navbar filters.
+      test_incremental_updates: Test if saves and deletes update the facets without reloading them.
+      test_category_change: Test if changing the gender of a category moves its products.
+      test_rolled_back_change: Test if a rolled back save neither bumps the catalog nor changes the facets.
+      test_bump_version: Test if bumping returns the exact previous version, even after a cache clear.
+      test_store_view_filters: Test if the store view reads its filters and count from the facets.
+  """
+  def setUp(self):
+    """
+      Set up environment for each test.
+
+      Creates a women clothing category, a men accessories category and their products.
+    """
+    cache.clear()
+    self.dresses = Category.objects.create(category_name='Robes', slug='robes', gender='F', product_type='B')
+    self.belts = Category.objects.create(category_name='Ceintures', slug='ceintures', gender='H', product_type='Y')
+    self.dress = Product.objects.create(product_name='Dress', slug='dress', images='photos/products/dress.jpg', category=self.dresses)
+    self.belt = Product.objects.create(product_name='Belt', slug='belt', images='photos/products/belt.jpg', category=self.belts)
+    self.hidden = Product.objects.create(product_name='Hidden', slug='hidden', is_available=False, category=self.belts)
+
+
+  def test_filters(self):
+    """
+      Test the product ids of the gender, product type and category filters.
+    """
+    self.assertEqual(facet_index.product_ids(), [self.dress.id, self.belt.id])
+    self.assertEqual(facet_index.product_ids(gender='F'), [self.dress.id])
+    self.assertEqual(facet_index.product_ids(product_type='Y'), [self.belt.id])
+    self.assertEqual(facet_index.product_ids(gender='F', product_type='Y'), [])
+    self.assertEqual(facet_index.product_ids(category_id=self.belts.id), [self.belt.id])
+
+
+  def test_filter_counts(self):
+    """
+      Test the counts shown next to the navbar filters.
+    """
+    counts = facet_index.filter_counts()
+    self.assertEqual(counts['all'], 2)
+    self.assertEqual(counts['women'], 1)
+    self.assertEqual(counts['clothingAccessMen'], 1)
+    self.assertEqual(counts['clothingMen'], 0)
+
+
+  def test_incremental_updates(self):
+    """
+      Test if saves and deletes update the facets without reloading them.
+    """
+    facet_index.product_ids()
+    with self.assertNumQueries(0):
+      self.hidden.is_available = True
+      with self.captureOnCommitCallbacks(execute=True):
+        product_saved(Product, self.hidden)
+      self.assertEqual(facet_index.product_ids(gender='H'), [self.belt.id, self.hidden.id])
+      with self.captureOnCommitCallbacks(execute=True):
+        product_deleted(Product, self.belt)
+      self.assertEqual(facet_index.product_ids(gender='H'), [self.hidden.id])
+
+
+  def test_category_change(self):
+    """
+      Test if changing the gender of a category moves its products.
+    """
+    self.assertEqual(facet_index.count(gender='F'), 1)
+    self.belts.gender = 'F'
+    with self.captureOnCommitCallbacks(execute=True):
+      self.belts.save()
+    self.assertEqual(facet_index.product_ids(gender='F'), [self.dress.id, self.belt.id])
+    with self.captureOnCommitCallbacks(execute=True):
+      self.belts.delete()
+    self.assertEqual(facet_index.product_ids(), [self.dress.id])
+
+
+  def test_rolled_back_change(self):
+    """
+      Test if a rolled back save neither bumps the catalog nor changes the facets.
+    """
+    facet_index.product_ids()
+    version = get_version(CATALOG)
+    with self.captureOnCommitCallbacks(execute=True) as callbacks:
+      try:
+        with transaction.atomic():
+          self.hidden.is_available = True
+          self.hidden.save()
+          raise ValueError('rollback')
+      except ValueError:
+        pass
+    self.assertEqual(callbacks, [])
+    self.assertEqual(get_version(CATALOG), version)
+    self.assertEqual(facet_index.product_ids(gender='H'), [self.belt.id])
+
+
+  def test_bump_version(self):
+    """
+      Test if bumping returns the exact previous version, even after a cache clear.
+    """
+    version = get_version(CATALOG)
+    self.assertEqual(bump_version(CATALOG), (version, version + 1))
+    cache.clear()
+    previous, version = bump_version(CATALOG)
+    self.assertEqual((version, get_version(CATALOG)), (previous + 1, version))
+
+
+  def test_store_view_filters(self):
+    """
+      Test if the store view reads its filters and count from the facets.
+    """
+    response = self.client.get(reverse('store'), {'gender': 'men', 'category': 'clothingAccessMen'})
+    self.assertEqual(response.context['page_title'], 'Accessoires Homme')
+    self.assertEqual(response.context['product_count'], 1)
+    self.assertEqual([p.id for p in response.context['products']], [self.belt.id])
+    self.assertContains(response, '<span class="facet-count">(1)</span>', count=4, html=True)
+
+
+class CatalogViewCacheTest(TestCase):
+  """
+    Test class for the cached catalog views.
+
+    Methods:
+      setUp: Set up environment for each test.
+      test_store_page_cached: Test if a second visit of a store page is a hit that loads no product.
+      test_unknown_filters_share_entry: Test if unknown filter values are served from the entry of the unfiltered page.
+      test_invalid_cursor_refused: Test if a cursor that does not decode to a product id is not found.
+      test_cursor_cache_key: Test if pages are cached by the product id of their cursor.
+      test_store_page_invalidated_by_product: Test if saving a product of the listing invalidates the page.
+      test_unrelated_change_keeps_page: Test if a change in another category keeps the page cached.
+      test_product_detail_invalidated_by_variation: Test if saving a variation invalidates the product page.
+      test_product_slug_change: Test if the old URL of a renamed product is no longer served from the cache.
+      test_stats_command: Test if the catalog_cache_stats command prints the counters.
+  """
+  def setUp(self):
+    """
+      Set up environment for each test.
+
+      Creates a women and a men category with one product each.
+    """
+    cache.clear()
+    self.women = Category.objects.create(category_name='Jupes', slug='jupes', gender='F', product_type='B')
+    self.men = Category.objects.create(category_name='Vestes', slug='vestes', gender='H', product_type='A')
+    self.skirt = Product.objects.create(product_name='Skirt', slug='skirt', stock=2, images='photos/products/skirt.jpg', category=self.women)
+    self.jacket = Product.objects.create(product_name='Jacket', slug='jacket', stock=2, images='photos/products/jacket.jpg', category=self.men)
+
+
+  def products_loaded(self, url):
+    with CaptureQueriesContext(connection) as queries:
+      self.client.get(url)
+    return len([query for query in queries if 'FROM "store_product"' in query['sql']])
+
+
+  def test_store_page_cached(self):
+    """
+      Test if a second visit of a store page is a hit that loads no product.
+    """
+    url = reverse('store') + '?gender=women'
+    self.assertGreater(self.products_loaded(url), 0)
+    self.assertEqual(self.products_loaded(url), 0)
+    self.assertEqual(view_cache_stats()['store'], {'hits': 1, 'misses': 1})
+
+
+  def test_unknown_filters_share_entry(self):
+    """
+      Test if unknown filter values are served from the entry of the unfiltered page.
+    """
+    self.client.get(reverse('store'))
+    for query in ('?gender=x1', '?gender=x2&category=y', '?cursor='):
+      self.assertEqual(self.products_loaded(reverse('store') + query), 0)
+    self.assertEqual(view_cache_stats()['store'], {'hits': 3, 'misses': 1})
+
+
+  def test_invalid_cursor_refused(self):
+    """
+      Test if a cursor that does not decode to a product id is not found.
+    """
+    cursors = ['not-a-cursor', base64.urlsafe_b64encode(b'{"k":[1],"n":Infinity}').decode()]
+    for cursor in cursors + [encode_cursor(values, 2) for values in (['a'], [None], [{}])]:
+      self.assertEqual(self.client.get(reverse('store'), {'cursor': cursor}).status_code, 404)
+    self.assertEqual(view_cache_stats()['store'], {'hits': 0, 'misses': 0})
+
+
+  def test_cursor_cache_key(self):
+    """
+      Test if pages are cached by the product id of their cursor.
+    """
+    first = min(self.skirt.id, self.jacket.id)
+    for number in (2, 5, 99):
+      response = self.client.get(reverse('store'), {'cursor': encode_cursor([first], number)})
+      self.assertEqual(response.context['products'].number, 2)
+    self.assertEqual(view_cache_stats()['store'], {'hits': 2, 'misses': 1})
+    unknown = encode_cursor([max(self.skirt.id, self.jacket.id) + 1000], 2)
+    self.assertEqual(self.client.get(reverse('store'), {'cursor': unknown}).status_code, 404)
+
+
+  def test_store_page_invalidated_by_product(self):
+    """
+      Test if saving a product of the listing invalidates the page.
+    """
+    url = reverse('products_by_category', args=['jupes'])
+    self.client.get(url)
+    self.skirt.title_online = 'Pleated skirt'
+    with self.captureOnCommitCallbacks(execute=True):
+      self.skirt.save()
+    self.assertContains(self.client.get(url), 'Pleated skirt')
+
+
+  def test_unrelated_change_keeps_page(self):
+    """
+      Test if a change in another category keeps the page cached.
+    """
+    url = reverse('store') + '?gender=women'
+    self.client.get(url)
+    self.jacket.price = 99
+    self.jacket.save()
+    self.assertEqual(self.products_loaded(url), 0)
+
+
+  def test_product_detail_invalidated_by_variation(self):
+    """
+      Test if saving a variation invalidates the product page.
+    """
+    url = self.skirt.get_url()
+    self.client.get(url)
+    self.client.get(url)
+    self.assertEqual(view_cache_stats()['product_detail'], {'hits': 1, 'misses': 1})
+    Variation.objects.create(product=self.skirt, variation_category='size', variation_value='xl')
+    self.client.get(url)
+    self.assertEqual(view_cache_stats()['product_detail'], {'hits': 2, 'misses': 1})
+    with self.captureOnCommitCallbacks(execute=True):
+      Variation.objects.create(product=self.skirt, variation_category='size', variation_value='xxl')
+    self.client.get(url)
+    self.assertEqual(view_cache_stats()['product_detail'], {'hits': 2, 'misses': 2})
+
+
+  def test_product_slug_change(self):
+    """
+      Test if the old URL of a renamed product is no longer served from the cache.
+    """
+    old_url = self.skirt.get_url()
+    self.client.get(old_url)
+    self.skirt.slug = 'long-skirt'
+    with self.captureOnCommitCallbacks(execute=True):
+      self.skirt.save()
+    with self.assertRaises(Product.DoesNotExist):
+      self.client.get(old_url)
+
+
+  def test_stats_command(self):
+    """
+      Test if the catalog_cache_stats command prints the counters.
+    """
+    self.client.get(reverse('store'))
+    out = StringIO()
+    call_command('catalog_cache_stats', stdout=out)
+    self.assertIn('store            hits=0        misses=1', out.getvalue())
+
+
+class AutocompleteTest(TestCase):
+  """
+    Test class for the typeahead autocomplete.
+
+    Methods:
+      setUp: Set up environment for each test.
+      test_whole_name_before_word_matches: Test if names starting with the prefix come before word matches.
+      test_accents_and_case_ignored: Test if the prefix matching ignores accents and case.
+      test_limit: Test if the number of suggestions is limited.
+      test_incremental_updates: Test if saves and deletes update the index without reloading it.
+      test_category_slug_change: Test if renaming a category slug updates the URLs of its products.
+      test_endpoint_without_query: Test if the endpoint answers from memory once the index is loaded.
+  """
+  def setUp(self):
+    """
+      Set up environment for each test.
+
+      Creates a shirt category with three products.
+    """
+    cache.clear()
+    self.category = Category.objects.create(category_name='Chemises', slug='chemises')
+    self.oxford = Product.objects.create(product_name='Oxford shirt', title_online='Chemise Oxford', slug='oxford', category=self.category)
+    self.shirt = Product.objects.create(product_name='Shirt linen', slug='shirt-linen', category=self.category)
+    self.elephant = Product.objects.create(product_name='Éléphant tee', slug='elephant', category=self.category)
+
+
+  def test_whole_name_before_word_matches(self):
+    """
+      Test if names starting with the prefix come before word matches.
+    """
+    labels = [result['label'] for result in autocomplete_index.suggest('shi')]
+    self.assertEqual(labels, ['Shirt linen', 'Chemise Oxford'])
+    labels = [result['label'] for result in autocomplete_index.suggest('chem')]
+    self.assertEqual(labels, ['Chemise Oxford', 'Chemises'])
+
+
+  def test_accents_and_case_ignored(self):
+    """
+      Test if the prefix matching ignores accents and case.
+    """
+    result = autocomplete_index.suggest('ELEP')[0]
+    self.assertEqual(result, {'type': 'product', 'label': 'Éléphant tee', 'url': self.elephant.get_url()})
+
+
+  def test_limit(self):
+    """
+      Test if the number of suggestions is limited.
+    """
+    self.assertEqual(len(autocomplete_index.suggest('c', limit=1)), 1)
+
+
+  def test_incremental_updates(self):
+    """
+      Test if saves and deletes update the index without reloading it.
+    """
+    autocomplete_index.suggest('x')
+    self.shirt.product_name = 'Silk scarf'
+    with self.captureOnCommitCallbacks(execute=True):
+      self.shirt.save()
+      self.oxford.delete()
+    with self.assertNumQueries(0):
+      self.assertEqual([result['label'] for result in autocomplete_index.suggest('scarf')], ['Silk scarf'])
+      self.assertEqual(autocomplete_index.suggest('oxford'), [])
+      self.assertEqual(autocomplete_index.suggest('shirt'), [])
+
+
+  def test_category_slug_change(self):
+    """
+      Test if renaming a category slug updates the URLs of its products.
+    """
+    autocomplete_index.suggest('x')
+    self.category.slug = 'tops'
+    with self.captureOnCommitCallbacks(execute=True):
+      self.category.save()
+    self.assertEqual(autocomplete_index.suggest('oxford')[0]['url'], '/store/category/tops/oxford/')
+
+
+  def test_endpoint_without_query(self):
+    """
+      Test if the endpoint answers from memory once the index is loaded.
+    """
+    self.client.get(reverse('autocomplete'), {'q': 'a'})
+    with self.assertNumQueries(0):
+      response = self.client.get(reverse('autocomplete'), {'q': 'oxf', 'limit': 'x'})
+    self.assertEqual(response.json()['results'][0]['label'], 'Chemise Oxford')
+
+
+class ProductBundleTest(TestCase):
+  """
+    Test class for the single query product detail loader.
+
+    Methods:
+      setUp: Set up environment for each test.
+      test_single_query: Test if the product, its category and its variations are loaded in one query.
+      test_product_without_variation: Test if a product without active variation is loaded.
+      test_unknown_product: Test if an unknown product raises Product.DoesNotExist.
+      test_detail_page_from_cache: Test if a cached product page only runs the cart check.
+  """
+  def setUp(self):
+    """
+      Set up environment for each test.
+
+      Creates a product with two sizes, a color, an inactive color and two images.
+    """
+    cache.clear()
+    self.category = Category.objects.create(category_name='Pantalons', slug='pantalons')
+    self.product = Product.objects.create(
+      product_name='Chino', slug='chino', stock=3, category=self.category,
+      images='photos/products/chino.jpg', third_image='photos/products/chino-back.jpg',
+    )
+    for category, value, active in [('size', 's', True), ('color', 'Beige', True), ('size', 'm', True), ('color', 'Black', False)]:
+      Variation.objects.create(product=self.product, variation_category=category, variation_value=value, is_active=active)
+
+
+  def test_single_query(self):
+    """
+      Test if the product, its category and its variations are loaded in one query.
+    """
+    with self.assertNumQueries(1):
+      bundle = load_product_bundle('pantalons', 'chino')
+      self.assertEqual(bundle.product.category.slug, 'pantalons')
+      self.assertEqual([v.variation_value for v in bundle.sizes], ['s', 'm'])
+      self.assertEqual([v.variation_value for v in bundle.colors], ['Beige'])
+    self.assertEqual(bundle.main_image_url, '/media/photos/products/chino.jpg')
+    self.assertEqual(bundle.thumbnail_urls, ['/media/photos/products/chino-back.jpg'])
+
+
+  def test_product_without_variation(self):
+    """
+      Test if a product without active variation is loaded.
+    """
+    Variation.objects.filter(product=self.product).update(is_active=False)
+    bundle = load_product_bundle('pantalons', 'chino')
+    self.assertEqual(bundle.product, self.product)
+    self.assertEqual(bundle.sizes, [])
+    self.assertEqual(bundle.colors, [])
+
+
+  def test_unknown_product(self):
+    """
+      Test if an unknown product raises Product.DoesNotExist.
+    """
+    with self.assertRaises(Product.DoesNotExist):
+      load_product_bundle('pantalons', 'jeans')
+
+
+  def test_detail_page_from_cache(self):
+    """
+      Test if a cached product page only runs the cart check.
+    """
+    self.client.get(self.product.get_url())
+    with CaptureQueriesContext(connection) as queries:
+      response = self.client.get(self.product.get_url())
+    self.assertFalse([query for query in queries if 'store_' in query['sql']])
+    self.assertContains(response, '<option value="m">M</option>', html=True)
+    self.assertNotContains(response, 'Black')
+
+
+class StockReservationTest(TestCase):
+  """
+    Test class for the stock reservations.
+
+    Methods:
+      setUp: Set up environment for each test.
+      test_reserve_takes_stock: Test if a reservation takes units from the product stock.
+      test_out_of_stock: Test if reserving more units than left raises OutOfStock.
+      test_release: Test if releasing gives back the held units, newest holds first.
+      test_reserve_extends_cart_holds: Test if a new reservation extends the other holds of the product for the cart.
+      test_sweep_expired: Test if the expired holds are given back and the others kept.
+      test_shard_stock: Test if the stock is spread over shards and reserved from them.
+      test_unshard_stock: Test if the shards are gathered back into the product stock.
+      test_sweep_command: Test if the sweep_reservations command releases the expired holds.
+      test_add_to_cart_reserves: Test if adding to the cart holds a unit when reservations are enabled.
+      test_add_out_of_stock: Test if adding an out of stock product redirects to the product page.
+      test_api_out_of_stock: Test if the cart API answers 409 and adds nothing when out of stock.
+      test_api_remove_releases: Test if decrementing, setting and removing the cart item give the units back.
+      test_login_moves_holds: Test if the cart and its holds follow the session key rotated on login.
+      test_detail_page_live_stock: Test if the product page shows the live stock.
+      test_disabled_by_default: Test if adding to the cart takes no stock when reservations are disabled.
+  """
+  def setUp(self):
+    """
+      Set up environment for each test.
+
+      Creates a product with 3 units.
+    """
+    cache.clear()
+    self.category = Category.objects.create(category_name='Vestes', slug='vestes')
+    self.product = Product.objects.create(
+      product_name='Parka', slug='parka', stock=3, category=self.category, images='photos/products/parka.jpg',
+    )
+
+
+  def _stock(self):
+    return Product.objects.values_list('stock', flat=True).get(pk=self.product.pk)
+
+
+  def test_reserve_takes_stock(self):
+    """
+      Test if a reservation takes units from the product stock.
+    """
+    hold = reserve(self.product.id, 'cart-a', 2)
+    self.assertEqual(hold.quantity, 2)
+    self.assertIsNone(hold.shard_id)
+    self.assertEqual(self._stock(), 1)
+    self.assertEqual(available_stock(self.product.id), 1)
+
+
+  def test_out_of_stock(self):
+    """
+      Test if reserving more units than left raises OutOfStock.
+    """
+    reserve(self.product.id, 'cart-a', 2)
+    with self.assertRaises(OutOfStock):
+      reserve(self.product.id, 'cart-b', 2)
+    self.assertEqual(self._stock(), 1)
+    self.assertEqual(StockReservation.objects.count(), 1)
+
+
+  def test_release(self):
+    """
+      Test if releasing gives back the held units, newest holds first.
+    """
+    first = reserve(self.product.id, 'cart-a', 1)
+    reserve(self.product.id, 'cart-a', 2)
+    self.assertEqual(release('cart-a', self.product.id, 2), 2)
+    self.assertEqual(self._stock(), 2)
+    self.assertEqual(list(StockReservation.objects.values_list('pk', 'quantity')), [(first.pk, 1)])
+    # Only the held units are given back
+    self.assertEqual(release('cart-a', self.product.id, 5), 1)
+    self.assertEqual(self._stock(), 3)
+    self.assertFalse(StockReservation.objects.exists())
+
+
+  def test_reserve_extends_cart_holds(self):
+    """
+      Test if a new reservation extends the other holds of the product for the cart.
+    """
+    coat = Product.objects.create(product_name='Manteau', slug='manteau', stock=3, category=self.category)
+    first = reserve(self.product.id, 'cart-a', 1, ttl=10)
+    other = reserve(self.product.id, 'cart-b', 1, ttl=10)
+    other_product = reserve(coat.id, 'cart-a', 1, ttl=10)
+    second = reserve(self.product.id, 'cart-a', 1, ttl=600)
+    for hold in (first, other, other_product):
+      hold.refresh_from_db()
+    self.assertEqual(first.expires_at, second.expires_at)
+    self.assertLess(other.expires_at, second.expires_at)
+    self.assertLess(other_product.expires_at, second.expires_at)
+
+
+  def test_sweep_expired(self):
+    """
+      Test if the expired holds are given back and the others kept.
+    """
+    reserve(self.product.id, 'cart-a', 1, ttl=-1)
+    reserve(self.product.id, 'cart-b', 1, ttl=-1)
+    kept = reserve(self.product.id, 'cart-c', 1)
+    self.assertEqual(sweep_expired(batch_size=1), 2)
+    self.assertEqual(self._stock(), 2)
+    self.assertEqual(list(StockReservation.objects.all()), [kept])
+    self.assertEqual(sweep_expired(now=timezone.now() + datetime.timedelta(days=1)), 1)
+    self.assertEqual(self._stock(), 3)
+
+
+  def test_shard_stock(self):
+    """
+      Test if the stock is spread over shards and reserved from them.
+    """
+    self.assertEqual(shard_stock(self.product.id, 2), 3)
+    self.assertEqual(self._stock(), 0)
+    self.assertEqual(list(StockShard.objects.filter(product=self.product).order_by('index').values_list('available', flat=True)), [2, 1])
+    holds = [reserve(self.product.id, 'cart-a') for _ in range(3)]
+    self.assertTrue(all(hold.shard_id for hold in holds))
+    self.assertEqual(available_stock(self.product.id), 0)
+    with self.assertRaises(OutOfStock):
+      reserve(self.product.id, 'cart-a')
+    # The units go back to the shard they were taken from
+    sweep_expired(now=timezone.now() + datetime.timedelta(days=1))
+    self.assertEqual(available_stock(self.product.id), 3)
+    self.assertEqual(StockShard.objects.filter(product=self.product, available__lt=0).count(), 0)
+
+
+  def test_unshard_stock(self):
+    """
+      Test if the shards are gathered back into the product stock.
+    """
+    shard_stock(self.product.id, 3)
+    reserve(self.product.id, 'cart-a')
+    self.assertEqual(shard_stock(self.product.id, 0), 2)
+    self.assertEqual(self._stock(), 2)
+    self.assertEqual(available_stock(self.product.id), 2)
+
+
+  def test_sweep_command(self):
+    """
+      Test if the sweep_reservations command releases the expired holds.
+    """
+    reserve(self.product.id, 'cart-a', 2, ttl=-1)
+    out = StringIO()
+    call_command('sweep_reservations', stdout=out)
+    self.assertIn('1 expired reservation(s) released.', out.getvalue())
+    self.assertEqual(self._stock(), 3)
+
+
+  @override_settings(STOCK_RESERVATIONS=True)
+  def test_add_to_cart_reserves(self):
+    """
+      Test if adding to the cart holds a unit when reservations are enabled.
+    """
+    self.client.post(reverse('add_cart', args=[self.product.id]))
+    self.client.post(reverse('add_cart', args=[self.product.id]))
+    self.assertEqual(self._stock(), 1)
+    session_key = self.client.session.session_key
+    self.assertEqual(StockReservation.objects.filter(cart_id=session_key).count(), 2)
+
+
+  @override_settings(STOCK_RESERVATIONS=True)
+  def test_add_out_of_stock(self):
+    """
+      Test if adding an out of stock product redirects to the product page.
+    """
+    reserve(self.product.id, 'cart-a', 3)
+    response = self.client.post(reverse('add_cart', args=[self.product.id]), follow=True)
+    self.assertRedirects(response, self.product.get_url())
+    self.assertContains(response, 'Sorry, this product is out of stock.')
+    self.assertContains(response, 'Out of stock')
+    self.assertEqual(self.client.get(reverse('cart')).context['quantity'], 0)
+
+
+  @override_settings(STOCK_RESERVATIONS=True)
+  def test_api_out_of_stock(self):
+    """
+      Test if the cart API answers 409 and adds nothing when out of stock.
+    """
+    other = Product.objects.create(product_name='Bonnet', slug='bonnet', stock=5, category=self.category)
+    response = self.client.post(
+      reverse('cart_api_add_many'),
+      json.dumps({'items': [{'product_id': other.id, 'quantity': 2}, {'product_id': self.product.id, 'quantity': 4}]}),
+      content_type='application/json',
+    )
+    self.assertEqual(response.status_code, 409)
+    self.assertEqual(Product.objects.get(pk=other.pk).stock, 5)
+    self.assertFalse(StockReservation.objects.exists())
+    reserve(self.product.id, 'cart-a', 3)
+    response = self.client.post(reverse('cart_api_add', args=[self.product.id]))
+    self.assertEqual(response.status_code, 409)
+    self.assertEqual(response.json()['error'], 'This product is out of stock.')
+
+
+  @override_settings(STOCK_RESERVATIONS=True)
+  def test_api_remove_releases(self):
+    """
+      Test if decrementing, setting and removing the cart item give the units back.
+    """
+    line = self.client.post(reverse('cart_api_add', args=[self.product.id])).json()['line']
+    args = [self.product.id, line['id']]
+    response = self.client.post(reverse('cart_api_set_quantity', args=args), {'quantity': 3})
+    self.assertEqual(response.json()['line']['quantity'], 3)
+    self.assertEqual(self._stock(), 0)
+    # The previous quantity is kept when the stock is short
+    response = self.client.post(reverse('cart_api_set_quantity', args=args), {'quantity': 4})
+    self.assertEqual(response.status_code, 409)
+    self.assertEqual(self.client.get(reverse('cart')).context['quantity'], 3)
+    self.client.post(reverse('cart_api_decrement', args=args))
+    self.assertEqual(self._stock(), 1)
+    self.client.post(reverse('cart_api_remove', args=args))
+    self.assertEqual(self._stock(), 3)
+    self.assertFalse(StockReservation.objects.exists())
+
+
+  @override_settings(STOCK_RESERVATIONS=True)
+  def test_login_moves_holds(self):
+    """
+      Test if the cart and its holds follow the session key rotated on login.
+    """
+    self.client.post(reverse('cart_api_add', args=[self.product.id]))
+    old_key = self.client.session.session_key
+    user = Account.objects.create_user(first_name='hold', last_name='user', email='hold@user.com', username='hold', password='password')
+    self.client.force_login(user)
+    new_key = self.client.session.session_key
+    self.assertNotEqual(new_key, old_key)
+    self.assertEqual(list(StockReservation.objects.values_list('cart_id', flat=True)), [new_key])
+    self.assertEqual(list(Cart.objects.values_list('cart_id', flat=True)), [new_key])
+    self.assertEqual([item.product for item in self.client.get(reverse('cart')).context['cart_items']], [self.product])
+    self.assertEqual(release(new_key, self.product.id, 1), 1)
+    self.assertEqual(self._stock(), 3)
+
+
+  @override_settings(STOCK_RESERVATIONS=True)
+  def test_detail_page_live_stock(self):
+    """
+      Test if the product page shows the live stock.
+    """
+    self.assertNotContains(self.client.get(self.product.get_url()), 'Out of stock')
+    reserve(self.product.id, 'cart-a', 3)
+    self.assertContains(self.client.get(self.product.get_url()), 'Out of stock')
+
+
+  def test_disabled_by_default(self):
+    """
+      Test if adding to the cart takes no stock when reservations are disabled.
+    """
+    self.client.post(reverse('add_cart', args=[self.product.id]))
+    self.assertEqual(self._stock(), 3)
+    self.assertFalse(StockReservation.objects.exists())
+
+
+class StockReservationConcurrencyTest(TransactionTestCase):
+  """
+    Test class for concurrent stock reservations.
+
+    Methods:
+      setUp: Set up environment for each test.
+      test_benchmark_command: Test if the benchmark_reservations command never oversells.
+      test_no_oversell: Test if concurrent threads never reserve more than the stock.
+  """
+  def setUp(self):
+    """
+      Set up environment for each test.
+
+      Creates the category of the benchmark product.
+    """
+    Category.objects.create(category_name='Vestes', slug='vestes')
+
+
+  def test_benchmark_command(self):
+    """
+      Test if the benchmark_reservations command never oversells, with a single thread.
+    """
+    out = StringIO()
+    call_command('benchmark_reservations', threads=1, attempts=8, stock=5, shards=2, stdout=out)
+    self.assertIn('5 reservations, 3 refused', out.getvalue())
+    self.assertIn('The product was never oversold.', out.getvalue())
+    self.assertFalse(Product.objects.filter(slug__startswith='benchmark-').exists())
+    self.assertFalse(StockReservation.objects.exists())
+
+
+  @skipUnlessDBFeature('test_db_allows_multiple_connections')
+  def test_no_oversell(self):
+    """
+      Test if concurrent threads never reserve more than the stock.
+
+      SQLite test databases do not support concurrent connections, so this runs on MySQL only.
+    """
+    out = StringIO()
+    call_command('benchmark_reservations', threads=4, attempts=20, stock=50, shards=4, stdout=out)
+    self.assertIn('The product was never oversold.', out.getvalue())
+
+
+class CatalogImportTest(TestCase):
+  """
+    Test class for the import_catalog command.
+
+    Methods:
+      setUp: Set up environment for each test.
+      test_import_csv: Test if a CSV feed creates the categories, the products and their variations.
+      test_import_jsonl_updates: Test if a JSON Lines feed updates the existing products and skips unchanged ones.
+      test_variations_synchronized: Test if listed variations are reactivated and the missing ones deactivated.
+      test_unique_slugs: Test if new products get a free slug, kept when imported again.
+      test_rejected_rows: Test if invalid rows are reported and the others imported.
+      test_field_limits: Test if values the model fields refuse reject their row.
+      test_invalid_numbers: Test if a price that is not a finite number or a negative stock rejects its row.
+      test_image_references: Test if imported images reference their blobs and release the replaced ones.
+      test_queries_per_batch: Test if a batch costs the same number of queries whatever its size.
+      test_caches_refreshed: Test if the search index and the cached listings see the imported products.
+  """
+  def setUp(self):
+    """
+      Set up environment for each test.
+
+      Creates a category with a product that has a size.
+    """
+    cache.clear()
+    self.category = Category.objects.create(category_name='Robes', slug='robes', gender='F', product_type='B')
+    self.product = Product.objects.create(
+      product_name='Robe lin', slug='robe-lin', price=50, stock=1, category=self.category, images='photos/products/robe.jpg',
+    )
+    self.size = Variation.objects.create(product=self.product, variation_category='size', variation_value='S')
+
+
+  def _feed(self, content, suffix):
+    feed = tempfile.NamedTemporaryFile('w', suffix=suffix, delete=False, encoding='utf-8')
+    feed.write(content)
+    feed.close()
+    self.addCleanup(os.remove, feed.name)
+    return feed.name
+
+
+  def _jsonl(self, rows):
+    return self._feed(''.join(json.dumps(row) + '\n' for row in rows), '.jsonl')
+
+
+  def test_import_csv(self):
+    """
+      Test if a CSV feed creates the categories, the products and their variations.
+    """
+    path = self._feed(
+      'product_name,category,gender,product_type,price,stock,sizes,colors\n'
+      'Chemise oxford,Chemises,H,A,45.5,3,S|M|L,Blue\n'
+      'Chemise lin,Chemises,H,A,39,0,M,\n',
+      '.csv',
+    )
+    out = StringIO()
+    call_command('import_catalog', path, stdout=out)
+    self.assertIn('Imported 2 rows', out.getvalue())
+    category = Category.objects.get(category_name='Chemises')
+    self.assertEqual((category.slug, category.gender, category.product_type), ('chemises', 'H', 'A'))
+    product = Product.objects.get(product_name='Chemise oxford')
+    self.assertEqual((product.slug, product.title_online, product.price, product.stock), ('chemise-oxford', 'Chemise oxford', 45.5, 3))
+    self.assertEqual(product.category, category)
+    self.assertEqual(sorted(Variation.objects.sizes().filter(product=product).values_list('variation_value', flat=True)), ['L', 'M', 'S'])
+    self.assertEqual(list(Variation.objects.colors().filter(product=product).values_list('variation_value', flat=True)), ['Blue'])
+
+
+  def test_import_jsonl_updates(self):
+    """
+      Test if a JSON Lines feed updates the existing products and skips unchanged ones.
+    """
+    path = self._jsonl([
+      {'product_name': 'Robe lin', 'category': 'Robes', 'price': 60, 'is_available': False},
+      {'product_name': 'Robe soie', 'category': 'Robes', 'price': 90},
+    ])
+    importer = CatalogImporter()
+    stats = importer.run(read_rows(path))
+    self.assertEqual((stats['products_created'], stats['products_updated']), (1, 1))
+    self.product.refresh_from_db()
+    self.assertEqual((self.product.price, self.product.is_available, self.product.stock), (60, False, 1))
+    stats = CatalogImporter().run(read_rows(path))
+    self.assertEqual((stats['products_created'], stats['products_updated'], stats['products_unchanged']), (0, 0, 2))
+
+
+  def test_variations_synchronized(self):
+    """
+      Test if listed variations are reactivated and the missing ones deactivated.
+    """
+    Variation.objects.create(product=self.product, variation_category='color', variation_value='Red')
+    self.size.is_active = False
+    self.size.save()
+    CatalogImporter().run(read_rows(self._jsonl([{'product_name': 'Robe lin', 'category': 'Robes', 'sizes': ['S', 'M']}])))
+    self.assertEqual(sorted(Variation.objects.sizes().filter(product=self.product).values_list('variation_value', flat=True)), ['M', 'S'])
+    # Colors were not listed, so they are kept
+    self.assertEqual(Variation.objects.colors().filter(product=self.product).count(), 1)
+    CatalogImporter().run(read_rows(self._jsonl([{'product_name': 'Robe lin', 'category': 'Robes', 'sizes': ['M']}])))
+    self.assertFalse(Variation.objects.get(pk=self.size.pk).is_active)
+
+
+  def test_unique_slugs(self):
+    """
+      Test if new products get a free slug, kept when imported again.
+    """
+    path = self._jsonl([
+      {'product_name': 'Robe  lin', 'category': 'Robes'},
+      {'product_name': 'Robe-lin', 'category': 'Robes'},
+      {'product_name': 'Robe courte', 'category': 'Robes', 'slug': 'robe-lin'},
+    ])
+    CatalogImporter(batch_size=1).run(read_rows(path))
+    slugs = dict(Product.objects.values_list('product_name', 'slug'))
+    self.assertEqual(slugs['Robe  lin'], 'robe-lin-2')
+    self.assertEqual(slugs['Robe-lin'], 'robe-lin-3')
+    self.assertEqual(slugs['Robe courte'], 'robe-lin-4')
+    stats = CatalogImporter().run(read_rows(path))
+    self.assertEqual((stats['products_updated'], stats['products_unchanged']), (0, 3))
+    self.assertEqual(Product.objects.get(product_name='Robe courte').slug, 'robe-lin-4')
+
+
+  def test_rejected_rows(self):
+    """
+      Test if invalid rows are reported and the others imported.
+    """
+    path = self._feed(
+      '{"product_name": "Robe soie", "category": "Robes"}\n'
+      'not json\n'
+      '{"product_name": "Robe verte"}\n'
+      '{"product_name": "Robe bleue", "category": "Robes", "price": "cheap"}\n',
+      '.jsonl',
+    )
+    out, err = StringIO(), StringIO()
+    call_command('import_catalog', path, stdout=out, stderr=err)
+    self.assertIn('Imported 1 rows', out.getvalue())
+    self.assertIn('3 rejected', out.getvalue())
+    self.assertIn('Line 3: product_name and category are required.', err.getvalue())
+    self.assertIn("Line 4: Invalid price: 'cheap'.", err.getvalue())
+    self.assertTrue(Product.objects.filter(product_name='Robe soie').exists())
+    with self.assertRaises(CommandError):
+      call_command('import_catalog', '/nonexistent/feed.csv', stdout=StringIO())
+
+
+  def test_field_limits(self):
+    """
+      Test if values the model fields refuse reject their row.
+    """
+    rows = [
+      {'product_name': 'Robe soie', 'category': 'Robes'},
+      {'product_name': 'R' * 201, 'category': 'Robes'},
+      {'product_name': 'Robe rose', 'category': 'C' * 51},
+      {'product_name': 'Robe rose', 'category': 'Robes', 'description': 'D' * 501},
+      {'product_name': 'Robe rose', 'category': 'Robes', 'gender': 'FF'},
+      {'product_name': 'Robe rose', 'category': 'Robes', 'product_type': 'Z'},
+      {'product_name': 'Robe rose', 'category': 'Robes', 'sizes': ['S' * 101]},
+    ]
+    out, err = StringIO(), StringIO()
+    call_command('import_catalog', self._jsonl(rows), stdout=out, stderr=err)
+    self.assertIn('Imported 1 rows', out.getvalue())
+    self.assertIn('6 rejected', out.getvalue())
+    self.assertIn('Line 2: product_name is longer than 200 characters.', err.getvalue())
+    self.assertIn("Line 6: Invalid product_type: 'Z'.", err.getvalue())
+    self.assertFalse(Product.objects.filter(product_name='Robe rose').exists())
+
+
+  def test_invalid_numbers(self):
+    """
+      Test if a price that is not a finite number or a negative stock rejects its row.
+    """
+    path = self._feed(
+      '{"product_name": "Robe rose", "category": "Robes", "price": NaN}\n'
+      '{"product_name": "Robe rose", "category": "Robes", "price": "inf"}\n'
+      '{"product_name": "Robe rose", "category": "Robes", "stock": -2}\n'
+      '{"product_name": "Robe soie", "category": "Robes", "price": 90, "stock": 0}\n',
+      '.jsonl',
+    )
+    out, err = StringIO(), StringIO()
+    call_command('import_catalog', path, stdout=out, stderr=err)
+    self.assertIn('Imported 1 rows', out.getvalue())
+    self.assertIn('Line 1: Invalid price: nan.', err.getvalue())
+    self.assertIn("Line 2: Invalid price: 'inf'.", err.getvalue())
+    self.assertIn('Line 3: The stock cannot be negative.', err.getvalue())
+    self.assertFalse(Product.objects.filter(product_name='Robe rose').exists())
+
+
+  def test_image_references(self):
+    """
+      Test if imported images reference their blobs and release the replaced ones.
+    """
+    first = MediaBlob.objects.create(digest='a' * 64, name='blobs/aa/first.jpg', size=1)
+    second = MediaBlob.objects.create(digest='b' * 64, name='blobs/bb/second.jpg', size=1)
+    CatalogImporter().run(read_rows(self._jsonl([
+      {'product_name': 'Robe lin', 'category': 'Robes', 'images': first.name},
+      {'product_name': 'Robe soie', 'category': 'Robes', 'images': first.name},
+      {'product_name': 'Robe verte', 'category': 'Robes', 'images': second.name},
+    ])))
+    self.assertEqual(MediaBlob.objects.get(pk=first.pk).references, 2)
+    self.assertEqual(MediaBlob.objects.get(pk=second.pk).references, 1)
+    with self.captureOnCommitCallbacks(execute=True):
+      CatalogImporter().run(read_rows(self._jsonl([
+        {'product_name': 'Robe lin', 'category': 'Robes', 'images': second.name, 'price': 55},
+        {'product_name': 'Robe verte', 'category': 'Robes', 'images': second.name, 'price': 70},
+      ])))
+    self.assertEqual(MediaBlob.objects.get(pk=first.pk).references, 1)
+    self.assertEqual(MediaBlob.objects.get(pk=second.pk).references, 2)
+
+
+  def test_queries_per_batch(self):
+    """
+      Test if a batch costs the same number of queries whatever its size.
+    """
+    def queries(count, offset):
+      rows = [
+        {'product_name': 'Robe %d' % (offset + number), 'category': 'Robes', 'sizes': ['S', 'M'], 'price': number}
+        for number in range(count)
+      ]
+      importer = CatalogImporter(batch_size=count)
+      with CaptureQueriesContext(connection) as captured:
+        importer.run(enumerate(rows))
+      return len(captured)
+    self.assertEqual(queries(2, 0), queries(40, 100))
+
+
+  def test_caches_refreshed(self):
+    """
+      Test if the search index and the cached listings see the imported products.
+    """
+    url = reverse('products_by_category', args=['robes'])
+    self.assertNotContains(self.client.get(url), 'Robe émeraude')
+    CatalogImporter().run(read_rows(self._jsonl([
+      {'product_name': 'Robe émeraude', 'title_online': 'Robe émeraude', 'category': 'Robes', 'images': 'photos/products/x.jpg'},
+    ])))
+    product = Product.objects.get(product_name='Robe émeraude')
+    self.assertEqual(get_backend().search('émeraude'), [product.id])
+    self.assertContains(self.client.get(url), 'Robe émeraude')
+
+
+class ProductFeedTest(TestCase):
+  """
+    Test class for the streaming product feeds.
+
+    Methods:
+      setUp: Set up environment for each test.
+      test_keyset_chunks: Test if the products are read one chunk at a time.
+      test_csv_endpoint: Test if the CSV feed is streamed with absolute links.
+      test_jsonl_endpoint: Test if the JSON Lines feed has one product per line.
+      test_xml_endpoint: Test if the XML feed is a Google Shopping RSS feed, without invalid characters.
+      test_unknown_format: Test if an unknown feed format is not found.
+      test_export_command: Test if the export_catalog command writes the feed.
+  """
+  def setUp(self):
+    """
+      Set up environment for each test.
+
+      Creates a category with five available products and an unavailable one.
+    """
+    cache.clear()
+    self.category = Category.objects.create(category_name='Sacs & co', slug='sacs')
+    self.products = [
+      Product.objects.create(
+        product_name='Sac %d' % number, title_online='Sac <%d>' % number, slug='sac-%d' % number, price=10 + number,
+        stock=number, category=self.category, images='photos/products/sac-%d.jpg' % number,
+      )
+      for number in range(5)
+    ]
+    Product.objects.create(product_name='Sac retiré', slug='sac-retire', category=self.category, is_available=False)
+
+
+  def test_keyset_chunks(self):
+    """
+      Test if the products are read one chunk at a time.
+    """
+    with CaptureQueriesContext(connection) as queries:
+      rows = list(iter_feed_products(chunk_size=2))
+    self.assertEqual([row['id'] for row in rows], [product.id for product in self.products])
+    self.assertEqual(len(queries), 3)
+    self.assertTrue(all('LIMIT 2' in query['sql'] and 'category' in query['sql'] for query in queries))
+    self.assertEqual(len(list(iter_feed_products(available_only=False))), 6)
+
+
+  def test_csv_endpoint(self):
+    """
+      Test if the CSV feed is streamed with absolute links.
+    """
+    response = self.client.get(reverse('product_feed', args=['csv']))
+    self.assertTrue(response.streaming)
+    self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+    rows = list(csv.DictReader(b''.join(response.streaming_content).decode('utf-8').splitlines()))
+    self.assertEqual(len(rows), 5)
+    self.assertEqual(rows[1]['title'], 'Sac <1>')
+    self.assertEqual(rows[1]['link'], 'http://testserver' + self.products[1].get_url())
+    self.assertEqual(rows[1]['image_link'], 'http://testserver/media/photos/products/sac-1.jpg')
+    self.assertEqual(rows[1]['price'], '11.00 EUR')
+    self.assertEqual(rows[0]['availability'], 'out of stock')
+    self.assertEqual(rows[1]['availability'], 'in stock')
+    self.assertEqual(rows[1]['product_type'], 'Sacs & co')
+
+
+  def test_jsonl_endpoint(self):
+    """
+      Test if the JSON Lines feed has one product per line.
+    """
+    response = self.client.get(reverse('product_feed', args=['jsonl']))
+    lines = b''.join(response.streaming_content).decode('utf-8').splitlines()
+    self.assertEqual([json.loads(line)['id'] for line in lines], [product.id for product in self.products])
+
+
+  def test_xml_endpoint(self):
+    """
+      Test if the XML feed is a Google Shopping RSS feed, without invalid characters.
+    """
+    response = self.client.get(reverse('product_feed', args=['xml']))
+    root = ElementTree.fromstring(b''.join(response.streaming_content))
+    items = root.findall('channel/item')
+    self.assertEqual(len(items), 5)
+    namespace = '{http://base.google.com/ns/1.0}'
+    self.assertEqual(items[2].find(namespace + 'id').text, str(self.products[2].id))
+    self.assertEqual(items[2].find('title').text, 'Sac <2>')
+    self.assertEqual(items[2].find(namespace + 'price').text, '12.00 EUR')
+    self.assertEqual(items[2].find(namespace + 'product_type').text, 'Sacs & co')
+    Product.objects.filter(pk=self.products[2].pk).update(description='Cuir\x0b souple\x00\n\tcousu')
+    root = ElementTree.fromstring(b''.join(self.client.get(reverse('product_feed', args=['xml'])).streaming_content))
+    self.assertEqual(root.findall('channel/item')[2].find('description').text, 'Cuir souple\n\tcousu')
+
+
+  def test_unknown_format(self):
+    """
+      Test if an unknown feed format is not found.
+    """
+    self.assertEqual(self.client.get(reverse('product_feed', args=['pdf'])).status_code, 404)
+
+
+  def test_export_command(self):
+    """
+      Test if the export_catalog command writes the feed.
+    """
+    out = StringIO()
+    call_command('export_catalog', format='jsonl', base_url='https://shop.example/', all=True, stdout=out)
+    lines = out.getvalue().splitlines()
+    self.assertEqual(len(lines), 6)
+    self.assertTrue(json.loads(lines[0])['link'].startswith('https://shop.example/store/category/sacs/'))
+    path = os.path.join(tempfile.mkdtemp(), 'feed.xml')
+    self.addCleanup(os.remove, path)
+    call_command('export_catalog', format='xml', output=path, chunk_size=2, stdout=StringIO(), stderr=StringIO())
+    self.assertEqual(len(ElementTree.parse(path).findall('channel/item')), 5)
+
+
+class CatalogAdminTest(TestCase):
+  """
+    Test class for the product and variation admin on large catalogs.
+
+    Methods:
+      setUp: Set up environment for each test.
+      test_changelist_queries_constant: Test if the changelists run the same queries whatever the number of rows.
+      test_variation_filters: Test if the variation filters do not list the products.
+      test_estimated_count: Test if unfiltered changelists use the table estimate and filtered ones count.
+      test_adjust_price: Test if the prices are adjusted with one UPDATE and the cached pages invalidated.
+      test_adjust_price_requires_percent: Test if adjusting without percentage changes nothing.
+      test_mark_unavailable: Test if only the selected products out of stock are marked unavailable.
+      test_variation_actions: Test if variations are activated and deactivated with one UPDATE.
+  """
+  def setUp(self):
+    """
+      Set up environment for each test.
+
+      Creates a superuser, two categories and products with a variation each.
+    """
+    cache.clear()
+    self.user = Account.objects.create_superuser(
+      first_name='Ad', last_name='Min', email='admin@example.com', username='admin', password='secret',
+    )
+    self.client.force_login(self.user)
+    self.categories = [
+      Category.objects.create(category_name='Admin %d' % number, slug='admin-%d' % number) for number in range(2)
+    ]
+    self.products = []
+    for number in range(4):
+      self._product(number)
+
+
+  def _product(self, number):
+    product = Product.objects.create(
+      product_name='Admin product %d' % number, slug='admin-product-%d' % number, price=10 * (number + 1),
+      stock=number % 2, category=self.categories[number % 2], images='photos/products/admin.jpg',
+    )
+    Variation.objects.create(product=product, variation_category='size', variation_value='S%d' % number)
+    self.products.append(product)
+    return product
+
+
+  def _queries(self, url):
+    with CaptureQueriesContext(connection) as queries:
+      self.assertEqual(self.client.get(url).status_code, 200)
+    return len(queries)
+
+
+  def _action(self, model, action, objects, **data):
+    url = reverse('admin:store_%s_changelist' % model)
+    data.update({'action': action, '_selected_action': [obj.pk for obj in objects], 'index': 0})
+    return self.client.post(url, data, follow=True)
+
+
+  def test_changelist_queries_constant(self):
+    """
+      Test if the changelists run the same queries whatever the number of rows.
+    """
+    urls = [reverse('admin:store_product_changelist'), reverse('admin:store_variation_changelist')]
+    # The first page loads the in-process category tree of the menu
+    self.client.get(urls[0])
+    before = [self._queries(url) for url in urls]
+    for number in range(4, 10):
+      self._product(number)
+    self.assertEqual([self._queries(url) for url in urls], before)
+
+
+  def test_variation_filters(self):
+    """
+      Test if the variation filters do not list the products.
+    """
+    response = self.client.get(reverse('admin:store_variation_changelist'))
+    self.assertEqual([spec.title for spec in response.context['cl'].filter_specs], ['variation category', 'is active'])
+    response = self.client.get(reverse('admin:store_variation_changelist'), {'q': 'product 2'})
+    self.assertEqual(list(response.context['cl'].result_list), list(Variation.objects.filter(product=self.products[2])))
+
+
+  def test_estimated_count(self):
+    """
+      Test if unfiltered changelists use the table estimate and filtered ones count.
+    """
+    self.assertIsNone(estimated_count(Product))
+    products = Product.objects.order_by('id')
+    with mock.patch('store.pagination.estimated_count', return_value=250000):
+      self.assertEqual(EstimatedCountPaginator(products, 100).count, 250000)
+      self.assertEqual(EstimatedCountPaginator(products.filter(stock=0), 100).count, 2)
+      response = self.client.get(reverse('admin:store_product_changelist'))
+      self.assertEqual(response.context['cl'].result_count, 250000)
+    with mock.patch('store.pagination.estimated_count', return_value=50):
+      self.assertEqual(EstimatedCountPaginator(products, 100).count, 4)
+
+
+  def test_adjust_price(self):
+    """
+      Test if the prices are adjusted with one UPDATE and the cached pages invalidated.
+    """
+    url = self.products[0].get_url()
+    self.client.get(url)
+    with CaptureQueriesContext(connection) as queries:
+      response = self._action('product', 'adjust_price', self.products[:3], percent='-12.5')
+    self.assertContains(response, '3 product(s) repriced.')
+    self.assertEqual(len([query for query in queries if query['sql'].startswith('UPDATE "store_product"')]), 1)
+    prices = list(Product.objects.order_by('id').values_list('price', flat=True))
+    self.assertEqual(prices, [8.75, 17.5, 26.25, 40])
+    self.assertContains(self.client.get(url), '8.75')
+
+
+  def test_adjust_price_requires_percent(self):
+    """
+      Test if adjusting without percentage changes nothing.
+    """
+    response = self._action('product', 'adjust_price', self.products, percent='')
+    self.assertContains(response, 'Enter the percentage of the price change.')
+    response = self._action('product', 'adjust_price', self.products, percent='-150')
+    self.assertContains(response, 'A price cannot decrease by more than 100%.')
+    self.assertEqual(list(Product.objects.order_by('id').values_list('price', flat=True)), [10, 20, 30, 40])
+
+
+  def test_mark_unavailable(self):
+    """
+      Test if only the selected products out of stock are marked unavailable.
+    """
+    response = self._action('product', 'mark_unavailable_when_out_of_stock', self.products[:3])
+    self.assertContains(response, '2 product(s) marked unavailable.')
+    available = dict(Product.objects.values_list('product_name', 'is_available'))
+    self.assertEqual([available[product.product_name] for product in self.products], [False, True, False, True])
+    self.assertEqual(facet_index.count(category_id=self.categories[0].id), 0)
+
+
+  def test_variation_actions(self):
+    """
+      Test if variations are activated and deactivated with one UPDATE.
+    """
+    variations = list(Variation.objects.order_by('id'))
+    with CaptureQueriesContext(connection) as queries:
+      response = self._action('variation', 'deactivate_variations', variations[:2])
+    self.assertContains(response, '2 variation(s) deactivated.')
+    self.assertEqual(len([query for query in queries if query['sql'].startswith('UPDATE "store_variation"')]), 1)
+    self.assertEqual(Variation.objects.filter(is_active=False).count(), 2)
+    self._action('variation', 'activate_variations', variations)
+    self.assertEqual(Variation.objects.filter(is_active=False).count(), 0)
+
+
+class ResponsiveImageTest(TestCase):
+  """
+    Test class for the image derivatives and their srcset.
+
+    Methods:
+      setUp: Set up environment for each test.
+      test_generate_derivatives: Test if every width gets a WebP and a JPEG, never enlarged.
+      test_existing_derivatives_skipped: Test if existing derivatives are only regenerated when forced.
+      test_tag_disabled: Test if the original is rendered alone when the derivatives are disabled.
+      test_tag_enabled: Test if the srcset of the derivatives is rendered when they are enabled, once they exist.
+      test_broken_pool_replaced: Test if a pool broken by a dead worker is replaced.
+      test_signal_generates_on_upload: Test if saving a product generates the derivatives of its images.
+      test_backfill_command: Test if the command generates the derivatives of every image in a process pool.
+  """
+  def setUp(self):
+    """
+      Set up environment for each test.
+
+      Stores a 1200px wide product image and a transparent 200px category image in a temporary media directory,
+      as files uploaded before the content-addressed storage.
+    """
+    cache.clear()
+    media_root = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, media_root)
+    media = override_settings(MEDIA_ROOT=media_root, IMAGE_DERIVATIVE_WIDTHS=(160, 320, 640), IMAGE_DERIVATIVE_WORKERS=0)
+    media.enable()
+    self.addCleanup(media.disable)
+    self.product_image = self._store('photos/products/robe.jpg', Image.new('RGB', (1200, 800), (200, 30, 30)), 'JPEG')
+    self.category_image = self._store('photos/categories/robes.png', Image.new('RGBA', (200, 100), (0, 0, 0, 0)), 'PNG')
+    self.category = Category.objects.create(category_name='Robes', slug='robes', cat_image=self.category_image)
+    self.product = Product.objects.create(
+      product_name='Robe', title_online='Robe', slug='robe', price=50, stock=3,
+      category=self.category, images=self.product_image,
+    )
+
+
+  def _store(self, name, image, image_format):
+    buffer = BytesIO()
+    image.save(buffer, image_format)
+    return FileSystemStorage().save(name, buffer)
+
+
+  def test_generate_derivatives(self):
+    """
+      Test if every width gets a WebP and a JPEG, never enlarged.
+    """
+    self.assertEqual(generate_derivatives(self.product_image), 6)
+    with default_storage.open(derivative_name(self.product_image, 320, 'webp')) as derivative:
+      self.assertEqual(Image.open(derivative).size, (320, 213))
+    self.assertEqual(generate_derivatives(self.category_image), 6)
+    with default_storage.open(derivative_name(self.category_image, 640, 'jpeg')) as derivative:
+      image = Image.open(derivative)
+      self.assertEqual((image.size, image.mode), ((200, 100), 'RGB'))
+      self.assertEqual(image.getpixel((0, 0)), (255, 255, 255))
+
+
+  def test_existing_derivatives_skipped(self):
+    """
+      Test if existing derivatives are only regenerated when forced.
+    """
+    generate_derivatives(self.product_image)
+    self.assertEqual(generate_derivatives(self.product_image), 0)
+    self.assertEqual(generate_derivatives(self.product_image, force=True), 6)
+    self.assertFalse(default_storage.exists('photos/products/robe.640w_1.webp'))
+    self.assertEqual(list(image_names()), [self.product_image, self.category_image])
+
+
+  def test_tag_disabled(self):
+    """
+      Test if the original is rendered alone when the derivatives are disabled.
+    """
+    self.client.post(reverse('add_cart', args=[self.product.id]))
+    response = self.client.get(reverse('cart'))
+    self.assertContains(response, '<img class="product-img" src="/media/photos/products/robe.jpg" alt="product image">', html=True)
+    self.assertNotContains(response, 'srcset')
+
+
+  @override_settings(IMAGE_DERIVATIVES=True)
+  def test_tag_enabled(self):
+    """
+      Test if the srcset of the derivatives is rendered when they are enabled, once they exist.
+    """
+    response = self.client.get(reverse('store'))
+    self.assertContains(response, '<img src="/media/photos/products/robe.jpg" alt="Front garment">', html=True)
+    self.assertNotContains(response, 'srcset')
+    generate_derivatives(self.product_image)
+    # Missing derivatives are remembered for a minute
+    self.assertNotContains(self.client.get(reverse('store')), 'srcset')
+    cache.clear()
+    response = self.client.get(reverse('store'))
+    self.assertContains(
+      response,
+      '<source type="image/webp" srcset="/media/photos/products/robe.160w.webp 160w, '
+      '/media/photos/products/robe.320w.webp 320w, /media/photos/products/robe.640w.webp 640w" '
+      'sizes="(max-width: 768px) 50vw, 25vw">',
+    )
+    self.assertContains(response, 'src="/media/photos/products/robe.jpg" srcset="/media/photos/products/robe.160w.jpg 160w, ')
+
+
+  @override_settings(IMAGE_DERIVATIVES=True, IMAGE_DERIVATIVE_WORKERS=2)
+  def test_broken_pool_replaced(self):
+    """
+      Test if a pool broken by a dead worker is replaced.
+    """
+    broken = mock.Mock()
+    broken.submit.side_effect = BrokenProcessPool('A child process terminated abruptly.')
+    with mock.patch('store.images._executor', broken), mock.patch('store.images.ProcessPoolExecutor') as pool:
+      schedule_derivatives([self.product_image])
+      self.assertIs(images._executor, pool.return_value)
+    broken.shutdown.assert_called_once_with(wait=False)
+    pool.return_value.submit.assert_called_once_with(images._generate, self.product_image)
+
+
+  @override_settings(IMAGE_DERIVATIVES=True)
+  def test_signal_generates_on_upload(self):
+    """
+      Test if saving a product generates the derivatives of its images.
+    """
+    with self.captureOnCommitCallbacks(execute=True):
+      self.product.second_image = self._store('photos/products/robe-dos.jpg', Image.new('RGB', (500, 500)), 'JPEG')
+      self.product.save()
+    self.assertTrue(default_storage.exists('photos/products/robe-dos.320w.webp'))
+    self.assertTrue(default_storage.exists('photos/products/robe.640w.jpg'))
+    self.assertFalse(default_storage.exists('photos/categories/robes.160w.webp'))
+
+
+  def test_backfill_command(self):
+    """
+      Test if the command generates the derivatives of every image in a process pool.
+    """
+    Product.objects.create(product_name='Robe cassée', slug='robe-cassee', category=self.category, images='photos/products/absente.jpg')
+    output, errors = StringIO(), StringIO()
+    call_command('generate_image_derivatives', '--processes=2', stdout=output, stderr=errors)
+    self.assertIn('Processed 3 images', output.getvalue())
+    self.assertIn('12 derivatives written, 1 errors', output.getvalue())
+    self.assertIn('photos/products/absente.jpg', errors.getvalue())
+    self.assertTrue(default_storage.exists('photos/categories/robes.160w.jpg'))
+    results = list(generate_in_pool(image_names(), processes=0))
+    self.assertEqual([count for name, count, error in results], [0, 0, 0])
+    with self.assertRaises(CommandError):
+      call_command('generate_image_derivatives', '--batch-size=0')
+
+
+class ContentAddressedStorageTest(TestCase):
+  """
+    Test class for the content-addressed media storage and the deduplication of the existing files.
+
+    Methods:
+      setUp: Set up environment for each test.
+      test_duplicate_upload: Test if uploading the same content twice stores one blob.
+      test_delete_releases_reference: Test if a blob file is only removed with the last field referencing it.
+      test_model_upload: Test if an image uploaded through a model is stored as a blob, counted once per field.
+      test_replaced_image_released: Test if replacing or clearing an image releases its blob.
+      test_removed_blob_stored_again: Test if content saved again after its blob was removed is written again.
+      test_deduplicate_command: Test if the command moves duplicates to one blob and rewrites the image paths.
+      test_deduplicate_dry_run: Test if a dry run changes nothing.
+      test_references_counted_after_rewrite: Test if a blob referenced during the deduplication keeps that reference.
+  """
+  def setUp(self):
+    """
+      Set up environment for each test.
+
+      Stores three copies of the same category image and another image in a temporary media directory, as
+      files uploaded before the content-addressed storage, referenced by two categories and a product.
+    """
+    cache.clear()
+    media_root = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, media_root)
+    media = override_settings(MEDIA_ROOT=media_root, IMAGE_DERIVATIVE_WIDTHS=(160,))
+    media.enable()
+    self.addCleanup(media.disable)
+    legacy = FileSystemStorage()
+    self.shoes = [legacy.save(name, ContentFile(b'shoes')) for name in ('photos/categories/shoes.png', 'photos/categories/shoes_8g4Qc58.png', 'photos/categories/shoes_8g4Qc58_L4ZEKYt.png')]
+    self.jeans = legacy.save('photos/categories/jeans.jpg', ContentFile(b'jeans'))
+    legacy.save('photos/categories/shoes.160w.webp', ContentFile(b'small shoes'))
+    self.categories = [
+      Category.objects.create(category_name='Chaussures', slug='chaussures', cat_image=self.shoes[0]),
+      Category.objects.create(category_name='Jeans', slug='jeans', cat_image=self.jeans),
+    ]
+    self.product = Product.objects.create(
+      product_name='Basket', slug='basket', category=self.categories[0], images=self.shoes[1], second_image=self.shoes[2],
+    )
+
+
+  def test_duplicate_upload(self):
+    """
+      Test if uploading the same content twice stores one blob.
+    """
+    first = default_storage.save('photos/categories/Sac.PNG', ContentFile(b'sac'))
+    second = default_storage.save('photos/products/sac.png', ContentFile(b'sac'))
+    self.assertEqual(first, second)
+    self.assertRegex(first, r'^blobs/[0-9a-f]{2}/[0-9a-f]{64}\.png$')
+    blob = MediaBlob.objects.get(name=first)
+    self.assertEqual((blob.size, blob.references), (3, 0))
+    self.assertEqual(default_storage.listdir(os.path.dirname(first))[1], [os.path.basename(first)])
+
+
+  def test_delete_releases_reference(self):
+    """
+      Test if a blob file is only removed with the last field referencing it.
+    """
+    name = default_storage.save('sac.png', ContentFile(b'sac'))
+    self.product.third_image = self.categories[1].cat_image = name
+    self.product.save()
+    self.categories[1].save()
+    with self.captureOnCommitCallbacks(execute=True):
+      default_storage.delete(name)
+      self.product.delete()
+    self.assertTrue(default_storage.exists(name))
+    self.assertEqual(MediaBlob.objects.get(name=name).references, 1)
+    with self.captureOnCommitCallbacks(execute=True):
+      self.categories[1].delete()
+    self.assertFalse(default_storage.exists(name))
+    self.assertFalse(MediaBlob.objects.exists())
+
+
+  def test_model_upload(self):
+    """
+      Test if an image uploaded through a model is stored as a blob, counted once per field.
+    """
+    self.product.third_image.save('basket.png', ContentFile(b'basket'))
+    self.product.refresh_from_db()
+    self.assertTrue(self.product.third_image.name.startswith('blobs/'))
+    self.assertEqual(self.product.third_image.read(), b'basket')
+    self.product.third_image = ContentFile(b'basket', name='basket.png')
+    self.product.fourth_image.save('basket.png', ContentFile(b'basket'))
+    self.assertEqual(MediaBlob.objects.get(name=self.product.third_image.name).references, 2)
+
+
+  def test_replaced_image_released(self):
+    """
+      Test if replacing or clearing an image releases its blob.
+    """
+    self.product.third_image.save('basket.png', ContentFile(b'basket'))
+    basket = self.product.third_image.name
+    with self.captureOnCommitCallbacks(execute=True):
+      self.product.third_image.save('sac.png', ContentFile(b'sac'))
+    self.assertFalse(default_storage.exists(basket))
+    self.assertFalse(MediaBlob.objects.filter(name=basket).exists())
+    sac = self.product.third_image.name
+    with self.captureOnCommitCallbacks(execute=True):
+      self.product.third_image = None
+      self.product.save()
+    self.assertFalse(default_storage.exists(sac))
+    self.assertFalse(MediaBlob.objects.exists())
+    self.assertTrue(default_storage.exists(self.shoes[1]))
+
+
+  def test_removed_blob_stored_again(self):
+    """
+      Test if content saved again after its blob was removed is written again.
+    """
+    name = default_storage.save('sac.png', ContentFile(b'sac'))
+    with self.captureOnCommitCallbacks() as callbacks:
+      default_storage.delete(name)
+    self.assertEqual(default_storage.save('sac.png', ContentFile(b'sac')), name)
+    Category.objects.create(category_name='Sacs', slug='sacs', cat_image=name)
+    for callback in callbacks:
+      callback()
+    self.assertTrue(default_storage.exists(name))
+    self.assertEqual(MediaBlob.objects.get(name=name).references, 1)
+
+
+  def test_deduplicate_command(self):
+    """
+      Test if the command moves duplicates to one blob and rewrites the image paths.
+    """
+    output = StringIO()
+    call_command('deduplicate_media', stdout=output)
+    self.assertIn('4 files, 2 new blobs, 10 bytes of duplicates.', output.getvalue())
+    self.assertIn('Rewrote 1 products and 2 categories, deleted 4 files.', output.getvalue())
+    self.product.refresh_from_db()
+    shoes = Category.objects.get(slug='chaussures').cat_image.name
+    self.assertEqual(self.product.images.name, shoes)
+    self.assertEqual(self.product.second_image.name, shoes)
+    self.assertEqual(MediaBlob.objects.get(name=shoes).references, 3)
+    self.assertEqual(MediaBlob.objects.get(name=Category.objects.get(slug='jeans').cat_image.name).references, 1)
+    self.assertEqual(default_storage.listdir('photos/categories'), ([], []))
+    with default_storage.open(shoes.replace('.png', '.160w.webp')) as derivative:
+      self.assertEqual(derivative.read(), b'small shoes')
+    output = StringIO()
+    call_command('deduplicate_media', stdout=output)
+    self.assertIn('0 files, 0 new blobs', output.getvalue())
+
+
+  def test_deduplicate_dry_run(self):
+    """
+      Test if a dry run changes nothing.
+    """
+    output = StringIO()
+    call_command('deduplicate_media', '--dry-run', stdout=output)
+    self.assertIn('4 files, 2 new blobs, 10 bytes of duplicates.', output.getvalue())
+    self.assertNotIn('Rewrote', output.getvalue())
+    self.assertFalse(MediaBlob.objects.exists())
+    self.assertEqual(Category.objects.get(slug='chaussures').cat_image.name, self.shoes[0])
+    self.assertEqual(len(default_storage.listdir('photos/categories')[1]), 5)
+
+
+  def test_references_counted_after_rewrite(self):
+    """
+      Test if a blob referenced during the deduplication keeps that reference.
+    """
+    def save_product(deduplicator, renamed):
+      Product.objects.create(product_name='Jean', slug='jean', category=self.categories[1], images=renamed[self.jeans])
+    with mock.patch.object(MediaDeduplicator, 'copy_derivatives', autospec=True, side_effect=save_product):
+      MediaDeduplicator().run()
+    jeans = Category.objects.get(slug='jeans').cat_image.name
+    self.assertEqual(MediaBlob.objects.get(name=jeans).references, 2)
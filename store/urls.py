@@ -8,4 +8,6 @@ urlpatterns = [
     path('category/<slug:category_slug>/', views.store, name='products_by_category'),
     path('category/<slug:category_slug>/<slug:product_slug>/', views.product_detail, name='product_detail'),
     path('search/', views.search, name='search'),
+    path('autocomplete/', views.autocomplete, name='autocomplete'),
+    path('feed/products.<str:feed_format>', views.feed, name='product_feed'),
 ]
@@ -1,17 +1,27 @@
 from django.shortcuts import render, get_object_or_404
 from .models import Product
+from .autocomplete import MAX_SUGGESTIONS, autocomplete_index
+from .cache import cached_view_data, listing_tags
+from .facets import GENDER_FILTERS, PRODUCT_TYPE_FILTERS, facet_index
+from .feeds import FEED_CONTENT_TYPES, product_feed
+from .loaders import load_product_bundle
+from .reservations import available_stock, reservations_enabled
+from .pagination import IdListPaginator, decode_id_cursor, pagination_links
+from .search import get_backend
 from category.models import Category
-from carts.views import _cart_id
-from carts.models import CartItem
-from django.db.models import Q
+from carts.storage import get_cart_storage
 from django.core.paginator import EmptyPage, PageNotAnInteger, Paginator
-from django.http import HttpResponse
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
 
 
 def store(request, category_slug=None):
     """
         View for displaying the main page of the store.
 
+        The matching product ids and their count come from the in-memory facets (see store.facets),
+        so only the products of the requested page are loaded from the database. The page is
+        cached until one of its products or categories changes (see store.cache.cached_view_data).
+
         Arguments:
         request -- HTTP request
         category_slug -- Category slug (default: None)
@@ -19,68 +29,67 @@ def store(request, category_slug=None):
         Returns:
         HTTP response with the rendering of the store page
     """
-    # Initializing the variables
-    categories = None
-    products = None
-    page_title = "Collection Complète"
-
-    # If a category slug is provided
+    # Unknown filter values are ignored, so that they cannot fill the cache with new keys
+    gender = request.GET.get('gender')
+    category = request.GET.get('category')
+    if category_slug is not None or gender not in GENDER_FILTERS:
+        gender = None
+    if category_slug is not None or category not in PRODUCT_TYPE_FILTERS:
+        category = None
+    # Pages are cached by the id of their cursor, which must be a product, so that made-up
+    # cursors cannot fill the cache with new keys either
+    cursor = request.GET.get('cursor') or None
+    anchor = decode_id_cursor(cursor) if cursor is not None else None
+    if cursor is not None and (anchor is None or not facet_index.is_available(anchor[0])):
+        raise Http404('Invalid page cursor.')
+    anchor_id = anchor[0] if anchor is not None else None
+
+    # If a category slug is provided, the page depends on this category only
     if category_slug is not None:
-        # Retrieve the corresponding category or raise a 404 error if it doesn't exist
-        categories = get_object_or_404(Category, slug=category_slug)
-        
-        # Filter the available products based on this category
-        products = Product.objects.filter(category=categories, is_available=True)
-
-        # Paginator for the store page with 9 items per page
-        paginator = Paginator(products, 9)
-        page = request.GET.get('page')
-        paged_products = paginator.get_page(page)
-        
-        # Count the number of available products in this category
-        product_count = products.count()
-        page_title = categories.category_name
+        tags = ['category:%s' % category_slug, 'listing:%s' % category_slug]
     else:
-        # If no category slug is provided, retrieve all available products
-        products = Product.objects.filter(is_available=True).order_by('id')
-
-        # Filter the products by gender (male or female) and by product type
-        gender = request.GET.get('gender')
-        category = request.GET.get('category')
-        if gender == 'men':
-            products = products.filter(category__gender='H')
-            page_title = "Collection Homme"
-        elif gender == 'women':
-            products = products.filter(category__gender='F')
-            page_title = "Collection Femme"
-        
-        if category == 'clothingMen':
-            products = products.filter(category__product_type='A')
-            page_title = "Vêtements Homme"
-        elif category == 'clothingWomen':
-            products = products.filter(category__product_type='B')
-            page_title = "Vêtements Femme"
-        elif category == 'clothingAccessMen':
-            products = products.filter(category__product_type='Y')
-            page_title = "Accessoires Homme"
-        elif category == 'clothingAccessWomen':
-            products = products.filter(category__product_type='X')
-            page_title = "Accessoires Femme"
-
-        # Pagination of the store with 9 items per page
-        paginator = Paginator(products, 9)
-        page = request.GET.get('page')
-        paged_products = paginator.get_page(page)
-
-        # Count the total number of available products
-        product_count = products.count()
+        tags = listing_tags(
+            GENDER_FILTERS.get(gender, (None,))[0],
+            PRODUCT_TYPE_FILTERS.get(category, (None,))[0],
+        )
+
+    def build():
+        # Initializing the variables
+        page_title = "Collection Complète"
+
+        # If a category slug is provided
+        if category_slug is not None:
+            # Retrieve the corresponding category or raise a 404 error if it doesn't exist
+            categories = get_object_or_404(Category, slug=category_slug)
+
+            # Ids of the available products of this category
+            product_ids = facet_index.product_ids(category_id=categories.id)
+            page_title = categories.category_name
+        else:
+            # Filter the available products by gender (male or female) and by product type
+            filter_gender = None
+            product_type = None
+            if gender is not None:
+                filter_gender, page_title = GENDER_FILTERS[gender]
+            if category is not None:
+                product_type, page_title = PRODUCT_TYPE_FILTERS[category]
+            product_ids = facet_index.product_ids(gender=filter_gender, product_type=product_type)
+
+        # Keyset pagination of the store with 9 items per page: every page costs the same as the first one
+        paginator = IdListPaginator(product_ids, 9)
+        paged_products = paginator.page(cursor)
+        products_by_id = Product.objects.select_related('category').in_bulk(paged_products.object_list)
+        paged_products.object_list = [products_by_id[pk] for pk in paged_products.object_list if pk in products_by_id]
+        return {
+            'products': paged_products,
+            'product_count': paginator.count,
+            'page_title': page_title,
+        }
+
+    data = cached_view_data('store', (category_slug, gender, category, anchor_id), tags, build)
 
     # Create the context with the products, the number of products, and the page title
-    context = {
-        'products': paged_products,
-        'product_count': product_count,
-        'page_title': page_title,
-    }
+    context = dict(data, pagination=pagination_links(request, data['products'], data['product_count']))
 
     # Render the store page with the created context
     return render(request, 'store/store.html', context)
@@ -90,18 +99,35 @@ def store(request, category_slug=None):
 def product_detail(request, category_slug, product_slug):
     """
         View to display the details of a specific product.
+
+        The product, its category and its active variations are loaded in one query as a
+        ProductBundle (see store.loaders), cached until the product, one of its variations
+        or its category changes; only the cart check runs on every request.
     """
     try:
         # Retrieve the specific product or raise an exception if it does not exist.
-        single_product = Product.objects.get(category__slug=category_slug, slug=product_slug)
-        in_cart = CartItem.objects.filter(cart__cart_id=_cart_id(request), product=single_product).exists()
+        bundle = cached_view_data(
+            'product_detail',
+            (category_slug, product_slug),
+            ['product:%s' % product_slug, 'category:%s' % category_slug],
+            lambda: load_product_bundle(category_slug, product_slug),
+        )
+        single_product = bundle.product
+        in_cart = get_cart_storage(request).contains(single_product.id)
+        # With reservations, the stock changes on every add to cart: read it live
+        stock = available_stock(single_product.id) if reservations_enabled() else single_product.stock
     except Exception as e:
         raise e
 
-    # Create the context with the product and category links.
+    # Create the context with the product, its variations and its images.
     context = {
         'single_product': single_product,
+        'sizes': bundle.sizes,
+        'colors': bundle.colors,
+        'main_image_url': bundle.main_image_url,
+        'thumbnail_urls': bundle.thumbnail_urls,
         'in_cart': in_cart,
+        'stock': stock,
     }
 
     # Render the product detail page with the created context.
@@ -109,17 +135,54 @@ def product_detail(request, category_slug, product_slug):
 
 
 def search(request):
-    # Check if the keyword is present in the GET request.
-    if 'keyword' in request.GET:
-        keyword = request.GET['keyword']
-        # Si le mot-clé n'est pas vide
-        if keyword:
-            products = Product.objects.order_by('-created_date').filter(Q(description__icontains=keyword) | Q(product_name__icontains=keyword))
-            # Count the total number of found products.
-            product_count = products.count()
+    """
+        View for the full-text product search.
+
+        The matching product ids are ranked by the configured search backend (see store.search),
+        then only the products of the requested page are loaded.
+    """
+    keyword = request.GET.get('keyword', '').strip()
+    # Ranked ids of the matching products, most relevant first.
+    product_ids = get_backend().search(keyword) if keyword else []
+
+    # Pagination of the results with 9 items per page
+    paginator = Paginator(product_ids, 9)
+    paged_products = paginator.get_page(request.GET.get('page'))
+    products_by_id = Product.objects.select_related('category').in_bulk(paged_products.object_list)
+    paged_products.object_list = [products_by_id[pk] for pk in paged_products.object_list if pk in products_by_id]
 
     context = {
-        'products': products,
-        'product_count': product_count,
+        'products': paged_products,
+        'product_count': paginator.count,
+        'pagination': pagination_links(request, paged_products),
     }
     return render(request, 'store/store.html', context)
+
+
+def autocomplete(request):
+    """
+        JSON typeahead for the navbar search: products and categories whose name starts with `q`.
+
+        Answered from the in-memory prefix index (see store.autocomplete), without database query.
+    """
+    try:
+        limit = min(max(int(request.GET.get('limit', 8)), 1), MAX_SUGGESTIONS)
+    except ValueError:
+        limit = 8
+    results = autocomplete_index.suggest(request.GET.get('q', ''), limit)
+    return JsonResponse({'results': results})
+
+
+def feed(request, feed_format):
+    """
+        Stream the product feed for marketplaces and price-comparison sites (CSV, JSON Lines or Google Shopping XML).
+
+        The feed is produced chunk by chunk as the response is sent (see store.feeds), so the
+        memory of the worker stays flat whatever the size of the catalog.
+    """
+    if feed_format not in FEED_CONTENT_TYPES:
+        raise Http404("Unknown feed format.")
+    chunks = product_feed(feed_format, request.build_absolute_uri('/'))
+    response = StreamingHttpResponse(chunks, content_type=FEED_CONTENT_TYPES[feed_format])
+    response['Content-Disposition'] = 'inline; filename="products.%s"' % feed_format
+    return response